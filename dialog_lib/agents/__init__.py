@@ -1,3 +1,19 @@
-from .abstract import *
-from .openai import DialogOpenAI
-from .anthropic import DialogAnthropic
\ No newline at end of file
+# Agents are only imported on first access: the base classes pull in the
+# database and embedding stack, provider agents their LangChain integration.
+_AGENTS = {
+    "AbstractLLM": ".abstract",
+    "AbstractLCEL": ".abstract",
+    "AbstractRAG": ".abstract",
+    "AbstractDialog": ".abstract",
+    "DialogOpenAI": ".openai",
+    "DialogLCELOpenAI": ".openai",
+    "DialogAnthropic": ".anthropic",
+}
+
+
+def __getattr__(name):
+    if name in _AGENTS:
+        from importlib import import_module
+
+        return getattr(import_module(_AGENTS[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
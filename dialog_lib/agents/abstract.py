@@ -1,4 +1,5 @@
 import warnings
+from functools import partial
 from operator import itemgetter
 
 from langchain.schema import format_document
@@ -8,13 +9,22 @@ from langchain.chains.llm import LLMChain
 from langchain.prompts.prompt import PromptTemplate
 from langchain.prompts.chat import ChatPromptTemplate
 from langchain.memory.chat_memory import BaseChatMemory
+from langchain_core.callbacks.manager import dispatch_custom_event
+from langchain_core.messages import AIMessage, HumanMessage
 from langchain_core.runnables import RunnablePassthrough, RunnableParallel, RunnableLambda
 from langchain_core.runnables.history import RunnableWithMessageHistory
 from langchain.chains.conversation.memory import ConversationBufferMemory
 
-from dialog_lib.db import get_session
+from dialog_lib.db import get_session, get_read_session
+from dialog_lib.db.bulk import psycopg_url
+from dialog_lib.db.session import get_database_url, get_shard, get_shard_router
+from dialog_lib.db.shards import DEFAULT_SHARD, check_dataset_name
 from dialog_lib.db.memory import CustomPostgresChatMessageHistory, get_memory_instance
+from dialog_lib.agents.hedging import HedgedModel
+from dialog_lib.agents.packing import count_tokens, pack_documents, packing_report
+from dialog_lib.coalescing import generation_flights, request_key
 from dialog_lib.embeddings.retrievers import DialogRetriever
+from dialog_lib.instrumentation import InstrumentationCallbackHandler, get_instrumentation
 
 
 class AbstractLLM:
@@ -26,6 +36,7 @@ class AbstractLLM:
         dataset=None,
         llm_api_key=None,
         dbsession=get_session,
+        read_dbsession=get_read_session,
     ):
         """
         :param config: Configuration dictionary
@@ -49,7 +60,25 @@ class AbstractLLM:
         self.dataset = dataset
         self.llm_api_key = self.config.get("llm_api_key", llm_api_key)
         self.parent_session_id = parent_session_id
+        if get_shard_router() is not None:
+            check_dataset_name(dataset)
+        # the default factories open sessions on the dataset's shard
+        if dbsession is get_session:
+            dbsession = partial(get_session, dataset)
+        if read_dbsession is get_read_session:
+            read_dbsession = partial(get_read_session, dataset)
         self.dbsession = dbsession
+        self.read_dbsession = read_dbsession
+
+    @property
+    def database_url(self):
+        """
+        The configured `database_url`, or the libpq URL of the dataset's
+        shard when it lives on another one (see `dialog_lib.db.shards`).
+        """
+        if get_shard(self.dataset) == DEFAULT_SHARD:
+            return self.config.get("database_url")
+        return psycopg_url(get_database_url(self.dataset))
 
     @property
     def memory(self) -> BaseChatMemory:
@@ -124,6 +153,17 @@ class AbstractLCEL(AbstractLLM):
         self.embedding_llm = kwargs.pop("embedding_llm")
         self.cosine_similarity_threshold = kwargs.pop("cosine_similarity_threshold", 0.3)
         self.top_k = kwargs.pop("top_k", 3)
+        self.retriever_kwargs = kwargs.pop("retriever_kwargs", {})
+        self.instrumentation = kwargs.pop("instrumentation", None) or get_instrumentation()
+        self.context_token_budget = kwargs.pop("context_token_budget", None)
+        self.token_counter = kwargs.pop("token_counter", count_tokens)
+        self.coalesce = kwargs.pop("coalesce", False)
+        self.coalesce_generation = kwargs.pop("coalesce_generation", False)
+        self.dispatcher = kwargs.pop("dispatcher", None)
+        self.backup_model = kwargs.pop("backup_model", None)
+        self.hedging = kwargs.pop("hedging", {})
+        self.direct_answer_distance = kwargs.pop("direct_answer_distance", None)
+        self.direct_answer_template = kwargs.pop("direct_answer_template", "{content}")
         super().__init__(*args, **kwargs)
 
     @property
@@ -132,24 +172,82 @@ class AbstractLCEL(AbstractLLM):
 
     @property
     def retriever(self):
-        with self.dbsession() as session:
+        with self.read_dbsession() as session:
             return DialogRetriever(
                 session=session,
                 embedding_llm=self.embedding_llm,
                 threshold=self.cosine_similarity_threshold,
-                top_k=self.top_k
+                top_k=self.top_k,
+                **{"coalesce": self.coalesce, **self.retriever_kwargs},
             )
 
     @property
     def model(self):
-        return self.chat_model
+        """
+        The chat model, holding its calls in the `dispatcher` queue (when set)
+        under this agent's dataset and session.
+        """
+        if self.dispatcher is None:
+            return self.chat_model
+        return self.chat_model.with_config(
+            callbacks=[self.dispatcher.callback(self.dataset, self.session_id)]
+        )
+
+    @property
+    def generation_model(self):
+        """
+        The chat model used by the answer chain. With a `backup_model`,
+        slow calls are hedged to it (see `HedgedModel`, configured by the
+        `hedging` kwargs). With `coalesce_generation`, concurrent calls with
+        the exact same prompt share one LLM call; each session still gets
+        its own history entries.
+        """
+        model = self.model
+        if self.backup_model is not None:
+            model = HedgedModel(model, self.backup_model, **self.hedging).as_runnable()
+        if not self.coalesce_generation:
+            return model
+
+        model_params = getattr(self.model, "_identifying_params", None) or repr(self.model)
+
+        def prompt_key(prompt):
+            messages = [(message.type, message.content) for message in prompt.to_messages()]
+            return request_key(model_params, messages)
+
+        def invoke(prompt, config):
+            return generation_flights.do(prompt_key(prompt), lambda: model.invoke(prompt, config))
+
+        async def ainvoke(prompt, config):
+            return await generation_flights.ado(prompt_key(prompt), lambda: model.ainvoke(prompt, config))
+
+        return RunnableLambda(invoke, afunc=ainvoke, name="CoalescedModel")
 
-    def combine_docs(self, docs, document_separator="\n\n"):
+    def combine_docs(self, docs, document_separator="\n\n", config=None):
         """
         This is the default combine_documents function that returns the documents as is.
         We use the default combine_docs function from Langchain.
+
+        With a `context_token_budget`, documents are packed into it instead
+        (see `dialog_lib.agents.packing.pack_documents`). The decisions are
+        dispatched as a "context_packing" event to the run's callbacks (turns
+        running concurrently on one agent each get their own).
         """
-        doc_strings = [format_document(doc, self.document_prompt) for doc in docs]
+        if self.context_token_budget is None:
+            doc_strings = [format_document(doc, self.document_prompt) for doc in docs]
+            return document_separator.join(doc_strings)
+
+        with self.instrumentation.stage("context_packing") as record:
+            doc_strings, decisions = pack_documents(
+                docs,
+                self.context_token_budget,
+                lambda doc: format_document(doc, self.document_prompt),
+                counter=self.token_counter,
+                separator_tokens=self.token_counter(document_separator),
+            )
+            report = packing_report(self.context_token_budget, decisions)
+            record.set(rows=len(doc_strings), tokens=report["packed_tokens"])
+        if config is not None:
+            dispatch_custom_event("context_packing", report, config=config)
         return document_separator.join(doc_strings)
 
     @property
@@ -190,7 +288,7 @@ class AbstractLCEL(AbstractLLM):
                 }
             ).with_config({"run_name": "GetContext"})
             | self.prompt
-            | self.model
+            | self.generation_model
         ).with_config({"run_name": "AnswerChain"})
 
     @property
@@ -208,21 +306,64 @@ class AbstractLCEL(AbstractLLM):
             return get_memory_instance(
                 session_id=self.session_id,
                 sqlalchemy_session=session,
-                database_url=self.config.get("database_url")
+                database_url=self.database_url
             )
 
     def get_session_history(self, something):
-        with self.dbsession() as session:
+        with self.instrumentation.stage("history_session"), self.dbsession() as session:
             return CustomPostgresChatMessageHistory(
-                connection_string=self.config.get("database_url"),
+                connection_string=self.database_url,
                 session_id=self.session_id,
                 parent_session_id=self.parent_session_id,
                 table_name="chat_messages",
                 dbsession=session,
+                read_dbsession=self.read_dbsession,
+                dataset=self.dataset,
+                instrumentation=self.instrumentation,
             )
 
+    def direct_answer_document(self, docs):
+        """
+        Returns the best scored document when its cosine distance to the
+        message is within `direct_answer_distance`, None otherwise.
+        """
+        if self.direct_answer_distance is None:
+            return None
+        scored = [doc for doc in docs if doc.metadata.get("score") is not None]
+        if not scored:
+            return None
+        best = max(scored, key=lambda doc: doc.metadata["score"])
+        if 1 - best.metadata["score"] <= self.direct_answer_distance:
+            return best
+        return None
+
+    def answer_directly(self, input):
+        """
+        Answers with the best document's content through `direct_answer_template`
+        (formatted with `content`, `question`, `link` and `input`), writing
+        the turn to the history without calling the model.
+        """
+        doc = self.direct_answer_document(input["relevant_contents"])
+        with self.instrumentation.stage("direct_answer", score=doc.metadata["score"]):
+            question = doc.metadata.get("title") or ""
+            answer = self.direct_answer_template.format(
+                content=doc.page_content.removeprefix(f"{question}\n\n"),
+                question=question,
+                link=doc.metadata.get("link") or "",
+                input=input["input"],
+            )
+            message = AIMessage(
+                content=answer, response_metadata={"direct_answer": True, "content_id": doc.metadata.get("id")}
+            )
+            self.get_session_history(None).add_messages([HumanMessage(content=input["input"]), message])
+        return message
+
     def chain_router(self, input):
-        return self.answer_runnable if len(input["relevant_contents"]) > 0 else self.fallback_chain
+        if not input["relevant_contents"]:
+            return self.fallback_chain
+        if self.direct_answer_document(input["relevant_contents"]) is not None:
+            return RunnableLambda(self.answer_directly).with_config({"run_name": "DirectAnswer"})
+        return self.answer_runnable
 
     @property
     def main_chain(self):
@@ -244,17 +385,20 @@ class AbstractLCEL(AbstractLLM):
         Function that encapsulates the pre-processing, processing and post-processing
         of the LLM.
         """
-        processed_input = self.preprocess(input)
-        self.generate_prompt(processed_input)
-        output = self.main_chain.invoke(
-            {
-                "input": processed_input,
-            },
-            {"configurable": {
-                "session_id": self.session_id,
-            }}
-        )
-        processed_output = self.postprocess(output)
+        config = {"configurable": {"session_id": self.session_id}}
+        if self.instrumentation.enabled:
+            config["callbacks"] = [InstrumentationCallbackHandler(self.instrumentation)]
+
+        with self.instrumentation.stage("turn"):
+            processed_input = self.preprocess(input)
+            self.generate_prompt(processed_input)
+            output = self.main_chain.invoke(
+                {
+                    "input": processed_input,
+                },
+                config,
+            )
+            processed_output = self.postprocess(output)
         return processed_output
 
     def invoke(self, input: dict):
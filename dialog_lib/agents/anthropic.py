@@ -1,4 +1,5 @@
 from .abstract import AbstractDialog
+from .dispatcher import get_dispatcher
 from langchain_anthropic import ChatAnthropic
 
 
@@ -6,11 +7,13 @@ class DialogAnthropic(AbstractDialog):
     def __init__(self, *args, **kwargs):
         model = kwargs.pop("model", "claude-3-opus-20240229")
         temperature = kwargs.pop("temperature", 0)
+        dispatcher = kwargs.pop("dispatcher", None) or get_dispatcher("anthropic")
         kwargs["model_class"] = ChatAnthropic(
             model=model,
             temperature=temperature,
             anthropic_api_key=kwargs.get("llm_api_key"),
-            max_tokens=1536
+            max_tokens=1536,
+            callbacks=[dispatcher.callback(kwargs.get("dataset"), kwargs.get("session_id"))] if dispatcher else None,
         )
         super().__init__(*args, **kwargs)
 
@@ -0,0 +1,344 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+
+from collections import OrderedDict, deque
+from typing import Dict, Hashable, Optional, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import AsyncCallbackHandler
+
+from dialog_lib.instrumentation import get_instrumentation
+from dialog_lib.instrumentation.callbacks import token_usage
+from dialog_lib.tokens import estimate_tokens
+
+
+logger = logging.getLogger(__name__)
+
+
+class DispatcherTimeout(TimeoutError):
+    pass
+
+
+class TokenBucket:
+    """
+    Refills `rate_per_minute` units per minute, continuously, up to
+    `capacity` (a minute's worth by default). The balance can go negative
+    when a request used more tokens than estimated.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.balance = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now):
+        self.balance = min(self.capacity, self.balance + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount: float) -> float:
+        """
+        Seconds until `amount` is available (0 when it is). A request larger
+        than the capacity only waits for a full bucket.
+        """
+        self._refill(time.monotonic())
+        needed = min(amount, self.capacity) - self.balance
+        return max(0.0, needed / self.rate)
+
+    def take(self, amount: float) -> None:
+        self._refill(time.monotonic())
+        self.balance -= amount
+
+
+class LLMDispatcher:
+    """
+    Admits LLM calls under a max in-flight limit and request/token buckets.
+
+    Waiting calls are queued per tenant, a (dataset, session) pair, and
+    admitted round-robin across datasets, then across the sessions of a
+    dataset, so one busy dataset or session can't starve the others.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: Optional[int] = None,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        expected_output_tokens: int = 256,
+        max_wait: Optional[float] = None,
+        name: str = "llm",
+    ):
+        self.max_in_flight = max_in_flight
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.expected_output_tokens = expected_output_tokens
+        self.max_wait = max_wait
+        self.name = name
+
+        self.in_flight = 0
+        self.queue_depth = 0
+        self.admitted = 0
+        self.wait_seconds_total = 0.0
+        self.max_wait_seconds = 0.0
+        self._queues: "OrderedDict[Hashable, OrderedDict[Hashable, deque]]" = OrderedDict()
+        self._condition = threading.Condition()
+        self._async_waiters = set()
+
+    def _head(self):
+        for sessions in self._queues.values():
+            for tickets in sessions.values():
+                return tickets[0]
+        return None
+
+    def _pop(self):
+        dataset, sessions = next(iter(self._queues.items()))
+        session, tickets = next(iter(sessions.items()))
+        tickets.popleft()
+        sessions.move_to_end(session)
+        if not tickets:
+            del sessions[session]
+        self._queues.move_to_end(dataset)
+        if not sessions:
+            del self._queues[dataset]
+
+    def _wait_time(self, tokens) -> Optional[float]:
+        """
+        None when a slot is needed, else seconds until the buckets allow the call.
+        """
+        if self.max_in_flight is not None and self.in_flight >= self.max_in_flight:
+            return None
+        waits = [0.0]
+        if self.requests is not None:
+            waits.append(self.requests.wait_time(1))
+        if self.tokens is not None:
+            waits.append(self.tokens.wait_time(tokens))
+        return max(waits)
+
+    def _enqueue(self, tenant):
+        dataset, session = tenant
+        ticket = object()
+        self._queues.setdefault(dataset, OrderedDict()).setdefault(session, deque()).append(ticket)
+        self.queue_depth += 1
+        return ticket
+
+    def _abandon(self, ticket, tenant):
+        dataset, session = tenant
+        self._queues[dataset][session].remove(ticket)
+        if not self._queues[dataset][session]:
+            del self._queues[dataset][session]
+            if not self._queues[dataset]:
+                del self._queues[dataset]
+        self.queue_depth -= 1
+        self._notify()
+
+    def _admit(self, tokens, started_at) -> float:
+        self._pop()
+        self.queue_depth -= 1
+        self.in_flight += 1
+        if self.requests is not None:
+            self.requests.take(1)
+        if self.tokens is not None:
+            self.tokens.take(tokens)
+
+        waited = time.monotonic() - started_at
+        self.admitted += 1
+        self.wait_seconds_total += waited
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        # the next tenant may be admissible right away
+        self._notify()
+        return waited
+
+    def _notify(self):
+        # called with the condition held: wakes sync waiters and async ones, on their own loops
+        self._condition.notify_all()
+        for loop, event in list(self._async_waiters):
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # loop closed
+                self._async_waiters.discard((loop, event))
+
+    def _timeout(self, ticket, tokens, deadline):
+        """
+        (admissible, seconds to wait) for the ticket's next check.
+        """
+        wait = self._wait_time(tokens) if self._head() is ticket else None
+        if wait == 0:
+            return True, 0
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise DispatcherTimeout(f"Waited more than {self.max_wait}s for an LLM slot")
+            wait = remaining if wait is None else min(wait, remaining)
+        return False, wait
+
+    def acquire(self, tokens: int = 0, tenant: Tuple[Hashable, Hashable] = (None, None)) -> float:
+        """
+        Blocks the thread until the call is admitted and returns the time it
+        waited. Use `aacquire` from async code.
+        """
+        started_at = time.monotonic()
+        deadline = started_at + self.max_wait if self.max_wait is not None else None
+
+        with get_instrumentation().stage(f"{self.name}_queue") as record, self._condition:
+            ticket = self._enqueue(tenant)
+            record.set(queue_depth=self.queue_depth)
+            try:
+                while True:
+                    admissible, timeout = self._timeout(ticket, tokens, deadline)
+                    if admissible:
+                        break
+                    self._condition.wait(timeout)
+            except BaseException:
+                self._abandon(ticket, tenant)
+                raise
+            return self._admit(tokens, started_at)
+
+    async def aacquire(self, tokens: int = 0, tenant: Tuple[Hashable, Hashable] = (None, None)) -> float:
+        """
+        Async `acquire`: waits on an `asyncio.Event` instead of blocking a
+        thread, so queued async calls never hold executor threads that the
+        releases need.
+        """
+        started_at = time.monotonic()
+        deadline = started_at + self.max_wait if self.max_wait is not None else None
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+
+        with get_instrumentation().stage(f"{self.name}_queue") as record:
+            with self._condition:
+                ticket = self._enqueue(tenant)
+                self._async_waiters.add(waiter)
+                record.set(queue_depth=self.queue_depth)
+            try:
+                while True:
+                    with self._condition:
+                        admissible, timeout = self._timeout(ticket, tokens, deadline)
+                        if admissible:
+                            return self._admit(tokens, started_at)
+                        waiter[1].clear()
+                    try:
+                        await asyncio.wait_for(waiter[1].wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+            except BaseException:
+                with self._condition:
+                    self._abandon(ticket, tenant)
+                raise
+            finally:
+                with self._condition:
+                    self._async_waiters.discard(waiter)
+
+    def release(self, estimated_tokens: int = 0, used_tokens: Optional[int] = None) -> None:
+        """
+        Frees the call's slot, charging the token bucket for the tokens the
+        call used beyond its estimate (or refunding the difference).
+        """
+        with self._condition:
+            self.in_flight -= 1
+            if self.tokens is not None and used_tokens:
+                self.tokens.take(used_tokens - estimated_tokens)
+            self._notify()
+
+    def estimate(self, text: str) -> int:
+        return estimate_tokens(text) + self.expected_output_tokens
+
+    def metrics(self) -> Dict[str, float]:
+        return {
+            "queue_depth": self.queue_depth,
+            "in_flight": self.in_flight,
+            "admitted": self.admitted,
+            "wait_seconds_total": self.wait_seconds_total,
+            "max_wait_seconds": self.max_wait_seconds,
+        }
+
+    def register_gauges(self, exporter) -> None:
+        """
+        Exposes the queue depth and in-flight calls on a `PrometheusExporter`.
+        Wait times are recorded as the `{name}_queue` stage.
+        """
+        exporter.add_gauge(f"{self.name}_queue_depth", lambda: self.queue_depth, "LLM calls waiting for a slot.")
+        exporter.add_gauge(f"{self.name}_in_flight", lambda: self.in_flight, "LLM calls in flight.")
+
+    def callback(self, dataset=None, session_id=None) -> "DispatcherCallbackHandler":
+        return DispatcherCallbackHandler(self, (dataset, session_id))
+
+
+class DispatcherCallbackHandler(AsyncCallbackHandler):
+    """
+    Holds every LLM call of the model it is attached to until the dispatcher
+    admits it, and frees the slot when the call ends.
+
+    Async calls wait on the event loop (`aacquire`). LangChain runs the
+    handlers of sync calls on a private loop in the calling thread, so these
+    block only their own thread.
+    """
+
+    raise_error = True
+
+    def __init__(self, dispatcher: LLMDispatcher, tenant):
+        self.dispatcher = dispatcher
+        self.tenant = tenant
+        self._estimates: Dict[UUID, int] = {}
+
+    async def _start(self, run_id, text):
+        tokens = self.dispatcher.estimate(text)
+        await self.dispatcher.aacquire(tokens, self.tenant)
+        self._estimates[run_id] = tokens
+
+    async def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs):
+        await self._start(run_id, "".join(str(message.content) for batch in messages for message in batch))
+
+    async def on_llm_start(self, serialized, prompts, *, run_id: UUID, **kwargs):
+        await self._start(run_id, "".join(prompts))
+
+    async def on_llm_end(self, response, *, run_id: UUID, **kwargs):
+        estimated = self._estimates.pop(run_id, None)
+        if estimated is not None:
+            self.dispatcher.release(estimated, token_usage(response).get("tokens"))
+
+    async def on_llm_error(self, error, *, run_id: UUID, **kwargs):
+        estimated = self._estimates.pop(run_id, None)
+        if estimated is not None:
+            self.dispatcher.release(estimated)
+
+
+_dispatchers: Dict[str, LLMDispatcher] = {}
+_dispatchers_lock = threading.Lock()
+
+
+def _env_number(name, cast=float):
+    value = os.environ.get(name)
+    return cast(value) if value else None
+
+
+def get_dispatcher(provider: str) -> Optional[LLMDispatcher]:
+    """
+    Process wide dispatcher for `provider` (i.e. "openai"), configured by
+    DIALOG_{PROVIDER}_MAX_IN_FLIGHT, DIALOG_{PROVIDER}_RPM, DIALOG_{PROVIDER}_TPM
+    and DIALOG_{PROVIDER}_MAX_WAIT. Returns None when no limit is set.
+    """
+    prefix = f"DIALOG_{provider.upper()}"
+    with _dispatchers_lock:
+        if provider not in _dispatchers:
+            limits = dict(
+                max_in_flight=_env_number(f"{prefix}_MAX_IN_FLIGHT", int),
+                requests_per_minute=_env_number(f"{prefix}_RPM"),
+                tokens_per_minute=_env_number(f"{prefix}_TPM"),
+            )
+            if not any(limits.values()):
+                return None
+            _dispatchers[provider] = LLMDispatcher(
+                **limits, max_wait=_env_number(f"{prefix}_MAX_WAIT"), name=f"{provider}_llm"
+            )
+        return _dispatchers[provider]
+
+
+def set_dispatcher(provider: str, dispatcher: Optional[LLMDispatcher]) -> None:
+    with _dispatchers_lock:
+        if dispatcher is None:
+            _dispatchers.pop(provider, None)
+        else:
+            _dispatchers[provider] = dispatcher
@@ -0,0 +1,353 @@
+import time
+import asyncio
+import logging
+import threading
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Optional
+
+from langchain_core.messages import message_chunk_to_message
+from langchain_core.runnables import RunnableLambda
+
+from dialog_lib.instrumentation import get_instrumentation
+
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+def provider_key(model) -> str:
+    """
+    Identifies the provider and model behind a chat model (i.e. "openai-chat:gpt-4o").
+    """
+    model = getattr(model, "bound", model)
+    llm_type = getattr(model, "_llm_type", type(model).__name__)
+    name = getattr(model, "model_name", None) or getattr(model, "model", None)
+    return f"{llm_type}:{name}" if name else llm_type
+
+
+class LatencyTracker:
+    """
+    Time to first token of the last `window` calls of a model.
+    """
+
+    def __init__(self, window: int = 200):
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency: float) -> None:
+        with self._lock:
+            self._latencies.append(latency)
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(percentile / 100 * len(latencies)))]
+
+
+class CircuitBreaker:
+    """
+    Stops sending calls to a model whose recent calls mostly failed or were
+    slow: over the last `window` calls (once there are `min_calls`), an
+    error rate or slow call rate at or above the thresholds opens the
+    circuit. After `reset_timeout` seconds a single trial call is let
+    through; it closes the circuit on success and reopens it otherwise.
+    """
+
+    def __init__(
+        self,
+        window: int = 20,
+        min_calls: int = 5,
+        error_rate: float = 0.5,
+        slow_call_rate: float = 0.8,
+        slow_call_seconds: Optional[float] = None,
+        reset_timeout: float = 30.0,
+    ):
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_rate = slow_call_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.reset_timeout = reset_timeout
+        self.opened_at = None
+        self._trial = False
+        self._calls = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def record(self, success: bool, latency: Optional[float] = None) -> None:
+        slow = self.slow_call_seconds is not None and latency is not None and latency >= self.slow_call_seconds
+        with self._lock:
+            if self._trial:
+                self._trial = False
+                if success and not slow:
+                    self.opened_at = None
+                    self._calls.clear()
+                else:
+                    self.opened_at = time.monotonic()
+                return
+
+            self._calls.append((success, slow))
+            if self.opened_at is None and len(self._calls) >= self.min_calls:
+                errors = sum(1 for ok, _ in self._calls if not ok) / len(self._calls)
+                slow_calls = sum(1 for _, is_slow in self._calls if is_slow) / len(self._calls)
+                if errors >= self.error_rate or slow_calls >= self.slow_call_rate:
+                    logger.warning(f"Opening circuit: {errors:.0%} errors, {slow_calls:.0%} slow calls")
+                    self.opened_at = time.monotonic()
+
+
+_trackers: Dict[str, LatencyTracker] = {}
+_breakers: Dict[str, CircuitBreaker] = {}
+_registry_lock = threading.Lock()
+
+
+def get_latency_tracker(key: str) -> LatencyTracker:
+    with _registry_lock:
+        return _trackers.setdefault(key, LatencyTracker())
+
+
+def get_circuit_breaker(key: str) -> CircuitBreaker:
+    """
+    Process wide breaker of a provider key, shared by every agent.
+    """
+    with _registry_lock:
+        if key not in _breakers:
+            _breakers[key] = CircuitBreaker()
+        return _breakers[key]
+
+
+def set_circuit_breaker(key: str, breaker: Optional[CircuitBreaker]) -> None:
+    with _registry_lock:
+        if breaker is None:
+            _breakers.pop(key, None)
+        else:
+            _breakers[key] = breaker
+
+
+class _Attempt:
+    def __init__(self, name, model, latencies=None):
+        self.name = name
+        self.model = model
+        self.latencies = latencies
+        self.breaker = get_circuit_breaker(provider_key(model))
+        self.started_at = None
+        self.first_token = threading.Event()
+        self.cancelled = threading.Event()
+        self._recorded = False
+        self._lock = threading.Lock()
+
+    def _settle(self) -> bool:
+        """
+        True the first time only: a call is recorded once on its breaker,
+        whether it fails, finishes or loses to its hedge.
+        """
+        with self._lock:
+            settled, self._recorded = self._recorded, True
+        return not settled
+
+    def _merge(self, message, chunk):
+        if message is None:
+            if self.latencies is not None:
+                self.latencies.record(time.monotonic() - self.started_at)
+            self.first_token.set()
+            return chunk
+        return message + chunk
+
+    def _finish(self, message):
+        if self._settle():
+            self.breaker.record(True, time.monotonic() - self.started_at)
+        return message_chunk_to_message(message)
+
+    def _fail(self):
+        if self._settle():
+            self.breaker.record(False)
+
+    def stream(self, input, config):
+        self.started_at = time.monotonic()
+        message = None
+        try:
+            for chunk in self.model.stream(input, config):
+                if self.cancelled.is_set():
+                    return None
+                message = self._merge(message, chunk)
+        except Exception:
+            self._fail()
+            raise
+        return self._finish(message)
+
+    async def astream(self, input, config):
+        self.started_at = time.monotonic()
+        message = None
+        try:
+            async for chunk in self.model.astream(input, config):
+                message = self._merge(message, chunk)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self._fail()
+            raise
+        return self._finish(message)
+
+    def lost(self):
+        """
+        Cancels a call whose hedge won. It counts as a slow call, and a
+        primary that never started answering records its elapsed time as
+        a (lower bound) first token latency.
+        """
+        self.cancelled.set()
+        if self.started_at is None or not self._settle():
+            return
+        elapsed = time.monotonic() - self.started_at
+        if self.latencies is not None and not self.first_token.is_set():
+            self.latencies.record(elapsed)
+        self.breaker.record(True, elapsed)
+
+
+class HedgedModel:
+    """
+    Streams from `primary` and, if it hasn't produced a first token after
+    the `percentile` of its recent first token latencies (clamped to
+    [`min_delay`, `max_delay`], `initial_delay` until there is history),
+    sends the same request to `backup`. The first complete answer wins and
+    the other call is cancelled. A primary that fails before that is failed
+    over to the backup right away.
+
+    Calls skip a model whose circuit breaker is open, so an unhealthy
+    primary fails over to the backup right away.
+    """
+
+    def __init__(
+        self,
+        primary,
+        backup,
+        percentile: float = 95,
+        initial_delay: float = 2.0,
+        min_delay: float = 0.2,
+        max_delay: float = 10.0,
+    ):
+        self.primary = primary
+        self.backup = backup
+        self.percentile = percentile
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.latencies = get_latency_tracker(provider_key(primary))
+
+    @property
+    def delay(self) -> float:
+        latency = self.latencies.percentile(self.percentile)
+        if latency is None:
+            return self.initial_delay
+        return min(self.max_delay, max(self.min_delay, latency))
+
+    def _attempts(self):
+        primary = _Attempt("primary", self.primary, self.latencies)
+        backup = _Attempt("backup", self.backup)
+        if primary.breaker.allow():
+            # the backup's breaker is asked in `_hedge`, only when it is sent:
+            # a half open breaker hands out a single trial slot
+            return [primary, backup]
+        if backup.breaker.allow():
+            return [backup]
+        raise CircuitOpenError("Circuits of both the primary and backup models are open")
+
+    def _hedge(self, attempts, failed: bool, delay: float) -> bool:
+        """
+        Whether to send the backup, decided once per call: when the primary
+        failed, or hadn't produced a first token within `delay`.
+        """
+        if len(attempts) < 2 or not (failed or not attempts[0].first_token.is_set()):
+            return False
+        if not attempts[1].breaker.allow():
+            return False
+        if failed:
+            logger.info(f"Failing over from {provider_key(self.primary)} after an error")
+        else:
+            logger.info(f"Hedging {provider_key(self.primary)} after {delay:.2f}s")
+        return True
+
+    def invoke(self, input, config=None):
+        attempts = self._attempts()
+        delay = self.delay
+        deadline = time.monotonic() + delay
+        hedgeable = len(attempts) > 1
+        pool = ThreadPoolExecutor(len(attempts))
+        try:
+            with get_instrumentation().stage("hedge") as record:
+                futures = {pool.submit(attempts[0].stream, input, config): attempts[0]}
+                errors, pending = [], set(futures)
+                while pending:
+                    timeout = max(0.0, deadline - time.monotonic()) if hedgeable else None
+                    done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        if future.exception() is None:
+                            for other in pending:
+                                futures[other].lost()
+                            record.set(winner=futures[future].name, hedged=len(futures) > 1)
+                            return future.result()
+                        errors.append(future.exception())
+                    if hedgeable and (errors or time.monotonic() >= deadline):
+                        hedgeable = False
+                        if self._hedge(attempts, bool(errors), delay):
+                            future = pool.submit(attempts[1].stream, input, config)
+                            futures[future] = attempts[1]
+                            pending.add(future)
+                raise errors[0]
+        finally:
+            # a losing stream stops at its next chunk, don't wait for it
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    async def ainvoke(self, input, config=None):
+        attempts = self._attempts()
+        delay = self.delay
+        deadline = time.monotonic() + delay
+        hedgeable = len(attempts) > 1
+        with get_instrumentation().stage("hedge") as record:
+            tasks = {asyncio.ensure_future(attempts[0].astream(input, config)): attempts[0]}
+            errors, pending = [], set(tasks)
+            try:
+                while pending:
+                    timeout = max(0.0, deadline - time.monotonic()) if hedgeable else None
+                    done, pending = await asyncio.wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                    for task in done:
+                        if task.exception() is None:
+                            for other in pending:
+                                tasks[other].lost()
+                            record.set(winner=tasks[task].name, hedged=len(tasks) > 1)
+                            return task.result()
+                        errors.append(task.exception())
+                    if hedgeable and (errors or time.monotonic() >= deadline):
+                        hedgeable = False
+                        if self._hedge(attempts, bool(errors), delay):
+                            task = asyncio.ensure_future(attempts[1].astream(input, config))
+                            tasks[task] = attempts[1]
+                            pending.add(task)
+                raise errors[0]
+            finally:
+                for task in pending:
+                    task.cancel()
+
+    def as_runnable(self) -> RunnableLambda:
+        return RunnableLambda(self.invoke, afunc=self.ainvoke, name="HedgedModel")
@@ -1,7 +1,8 @@
 import os
 from .abstract import AbstractDialog, AbstractLCEL
-from langchain_openai import OpenAIEmbeddings
+from .dispatcher import get_dispatcher
 from langchain_openai.chat_models.base import ChatOpenAI
+from dialog_lib.embeddings.generate import openai_embeddings
 from dialog_lib.embeddings.retrievers import DialogRetriever
 
 
@@ -9,10 +10,12 @@ class DialogOpenAI(AbstractDialog):
     def __init__(self, *args, **kwargs):
         model = kwargs.pop("model", "gpt-3.5-turbo")
         temperature = kwargs.pop("temperature", 0.1)
+        dispatcher = kwargs.pop("dispatcher", None) or get_dispatcher("openai")
         kwargs["model_class"] = ChatOpenAI(
             model=model,
             temperature=temperature,
             openai_api_key=kwargs.get("llm_api_key"),
+            callbacks=[dispatcher.callback(kwargs.get("dataset"), kwargs.get("session_id"))] if dispatcher else None,
         )
         super().__init__(*args, **kwargs)
 
@@ -23,10 +26,16 @@ class DialogOpenAI(AbstractDialog):
 class DialogLCELOpenAI(AbstractLCEL):
     def __init__(self, *args, **kwargs):
         self.openai_api_key = kwargs.get("llm_api_key") or os.environ.get("OPENAI_API_KEY")
+        # any OpenAI-compatible endpoint, i.e. a proxy or a local stand-in
+        base_url = kwargs.pop("base_url", None) or os.environ.get("OPENAI_BASE_URL")
         kwargs["model_class"] = ChatOpenAI(
             model=kwargs.pop("model"),
             temperature=kwargs.pop("temperature"),
             openai_api_key=self.openai_api_key,
+            base_url=base_url,
+            streaming=kwargs.pop("streaming", False),
         )
-        kwargs["embedding_llm"] = OpenAIEmbeddings(openai_api_key=self.openai_api_key)
+        if "embedding_llm" not in kwargs:
+            kwargs["embedding_llm"] = openai_embeddings(self.openai_api_key, base_url=base_url)
+        kwargs["dispatcher"] = kwargs.get("dispatcher") or get_dispatcher("openai")
         super().__init__(*args, **kwargs)
@@ -0,0 +1,116 @@
+import re
+import logging
+
+from dataclasses import dataclass, asdict
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+from dialog_lib.tokens import estimate_tokens
+
+
+logger = logging.getLogger(__name__)
+
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n+")
+
+_encoding = None
+
+
+def _count_tokens(text: str) -> int:
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as exc:
+            logger.warning(f"tiktoken unavailable ({exc}), estimating token counts")
+            _encoding = False
+    if _encoding is False:
+        return estimate_tokens(text)
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+@lru_cache(maxsize=8192)
+def count_tokens(text: str) -> int:
+    """
+    Token count of `text` (cl100k_base, or ~4 characters per token without
+    tiktoken), cached across turns since the same contents keep coming back.
+    """
+    return _count_tokens(text)
+
+
+@dataclass
+class PackingDecision:
+    title: Optional[str]
+    score: Optional[float]
+    tokens: int
+    packed_tokens: int
+    action: str  # "full", "truncated" or "dropped"
+
+
+def truncate_sentences(text: str, budget: int, counter: Callable[[str], int] = count_tokens) -> Tuple[str, int]:
+    """
+    Returns the longest prefix of whole sentences of `text` fitting in
+    `budget` tokens, with its token count.
+    """
+    sentences = [sentence for sentence in SENTENCE_BOUNDARY.split(text) if sentence.strip()]
+    kept, used = [], 0
+    for sentence in sentences:
+        tokens = counter(sentence)
+        if used + tokens > budget:
+            break
+        kept.append(sentence)
+        used += tokens
+    return " ".join(kept), used
+
+
+def pack_documents(
+    docs: Sequence[Document],
+    budget: int,
+    format_document: Callable[[Document], str],
+    counter: Callable[[str], int] = count_tokens,
+    separator_tokens: int = 1,
+    min_truncated_tokens: int = 32,
+) -> Tuple[List[str], List[PackingDecision]]:
+    """
+    Packs formatted documents, best first (highest `metadata["score"]`,
+    documents without one last, in the retriever's order), into `budget`
+    tokens. Documents are kept whole until the first one that does not fit,
+    which is truncated at a sentence boundary when at least
+    `min_truncated_tokens` remain (dropped otherwise); every document ranked
+    after it is dropped. Decisions come in packing order.
+    """
+    ranked = sorted(docs, key=lambda doc: (doc.metadata.get("score") is None, -(doc.metadata.get("score") or 0)))
+    packed, decisions, remaining, spent = [], [], budget, False
+    for doc in ranked:
+        text = format_document(doc)
+        tokens = counter(text)
+        cost = tokens + (separator_tokens if packed else 0)
+        title, score = doc.metadata.get("title"), doc.metadata.get("score")
+
+        if spent:
+            decisions.append(PackingDecision(title, score, tokens, 0, "dropped"))
+        elif cost <= remaining:
+            packed.append(text)
+            remaining -= cost
+            decisions.append(PackingDecision(title, score, tokens, tokens, "full"))
+        else:
+            available = remaining - (separator_tokens if packed else 0)
+            truncated, used = truncate_sentences(text, available, counter) if available >= min_truncated_tokens else ("", 0)
+            if truncated:
+                packed.append(truncated)
+                decisions.append(PackingDecision(title, score, tokens, used, "truncated"))
+            else:
+                decisions.append(PackingDecision(title, score, tokens, 0, "dropped"))
+            spent = True
+    return packed, decisions
+
+
+def packing_report(budget: int, decisions: Sequence[PackingDecision]) -> Dict:
+    return {
+        "budget": budget,
+        "packed_tokens": sum(decision.packed_tokens for decision in decisions),
+        "documents": [asdict(decision) for decision in decisions],
+    }
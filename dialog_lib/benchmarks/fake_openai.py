@@ -0,0 +1,181 @@
+import json
+import time
+import random
+import hashlib
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+import numpy as np
+
+
+def fake_embedding(value, dimension: int) -> List[float]:
+    """
+    Deterministic unit vector for any JSON value (a text or a token list).
+    """
+    digest = hashlib.sha256(json.dumps(value).encode("utf-8")).digest()
+    generator = np.random.default_rng(int.from_bytes(digest[:8], "little"))
+    vector = generator.standard_normal(dimension)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+class FakeOpenAIServer:
+    """
+    Local stand-in for the OpenAI HTTP API serving `/v1/chat/completions`
+    (plain or streamed as server-sent events) and `/v1/embeddings`, so load
+    tests exercise the real client stack without leaving the machine.
+
+    Chat responses wait `latency` seconds before the first byte, then
+    `token_latency` seconds per streamed word. `error_rate` of the requests
+    fail with a 500.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        response: str = "Thanks for asking, here is what I found in our documentation.",
+        latency: float = 0.0,
+        token_latency: float = 0.0,
+        embedding_latency: float = 0.0,
+        error_rate: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        self.response = response
+        self.latency = latency
+        self.token_latency = token_latency
+        self.embedding_latency = embedding_latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _fails(self) -> bool:
+        with self._lock:
+            self.requests += 1
+            return self.random.random() < self.error_rate
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _json(self, status, payload):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/models"):
+                    return self._json(200, {"object": "list", "data": [{"id": "fake", "object": "model"}]})
+                self._json(404, {"error": {"message": "Not found"}})
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if server._fails():
+                    return self._json(500, {"error": {"message": "Injected failure", "type": "server_error"}})
+                if self.path.endswith("/chat/completions"):
+                    return self._chat(request)
+                if self.path.endswith("/embeddings"):
+                    return self._embeddings(request)
+                self._json(404, {"error": {"message": "Not found"}})
+
+            def _embeddings(self, request):
+                time.sleep(server.embedding_latency)
+                inputs = request["input"] if isinstance(request["input"], list) else [request["input"]]
+                # tokenized inputs (a list of token ids) arrive as a single list of ints
+                if inputs and isinstance(inputs[0], int):
+                    inputs = [inputs]
+                dimension = request.get("dimensions") or 1536
+                self._json(200, {
+                    "object": "list",
+                    "model": request.get("model", "fake"),
+                    "data": [
+                        {"object": "embedding", "index": index, "embedding": fake_embedding(value, dimension)}
+                        for index, value in enumerate(inputs)
+                    ],
+                    "usage": {"prompt_tokens": len(inputs), "total_tokens": len(inputs)},
+                })
+
+            def _chat(self, request):
+                time.sleep(server.latency)
+                model = request.get("model", "fake")
+                prompt_tokens = sum(len(str(message.get("content", "")).split()) for message in request["messages"])
+                words = server.response.split(" ")
+                usage = {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": len(words),
+                    "total_tokens": prompt_tokens + len(words),
+                }
+                if not request.get("stream"):
+                    time.sleep(server.token_latency * len(words))
+                    return self._json(200, {
+                        "id": "chatcmpl-fake",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": model,
+                        "choices": [{
+                            "index": 0,
+                            "message": {"role": "assistant", "content": server.response},
+                            "finish_reason": "stop",
+                        }],
+                        "usage": usage,
+                    })
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                for index, word in enumerate(words):
+                    time.sleep(server.token_latency)
+                    self._event(model, {"content": word if index == 0 else f" {word}"}, None)
+                self._event(model, {}, "stop")
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+                self.close_connection = True
+
+            def _event(self, model, delta, finish_reason):
+                chunk = {
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                }
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+        return Handler
+
+    def start(self) -> "FakeOpenAIServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+        return False
@@ -0,0 +1,47 @@
+import time
+from typing import Any, List, Optional
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.chat_models import SimpleChatModel
+from langchain_core.messages import BaseMessage
+
+from dialog_lib.db.models import EMBEDDING_DIMENSION
+
+
+class FakeEmbeddingModel(DeterministicFakeEmbedding):
+    """
+    Deterministic embeddings (the same text always gets the same vector)
+    with an optional simulated latency per call.
+    """
+    size: int = EMBEDDING_DIMENSION
+    latency: float = 0.0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        time.sleep(self.latency)
+        return super().embed_query(text)
+
+
+class FakeChatModel(SimpleChatModel):
+    """
+    Chat model answering every prompt with the same response after `latency` seconds.
+    """
+    response: str = "Thanks for asking, here is what I found."
+    latency: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "dialog-fake-chat-model"
+
+    def _call(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager=None,
+        **kwargs: Any,
+    ) -> str:
+        time.sleep(self.latency)
+        return self.response
@@ -0,0 +1,179 @@
+import time
+import random
+import logging
+import threading
+
+from uuid import uuid4
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Sequence
+
+from sqlalchemy import create_engine, delete
+from sqlalchemy.orm import sessionmaker
+
+from dialog_lib.db.bulk import psycopg_url
+from dialog_lib.db.models import Base, ChatMessages, CompanyContent
+from dialog_lib.embeddings.generate import openai_embeddings
+from dialog_lib.loaders.executor import IngestionExecutor, store_contents
+from dialog_lib.benchmarks.fake_openai import FakeOpenAIServer
+from dialog_lib.benchmarks.pipeline import library_version
+from dialog_lib.benchmarks.stats import PoolWaitTimer, summarize
+
+
+logger = logging.getLogger(__name__)
+
+
+class LoadTest:
+    """
+    Simulates concurrent chat sessions through `DialogLCELOpenAI` against a
+    real Postgres and a local `FakeOpenAIServer`, ramping the number of
+    sessions up level by level.
+
+    Each session sends `turns` messages, sleeping an exponentially
+    distributed think time (mean `think_time` seconds) between them, with a
+    new agent per turn as a web worker would build one per request.
+    """
+
+    def __init__(
+        self,
+        database_url: str,
+        session_levels: Sequence[int] = (1, 8, 32),
+        turns: int = 5,
+        think_time: float = 1.0,
+        contents: int = 200,
+        pool_size: int = 10,
+        max_overflow: int = 0,
+        server: FakeOpenAIServer = None,
+        streaming: bool = False,
+        seed: int = 0,
+    ):
+        self.database_url = database_url
+        self.session_levels = list(session_levels)
+        self.turns = turns
+        self.think_time = think_time
+        self.contents = contents
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.engine = create_engine(database_url, pool_size=pool_size, max_overflow=max_overflow)
+        self.session_factory = sessionmaker(self.engine)
+        self.server = server or FakeOpenAIServer()
+        self.streaming = streaming
+        self.random = random.Random(seed)
+        self.dataset = f"load-{uuid4().hex[:8]}"
+        self.questions = [f"load test question {index}" for index in range(contents)]
+
+    def embeddings(self):
+        # raw strings: token lists would need tiktoken's encodings from the network
+        return openai_embeddings("fake", base_url=self.server.base_url, check_embedding_ctx_length=False)
+
+    def make_agent(self, session_id):
+        from dialog_lib.agents.openai import DialogLCELOpenAI
+
+        return DialogLCELOpenAI(
+            model="gpt-3.5-turbo",
+            temperature=0,
+            llm_api_key="fake",
+            base_url=self.server.base_url,
+            streaming=self.streaming,
+            embedding_llm=self.embeddings(),
+            dbsession=self.session_factory,
+            read_dbsession=self.session_factory,
+            dataset=self.dataset,
+            session_id=session_id,
+            retriever_kwargs={"dataset": self.dataset},
+            config={
+                "database_url": psycopg_url(self.database_url),
+                "prompt": {"fallback_not_found_relevant_contents": "Not found"},
+            },
+        )
+
+    def load_contents(self) -> None:
+        rows = [
+            dict(
+                category="load",
+                subcategory="load-content",
+                question=question,
+                content=f"The answer to {question}. " * 20,
+                dataset=self.dataset,
+            )
+            for question in self.questions
+        ]
+        with self.session_factory() as session:
+            store_contents(session, CompanyContent, rows, self.questions, IngestionExecutor(self.embeddings()))
+
+    def run_level(self, sessions: int) -> Dict:
+        latencies, errors = [], []
+        lock = threading.Lock()
+        think_times = [
+            [self.random.expovariate(1 / self.think_time) if self.think_time else 0.0 for _ in range(self.turns)]
+            for _ in range(sessions)
+        ]
+
+        def session(index):
+            session_id = f"s{sessions}-{index}"
+            for turn in range(self.turns):
+                started_at = time.perf_counter()
+                try:
+                    self.make_agent(session_id).process(self.questions[(index + turn) % len(self.questions)])
+                except Exception as exc:
+                    logger.warning(f"Turn failed: {exc!r}")
+                    with lock:
+                        errors.append(type(exc).__name__)
+                else:
+                    with lock:
+                        latencies.append(time.perf_counter() - started_at)
+                time.sleep(think_times[index][turn])
+
+        with PoolWaitTimer(self.engine) as pool_waits, ThreadPoolExecutor(max_workers=sessions) as pool:
+            started_at = time.perf_counter()
+            list(pool.map(session, range(sessions)))
+            elapsed = time.perf_counter() - started_at
+
+        total = sessions * self.turns
+        return {
+            "sessions": sessions,
+            "turns": total,
+            "turns_per_second": len(latencies) / elapsed,
+            "error_rate": len(errors) / total,
+            "errors": {name: errors.count(name) for name in set(errors)},
+            "latency": summarize(latencies),
+            "pool_wait": summarize(pool_waits.waits),
+        }
+
+    def cleanup(self):
+        with self.session_factory() as session:
+            session.execute(delete(CompanyContent).where(CompanyContent.dataset == self.dataset))
+            session.execute(delete(ChatMessages).where(ChatMessages.session_id.like(f"{self.dataset}_%")))
+            session.commit()
+
+    def run(self) -> Dict:
+        Base.metadata.create_all(self.engine)
+        self.server.start()
+        try:
+            self.load_contents()
+            levels = []
+            for sessions in self.session_levels:
+                levels.append(self.run_level(sessions))
+                logger.info(f"Load level done: {levels[-1]}")
+        finally:
+            self.server.stop()
+            self.cleanup()
+            self.engine.dispose()
+
+        return {
+            "benchmark": "load",
+            "dialog_lib_version": library_version(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "config": {
+                "turns_per_session": self.turns,
+                "think_time": self.think_time,
+                "contents": self.contents,
+                "pool_size": self.pool_size,
+                "max_overflow": self.max_overflow,
+                "streaming": self.streaming,
+                "llm_latency": self.server.latency,
+                "token_latency": self.server.token_latency,
+                "error_rate": self.server.error_rate,
+            },
+            "levels": levels,
+        }
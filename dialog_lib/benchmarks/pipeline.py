@@ -0,0 +1,215 @@
+import json
+import time
+import logging
+import platform
+
+from uuid import uuid4
+from datetime import datetime, timezone
+from importlib import metadata
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Sequence
+
+from sqlalchemy import create_engine, delete, select
+from sqlalchemy.orm import sessionmaker
+from langchain_core.messages import HumanMessage
+
+from dialog_lib.agents.abstract import AbstractLCEL
+from dialog_lib.db.bulk import psycopg_url
+from dialog_lib.db.memory import CustomPostgresChatMessageHistory
+from dialog_lib.db.models import Base, ChatMessages, CompanyContent
+from dialog_lib.db.prepared import fetch_messages, psycopg_connection
+from dialog_lib.embeddings.generate import get_most_relevant_contents_from_message
+from dialog_lib.embeddings.retrievers import DialogRetriever
+from dialog_lib.loaders.executor import IngestionExecutor, store_contents
+from dialog_lib.benchmarks.fakes import FakeChatModel, FakeEmbeddingModel
+from dialog_lib.benchmarks.stats import RoundTripCounter, StageTimer, peak_rss_mb, summarize
+
+
+logger = logging.getLogger(__name__)
+
+
+def library_version():
+    try:
+        return metadata.version("dialog-lib")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+class PipelineBenchmark:
+    """
+    Drives the loaders, the retriever, the chat history and full
+    `AbstractLCEL.process` turns against a real Postgres, with deterministic
+    fake chat and embedding models so no network is involved.
+
+    Seeded contents are embedded from their question, and turns ask those
+    same questions, so every turn goes through the answer chain.
+    """
+
+    def __init__(
+        self,
+        database_url: str,
+        contents: int = 500,
+        turns: int = 100,
+        concurrency_levels: Sequence[int] = (1, 4, 16),
+        chat_latency: float = 0.0,
+        embedding_latency: float = 0.0,
+        top_k: int = 3,
+    ):
+        self.database_url = database_url
+        self.contents = contents
+        self.turns = turns
+        self.concurrency_levels = list(concurrency_levels)
+        self.top_k = top_k
+        self.engine = create_engine(database_url, pool_size=max(self.concurrency_levels) + 1)
+        self.session_factory = sessionmaker(self.engine)
+        self.embeddings = FakeEmbeddingModel(latency=embedding_latency)
+        self.chat_model = FakeChatModel(latency=chat_latency)
+        self.dataset = f"bench-{uuid4().hex[:8]}"
+        self.questions = [f"benchmark question {index}" for index in range(contents)]
+        self.timer = StageTimer()
+
+    def question(self, index):
+        return self.questions[index % len(self.questions)]
+
+    def make_agent(self, session_id):
+        return AbstractLCEL(
+            model_class=self.chat_model,
+            embedding_llm=self.embeddings,
+            dbsession=self.session_factory,
+            read_dbsession=self.session_factory,
+            dataset=self.dataset,
+            session_id=session_id,
+            top_k=self.top_k,
+            retriever_kwargs={"dataset": self.dataset},
+            config={
+                "database_url": psycopg_url(self.database_url),
+                "prompt": {"fallback_not_found_relevant_contents": "Not found"},
+            },
+        )
+
+    def load_contents(self) -> Dict:
+        rows = [
+            dict(
+                category="benchmark",
+                subcategory="benchmark-content",
+                question=question,
+                content=f"The answer to {question}. " * 20,
+                dataset=self.dataset,
+            )
+            for question in self.questions
+        ]
+        with self.session_factory() as session:
+            metrics = store_contents(
+                session, CompanyContent, rows, self.questions, IngestionExecutor(self.embeddings)
+            )
+        return metrics.as_dict()
+
+    def run_stages(self):
+        with self.session_factory() as session:
+            retriever = DialogRetriever(
+                session=session, embedding_llm=self.embeddings, dataset=self.dataset, top_k=self.top_k
+            )
+            history = CustomPostgresChatMessageHistory(
+                connection_string=psycopg_url(self.database_url),
+                session_id=f"{self.dataset}_stages",
+                dbsession=session,
+            )
+            for index in range(self.turns):
+                question = self.question(index)
+                with self.timer.time("embedding"):
+                    self.embeddings.embed_query(question)
+                with self.timer.time("retrieval"):
+                    retriever.invoke(question)
+                with self.timer.time("history_write"):
+                    history.add_message(HumanMessage(content=question))
+                with self.timer.time("history_load"):
+                    history.messages
+            self.run_prepared_stages(session, f"{self.dataset}_stages")
+
+    def run_prepared_stages(self, session, session_id):
+        """
+        Times the hot retrieval and history queries through the ORM against
+        the prepared statements of `dialog_lib.db.prepared`, with a zero
+        latency embedding model. Skipped unless the URL uses psycopg 3
+        (`postgresql+psycopg://`).
+        """
+        if psycopg_connection(session) is None:
+            logger.info("Skipping prepared statement stages: the engine doesn't use psycopg 3")
+            return
+        embeddings = FakeEmbeddingModel()
+        for index in range(self.turns):
+            question = self.question(index)
+            for prepared in (False, True):
+                suffix = "prepared" if prepared else "orm"
+                with self.timer.time(f"vector_query_{suffix}"):
+                    get_most_relevant_contents_from_message(
+                        question, top=self.top_k, dataset=self.dataset, session=session,
+                        embeddings_llm=embeddings, prepared=prepared,
+                    )
+            with self.timer.time("history_query_orm"):
+                session.execute(
+                    select(ChatMessages.message).where(ChatMessages.session_id == session_id)
+                    .order_by(ChatMessages.timestamp, ChatMessages.id)
+                ).all()
+            with self.timer.time("history_query_prepared"):
+                fetch_messages(session, ChatMessages.__tablename__, session_id)
+
+    def run_turns(self, concurrency: int) -> Dict:
+        latencies = []
+
+        def turn(index):
+            agent = self.make_agent(f"c{concurrency}-{index % max(1, self.turns // 4)}")
+            started_at = time.perf_counter()
+            agent.process(self.question(index))
+            latencies.append(time.perf_counter() - started_at)
+
+        with RoundTripCounter(self.engine) as round_trips, ThreadPoolExecutor(max_workers=concurrency) as pool:
+            started_at = time.perf_counter()
+            list(pool.map(turn, range(self.turns)))
+            elapsed = time.perf_counter() - started_at
+
+        return {
+            "concurrency": concurrency,
+            "turns_per_second": self.turns / elapsed,
+            "round_trips_per_turn": round_trips.count / self.turns,
+            "latency": summarize(latencies),
+        }
+
+    def cleanup(self):
+        with self.session_factory() as session:
+            session.execute(delete(CompanyContent).where(CompanyContent.dataset == self.dataset))
+            session.execute(delete(ChatMessages).where(ChatMessages.session_id.like(f"{self.dataset}_%")))
+            session.commit()
+
+    def run(self) -> Dict:
+        Base.metadata.create_all(self.engine)
+        try:
+            loader = self.load_contents()
+            self.run_stages()
+            turns = [self.run_turns(concurrency) for concurrency in self.concurrency_levels]
+        finally:
+            self.cleanup()
+            self.engine.dispose()
+
+        return {
+            "benchmark": "pipeline",
+            "dialog_lib_version": library_version(),
+            "python_version": platform.python_version(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "config": {
+                "contents": self.contents,
+                "turns": self.turns,
+                "top_k": self.top_k,
+                "chat_latency": self.chat_model.latency,
+                "embedding_latency": self.embeddings.latency,
+            },
+            "loader": loader,
+            "stages": self.timer.summary(),
+            "turns": turns,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+
+
+def write_results(results: Dict, output_path: str):
+    with open(output_path, "w") as output:
+        json.dump(results, output, indent=2)
@@ -0,0 +1,156 @@
+import math
+import time
+import resource
+import threading
+
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, List
+
+import psycopg
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+def percentile(values: List[float], q: float) -> float:
+    """
+    Nearest-rank percentile, `q` between 0 and 100.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    """
+    Latency summary in milliseconds.
+    """
+    return {
+        "count": len(values),
+        "mean_ms": sum(values) / len(values) * 1000 if values else 0.0,
+        "p50_ms": percentile(values, 50) * 1000,
+        "p95_ms": percentile(values, 95) * 1000,
+        "p99_ms": percentile(values, 99) * 1000,
+    }
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class StageTimer:
+    """
+    Thread safe collection of per-stage durations (in seconds).
+    """
+
+    def __init__(self):
+        self.durations = defaultdict(list)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def time(self, stage: str):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started_at
+            with self._lock:
+                self.durations[stage].append(elapsed)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {stage: summarize(values) for stage, values in self.durations.items()}
+
+
+class RoundTripCounter:
+    """
+    Counts statements sent through `engines`, including the ones executed on
+    their psycopg 3 connections directly (i.e. prepared statements). Other
+    engines and connections of the process are left alone.
+    """
+
+    def __init__(self, *engines: Engine):
+        self.engines = engines
+        self.count = 0
+        self._lock = threading.Lock()
+        self._cursor_classes = {}
+        self._patched = {}
+
+    def _increment(self):
+        with self._lock:
+            self.count += 1
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # psycopg 3 cursors are counted by their cursor class
+        if not isinstance(conn.connection.dbapi_connection, psycopg.Connection):
+            self._increment()
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        if isinstance(dbapi_connection, psycopg.Connection) and dbapi_connection not in self._patched:
+            self._patched[dbapi_connection] = dbapi_connection.cursor_factory
+            dbapi_connection.cursor_factory = self._counting(dbapi_connection.cursor_factory)
+
+    def _counting(self, cursor_class):
+        if cursor_class not in self._cursor_classes:
+            counter = self
+
+            class CountingCursor(cursor_class):
+                def execute(self, *args, **kwargs):
+                    counter._increment()
+                    return super().execute(*args, **kwargs)
+
+                def executemany(self, *args, **kwargs):
+                    counter._increment()
+                    return super().executemany(*args, **kwargs)
+
+            self._cursor_classes[cursor_class] = CountingCursor
+        return self._cursor_classes[cursor_class]
+
+    def __enter__(self):
+        for engine in self.engines:
+            event.listen(engine, "before_cursor_execute", self._on_execute)
+            event.listen(engine.pool, "checkout", self._on_checkout)
+        return self
+
+    def __exit__(self, *exc_info):
+        for engine in self.engines:
+            event.remove(engine, "before_cursor_execute", self._on_execute)
+            event.remove(engine.pool, "checkout", self._on_checkout)
+        for dbapi_connection, cursor_class in self._patched.items():
+            dbapi_connection.cursor_factory = cursor_class
+        self._patched = {}
+        return False
+
+
+class PoolWaitTimer:
+    """
+    Times how long callers wait to check a connection out of an engine's pool.
+    """
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self.waits: List[float] = []
+        self._lock = threading.Lock()
+        self._original = None
+
+    def __enter__(self):
+        pool = self.engine.pool
+        self._original = pool.connect
+        timer = self
+
+        def connect(*args, **kwargs):
+            started_at = time.perf_counter()
+            try:
+                return timer._original(*args, **kwargs)
+            finally:
+                with timer._lock:
+                    timer.waits.append(time.perf_counter() - started_at)
+
+        pool.connect = connect
+        return self
+
+    def __exit__(self, *exc_info):
+        del self.engine.pool.connect
+        return False
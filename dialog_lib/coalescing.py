@@ -0,0 +1,112 @@
+import json
+import asyncio
+import hashlib
+import threading
+
+from typing import Any, Awaitable, Callable, Hashable
+
+from dialog_lib.instrumentation import get_instrumentation
+
+
+def normalize_input(text: str) -> str:
+    """
+    Case and whitespace insensitive form of a user message.
+    """
+    return " ".join(text.casefold().split())
+
+
+def request_key(*parts: Any) -> str:
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _Flight:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Runs a single call per key at a time: concurrent callers with the same
+    key wait for the in-flight call and all get its result (or exception).
+
+    Waiters are reported to the instrumentation as `cache_hit=True` of the
+    `name` stage, leaders as `cache_hit=False`.
+    """
+
+    def __init__(self, name: str = "coalesced"):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._flights = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        with get_instrumentation().stage(self.name, cache_hit=not leader):
+            if not leader:
+                call.done.wait()
+                if call.error is not None:
+                    raise call.error
+                return call.result
+
+            try:
+                call.result = fn()
+                return call.result
+            except BaseException as exc:
+                call.error = exc
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+    async def ado(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Async counterpart of `do`; calls are shared within an event loop.
+
+        The shared call runs in its own task, so cancelling the caller that
+        started it doesn't cancel it for the others; it is only cancelled
+        once every caller is gone.
+        """
+        loop = asyncio.get_running_loop()
+        key = (id(loop), key)
+        flight = self._flights.get(key)
+        leader = flight is None
+
+        with get_instrumentation().stage(self.name, cache_hit=not leader):
+            if leader:
+                flight = self._flights[key] = _Flight(loop.create_task(fn()))
+                flight.task.add_done_callback(lambda task: self._forget(key, flight))
+
+            flight.waiters += 1
+            try:
+                return await asyncio.shield(flight.task)
+            finally:
+                flight.waiters -= 1
+                if not flight.waiters and not flight.task.done():
+                    # later callers start over instead of joining a cancelled call
+                    self._forget(key, flight)
+                    flight.task.cancel()
+
+    def _forget(self, key: Hashable, flight: "_Flight") -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        # callers may all be gone, don't warn about an unretrieved exception
+        if flight.task.done() and not flight.task.cancelled():
+            flight.task.exception()
+
+retrieval_flights = SingleFlight("retrieval_coalesced")
+generation_flights = SingleFlight("generation_coalesced")
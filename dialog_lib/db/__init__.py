@@ -4,4 +4,4 @@ from .memory import (
     add_user_message_to_message_history,
     get_messages,
 )
-from .session import get_session
\ No newline at end of file
+from .session import get_session, get_read_session
\ No newline at end of file
@@ -0,0 +1,173 @@
+import logging
+from struct import pack
+from typing import Dict, Iterable, Sequence, Tuple
+
+import numpy as np
+import psycopg
+from psycopg import sql
+from psycopg.adapt import Dumper
+from psycopg.pq import Format
+from psycopg.types import TypeInfo
+from sqlalchemy.engine import make_url
+from pgvector.psycopg import register_vector
+
+from .models import CompanyContent
+from .types import HalfVector
+from .versions import BUMP_SQL, version_keys
+
+
+logger = logging.getLogger(__name__)
+
+COPY_COLUMNS = {
+    "category": "text",
+    "subcategory": "text",
+    "question": "text",
+    "content": "text",
+    "embedding": "vector",
+    "dataset": "text",
+    "link": "text",
+    "source": "text",
+    "source_key": "text",
+    "content_hash": "text",
+    "parent_id": "int4",
+    "chunk_index": "int4",
+}
+
+
+def psycopg_url(database_url: str) -> str:
+    """
+    Turns a SQLAlchemy database URL (i.e. postgresql+psycopg2://...) into a libpq one.
+    """
+    return make_url(database_url).set(drivername="postgresql").render_as_string(hide_password=False)
+
+
+class HalfVectorBinaryDumper(Dumper):
+    format = Format.BINARY
+
+    def dump(self, obj):
+        value = np.asarray(obj, dtype=">f2")
+        return pack(">HH", value.shape[0], 0) + value.tobytes()
+
+
+def register_halfvec(connection):
+    """
+    Registers a binary dumper for pgvector's `halfvec`, used through `set_types`.
+    """
+    info = TypeInfo.fetch(connection, "halfvec")
+    if info is None:
+        raise psycopg.ProgrammingError("halfvec type not found in the database")
+    info.register(connection)
+    connection.adapters.register_dumper(None, type("", (HalfVectorBinaryDumper,), {"oid": info.oid}))
+
+
+def secondary_indexes(cursor, table_name: str):
+    """
+    Returns (name, definition) of the indexes on `table_name` that are not
+    backing a constraint (primary keys, unique constraints).
+    """
+    cursor.execute(
+        """
+        SELECT i.indexname, i.indexdef FROM pg_indexes i
+        WHERE i.tablename = %s AND i.schemaname = current_schema()
+        AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conname = i.indexname)
+        """,
+        (table_name,),
+    )
+    return cursor.fetchall()
+
+
+class ContentsCopyWriter:
+    """
+    Streams content rows through `COPY ... FROM STDIN (FORMAT BINARY)`,
+    sending embeddings in pgvector's binary `vector` or `halfvec` format.
+
+    With `defer_indexes`, secondary indexes (HNSW, GIN, btree) are dropped
+    before the first write and rebuilt once when the writer closes, all in
+    the same transaction: a failed load rolls back to the previous indexes.
+    Other connections cannot read or write the table in between.
+
+    The versions of the written datasets are bumped in the same transaction.
+    """
+
+    def __init__(
+        self,
+        connection: psycopg.Connection,
+        table_name: str = CompanyContent.__tablename__,
+        columns: Sequence[str] = tuple(COPY_COLUMNS),
+        defer_indexes: bool = False,
+    ):
+        self.connection = connection
+        self.table_name = table_name
+        self.columns = list(columns)
+        self.defer_indexes = defer_indexes
+        self.rows = 0
+        self.datasets = set()
+        self._deferred = None
+        self.embedding_type = "halfvec" if isinstance(CompanyContent.embedding.type, HalfVector) else "vector"
+
+    def __enter__(self):
+        register_vector(self.connection)
+        if self.embedding_type == "halfvec":
+            register_halfvec(self.connection)
+        return self
+
+    def _drop_indexes(self):
+        with self.connection.cursor() as cursor:
+            self._deferred = secondary_indexes(cursor, self.table_name)
+            for name, _ in self._deferred:
+                cursor.execute(sql.SQL("DROP INDEX {}").format(sql.Identifier(name)))
+        logger.info(f"Deferred {len(self._deferred)} indexes on {self.table_name}")
+
+    def write(self, rows: Iterable[Dict]) -> int:
+        if self.defer_indexes and self._deferred is None:
+            self._drop_indexes()
+        query = sql.SQL("COPY {table} ({columns}) FROM STDIN (FORMAT BINARY)").format(
+            table=sql.Identifier(self.table_name),
+            columns=sql.SQL(", ").join(map(sql.Identifier, self.columns)),
+        )
+        written = 0
+        with self.connection.cursor() as cursor:
+            with cursor.copy(query) as copy:
+                copy.set_types([
+                    self.embedding_type if column == "embedding" else COPY_COLUMNS[column]
+                    for column in self.columns
+                ])
+                for row in rows:
+                    copy.write_row([row.get(column) for column in self.columns])
+                    self.datasets.add(row.get("dataset"))
+                    written += 1
+        self.rows += written
+        return written
+
+    def set_content_hashes(self, hashes: Iterable[Tuple[int, str]]) -> None:
+        """
+        Sets the `content_hash` of `(id, hash)` rows in the writer's
+        transaction, i.e. of parents whose last chunk it wrote.
+        """
+        query = sql.SQL("UPDATE {table} SET content_hash = %s WHERE id = %s").format(
+            table=sql.Identifier(self.table_name)
+        )
+        with self.connection.cursor() as cursor:
+            cursor.executemany(query, [(hash, id) for id, hash in hashes])
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is not None:
+            self.connection.rollback()
+            return False
+        with self.connection.cursor() as cursor:
+            for name, definition in self._deferred or []:
+                logger.info(f"Rebuilding index {name}")
+                cursor.execute(definition)
+            if self.rows:
+                cursor.executemany(BUMP_SQL, [(key,) for key in version_keys(self.datasets)])
+        self.connection.commit()
+        return False
+
+
+def copy_contents(database_url: str, rows: Iterable[Dict], defer_indexes: bool = False, **kwargs) -> int:
+    """
+    Bulk loads already embedded content rows (dicts with an `embedding`).
+    """
+    with psycopg.connect(psycopg_url(database_url)) as connection:
+        with ContentsCopyWriter(connection, defer_indexes=defer_indexes, **kwargs) as writer:
+            return writer.write(rows)
@@ -0,0 +1,162 @@
+import sys
+import json
+import logging
+
+from datetime import datetime
+from typing import IO, Dict, Iterable, Iterator, Optional, Sequence, Union
+
+from sqlalchemy import and_, create_engine, func, literal, or_, select
+from sqlalchemy.pool import NullPool
+
+from .models import Chat, ChatMessages
+
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ("jsonl", "parquet")
+
+
+def messages_query(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    dataset: Optional[str] = None,
+    tags: Sequence[str] = (),
+):
+    """
+    Selects chat messages with their session tags, in (timestamp, id) order.
+
+    `dataset` keeps the sessions of agents created with that dataset (their
+    session ids are prefixed with `{dataset}_`). `tags` keeps sessions
+    tagged with any of them, tags being stored comma separated.
+    """
+    query = (
+        select(
+            ChatMessages.id,
+            ChatMessages.session_id,
+            ChatMessages.parent,
+            ChatMessages.timestamp,
+            Chat.tags,
+            ChatMessages.message,
+        )
+        .outerjoin(Chat, Chat.session_id == ChatMessages.session_id)
+        .order_by(ChatMessages.timestamp, ChatMessages.id)
+    )
+    conditions = []
+    if since is not None:
+        conditions.append(ChatMessages.timestamp >= since)
+    if until is not None:
+        conditions.append(ChatMessages.timestamp < until)
+    if dataset is not None:
+        conditions.append(ChatMessages.session_id.startswith(f"{dataset}_", autoescape=True))
+    if tags:
+        padded = literal(",") + func.replace(Chat.tags, " ", "") + literal(",")
+        conditions.append(or_(*(padded.contains(f",{tag.strip()},", autoescape=True) for tag in tags)))
+    if conditions:
+        query = query.where(and_(*conditions))
+    return query
+
+
+def export_record(row) -> Dict:
+    message = row.message if isinstance(row.message, dict) else json.loads(row.message)
+    return {
+        "id": row.id,
+        "session_id": row.session_id,
+        "parent": row.parent,
+        "timestamp": row.timestamp,
+        "tags": row.tags,
+        "type": message.get("type"),
+        "content": (message.get("data") or {}).get("content"),
+        "message": message,
+    }
+
+
+def iter_messages(connection, batch_size: int = 5000, **filters) -> Iterator[Iterable[Dict]]:
+    """
+    Streams the selected messages (see `messages_query`) in batches of
+    `batch_size` records, through a server-side cursor on Postgres.
+    """
+    result = connection.execution_options(stream_results=True, yield_per=batch_size).execute(
+        messages_query(**filters)
+    )
+    for rows in result.partitions():
+        yield [export_record(row) for row in rows]
+
+
+def write_jsonl(batches: Iterator[Iterable[Dict]], output: IO[str]) -> int:
+    written = 0
+    for batch in batches:
+        for record in batch:
+            record = dict(record, timestamp=record["timestamp"].isoformat())
+            output.write(json.dumps(record, default=str) + "\n")
+            written += 1
+    return written
+
+
+def write_parquet(batches: Iterator[Iterable[Dict]], path: str) -> int:
+    """
+    Writes one Parquet row group per batch. Requires `pip install pyarrow`.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as exc:
+        raise ImportError("Parquet export requires pyarrow: pip install pyarrow") from exc
+
+    schema = pa.schema([
+        ("id", pa.int64()),
+        ("session_id", pa.string()),
+        ("parent", pa.int64()),
+        ("timestamp", pa.timestamp("us")),
+        ("tags", pa.string()),
+        ("type", pa.string()),
+        ("content", pa.string()),
+        ("message", pa.string()),
+    ])
+    written = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for batch in batches:
+            batch = [dict(record, message=json.dumps(record["message"])) for record in batch]
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+            written += len(batch)
+    return written
+
+
+def export_messages(
+    database_url: str,
+    output: Union[str, IO[str]] = "-",
+    format: str = "jsonl",
+    batch_size: int = 5000,
+    **filters,
+) -> int:
+    """
+    Exports chat messages to `output` (a path, or "-" for stdout with jsonl)
+    in constant memory and returns the number of exported messages.
+
+    The export runs on its own connection (no pool), inside a single
+    read-only transaction, so it neither takes connections from the
+    application pools nor sees a moving snapshot.
+    """
+    if format not in EXPORT_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    if format == "parquet" and (not isinstance(output, str) or output == "-"):
+        raise ValueError("Parquet exports need an output path")
+
+    engine = create_engine(database_url, poolclass=NullPool)
+    try:
+        with engine.connect() as connection:
+            if connection.dialect.name == "postgresql":
+                connection.exec_driver_sql("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+            batches = iter_messages(connection, batch_size=batch_size, **filters)
+            if format == "parquet":
+                written = write_parquet(batches, output)
+            elif output == "-":
+                written = write_jsonl(batches, sys.stdout)
+            elif isinstance(output, str):
+                with open(output, "w") as file:
+                    written = write_jsonl(batches, file)
+            else:
+                written = write_jsonl(batches, output)
+    finally:
+        engine.dispose()
+    logger.info(f"Exported {written} messages")
+    return written
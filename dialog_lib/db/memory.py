@@ -1,18 +1,27 @@
-import psycopg
-
 from typing import List
+from functools import partial
 from psycopg import sql
+from psycopg.types.json import Jsonb
 
 from .models import Chat, ChatMessages
-from .session import get_session, get_async_session, get_async_psycopg_connection
+from sqlalchemy import select, text
+
+from .prepared import fetch_messages
+from .session import checkout, get_session, get_async_session, async_psycopg_connection, get_read_your_writes
+from dialog_lib.instrumentation import get_instrumentation
 
 from langchain_postgres import PostgresChatMessageHistory
-from langchain.schema.messages import BaseMessage, _message_to_dict
+from langchain.schema.messages import BaseMessage, _message_to_dict, messages_from_dict
 
 
 class CustomPostgresChatMessageHistory(PostgresChatMessageHistory):
     """
     Custom chat message history for LLM
+
+    Sync reads and writes go through `dbsession` (its pooled connection is
+    only held for each query), async ones through the async psycopg pool.
+    `connection_string` and `ssl_mode` are accepted for compatibility but
+    no longer open a connection of their own.
     """
 
     def __init__(
@@ -24,27 +33,26 @@ class CustomPostgresChatMessageHistory(PostgresChatMessageHistory):
         chats_model=Chat,
         chat_messages_model=ChatMessages,
         ssl_mode=None,
+        instrumentation=None,
+        read_dbsession=None,
+        dataset=None,
         **kwargs,
     ):
         self.parent_session_id = parent_session_id
+        self.instrumentation = instrumentation or get_instrumentation()
         self.dbsession = dbsession
+        self.read_dbsession = read_dbsession
+        # picks the shard of the async connections (see `dialog_lib.db.shards`)
+        self.dataset = dataset
+        if async_dbsession is get_async_session:
+            async_dbsession = partial(get_async_session, dataset)
         self.async_dbsession = async_dbsession
         self.chats_model = chats_model
         self.chat_messages_model = chat_messages_model
-        self._connection = psycopg.connect(
-            kwargs.pop("connection_string"), sslmode=ssl_mode
-        )
-        self._async_connection = None  # Will be initialized when needed
+        kwargs.pop("connection_string", None)
         self._session_id = kwargs.pop("session_id")
         self._table_name = kwargs.pop("table_name", chat_messages_model.__tablename__)
 
-        self.cursor = self._connection.cursor()
-
-    async def _initialize_async_connection(self):
-        if self._async_connection is None:
-            self._async_connection = await get_async_psycopg_connection()
-        return self._async_connection
-
     def _create_tables_queries(self, table_name):
         index_name = f"idx_{table_name}_session_id"
         return [
@@ -71,7 +79,7 @@ class CustomPostgresChatMessageHistory(PostgresChatMessageHistory):
         return [
             sql.SQL(
                 """
-                SELECT message FROM {table_name} WHERE session_id = {session_id};
+                SELECT message FROM {table_name} WHERE session_id = {session_id} ORDER BY timestamp, id;
                 """
             ).format(
                 table_name=sql.Identifier(table_name),
@@ -85,40 +93,61 @@ class CustomPostgresChatMessageHistory(PostgresChatMessageHistory):
         Add a new column for timestamp
         """
         create_table_queries = self._create_tables_queries(self._table_name)
-        for query in create_table_queries:
-            self.cursor.execute(query)
-        self._connection.commit()
+        with checkout(self.dbsession) as session:
+            for query in create_table_queries:
+                session.execute(text(query.as_string(None)))
 
     async def acreate_tables(self) -> None:
         """
         Asynchronously create tables.
         """
         create_table_queries = self._create_tables_queries(self._table_name)
-        async_conn = await self._initialize_async_connection()
-        async with async_conn.cursor() as cursor:
+        async with async_psycopg_connection(self.dataset) as async_conn, async_conn.cursor() as cursor:
             for query in create_table_queries:
                 await cursor.execute(query)
-            await async_conn.commit()
 
     def get_messages(self):
         """
-        Retrieve messages synchronously.
+        Retrieve messages synchronously, rebuilt from the stored dicts into
+        `BaseMessage`s like `aget_messages` does.
+        """
+        with self.instrumentation.stage("history_load") as record:
+            if self.read_dbsession is not None and not get_read_your_writes().needs_primary(self._session_id):
+                with self.read_dbsession() as session:
+                    rows = self._read_messages(session)
+            else:
+                with checkout(self.dbsession) as session:
+                    rows = self._read_messages(session)
+            record.set(rows=len(rows))
+        return messages_from_dict([row[0] for row in rows])
+
+    def _read_messages(self, session):
+        """
+        Reads the messages with `session`: `read_dbsession` (a replica) unless
+        this process wrote to the session recently (read-your-own-writes),
+        `dbsession` otherwise.
         """
-        get_messages_query = self._get_messages_query(self._table_name)
-        for query in get_messages_query:
-            self.cursor.execute(query)
-        return [row[0] for row in self.cursor.fetchall()]
+        model = self.chat_messages_model
+        rows = fetch_messages(session, self._table_name, self._session_id)
+        if rows is not None:
+            return rows
+        return session.execute(
+            select(model.message).where(model.session_id == self._session_id).order_by(model.timestamp, model.id)
+        ).all()
 
     async def aget_messages(self):
         """
-        Retrieve messages asynchronously.
+        Retrieve messages asynchronously, on a connection checked out of the
+        async pool for the duration of the query.
         """
-        get_messages_query = self._get_messages_query(self._table_name)
-        async_conn = await self._initialize_async_connection()
-        async with async_conn.cursor() as cursor:
-            for query in get_messages_query:
-                await cursor.execute(query)
-            return [row[0] for row in await cursor.fetchall()]
+        with self.instrumentation.stage("history_load") as record:
+            get_messages_query = self._get_messages_query(self._table_name)
+            async with async_psycopg_connection(self.dataset) as async_conn, async_conn.cursor() as cursor:
+                for query in get_messages_query:
+                    await cursor.execute(query)
+                rows = await cursor.fetchall()
+            record.set(rows=len(rows))
+        return messages_from_dict([row[0] for row in rows])
 
     def add_tags(self, tags: str) -> None:
         """
@@ -146,8 +175,10 @@ class CustomPostgresChatMessageHistory(PostgresChatMessageHistory):
         )
         if self.parent_session_id:
             message.parent = self.parent_session_id
-        self.dbsession.add(message)
-        self.dbsession.commit()
+        with self.instrumentation.stage("history_write", rows=1):
+            self.dbsession.add(message)
+            self.dbsession.commit()
+        get_read_your_writes().mark_written(self._session_id)
 
     async def aadd_messages(self, messages: List[BaseMessage]) -> None:
         """
@@ -160,15 +191,15 @@ class CustomPostgresChatMessageHistory(PostgresChatMessageHistory):
         """
         Asynchronously append the message to the record in PostgreSQL.
         """
-        async_conn = await self._initialize_async_connection()
-        async with async_conn.cursor() as cursor:
-            await cursor.execute(
-                sql.SQL("INSERT INTO {table_name} (session_id, message) VALUES (%s, %s)").format(
-                    table_name=sql.Identifier(self._table_name)
-                ),
-                (self._session_id, _message_to_dict(message))
-            )
-            await async_conn.commit()
+        with self.instrumentation.stage("history_write", rows=1):
+            async with async_psycopg_connection(self.dataset) as async_conn, async_conn.cursor() as cursor:
+                await cursor.execute(
+                    sql.SQL("INSERT INTO {table_name} (session_id, message) VALUES (%s, %s)").format(
+                        table_name=sql.Identifier(self._table_name)
+                    ),
+                    (self._session_id, Jsonb(_message_to_dict(message)))
+                )
+        get_read_your_writes().mark_written(self._session_id)
 
 
 def generate_memory_instance(
@@ -195,7 +226,7 @@ def generate_memory_instance(
 
 
 def add_user_message_to_message_history(
-    session_id, message, memory=None, dbsession=get_session(), database_url=None
+    session_id, message, memory=None, dbsession=None, database_url=None
 ):
     """
     Add a user message to the message history and returns the updated
@@ -203,17 +234,20 @@ def add_user_message_to_message_history(
     """
     if not memory:
         memory = generate_memory_instance(
-            session_id, dbsession=dbsession, database_url=database_url
+            session_id, dbsession=dbsession if dbsession is not None else get_session(),
+            database_url=database_url
         )
 
     memory.add_user_message(message)
     return memory
 
 
-def get_messages(session_id, dbsession=get_session(), database_url=None):
+def get_messages(session_id, dbsession=None, database_url=None):
     """
     Get all messages for a given session_id
     """
+    if dbsession is None:
+        dbsession = get_session()
     memory = generate_memory_instance(
         session_id, dbsession=dbsession, database_url=database_url
     )
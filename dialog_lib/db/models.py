@@ -1,11 +1,18 @@
+import os
 import uuid
 
 from sqlalchemy import Table, MetaData
-from sqlalchemy import Column, Integer, DateTime, String, text, Text
-from sqlalchemy.orm import DeclarativeBase
-from sqlalchemy.dialects.postgresql import UUID, JSONB
+from sqlalchemy import BigInteger, Column, Computed, ForeignKey, Integer, DateTime, JSON, String, Index, text, Text
+from sqlalchemy.orm import DeclarativeBase, deferred
+from sqlalchemy.dialects.postgresql import UUID, JSONB, TSVECTOR
 
-from pgvector.sqlalchemy import Vector
+from .types import embedding_type, text_search_config, tsvector_document
+
+
+EMBEDDING_TYPE = os.environ.get("DIALOG_EMBEDDING_TYPE", "vector")
+EMBEDDING_DIMENSION = int(os.environ.get("DIALOG_EMBEDDING_DIMENSION", 1536))
+# "simple" keeps product codes and names intact; use i.e. "english" for stemming
+TEXT_SEARCH_CONFIG = text_search_config(os.environ.get("DIALOG_TEXT_SEARCH_CONFIG", "simple"))
 
 
 class Base(DeclarativeBase):
@@ -41,6 +48,94 @@ class CompanyContent(Base):
     subcategory = Column(String, nullable=False)
     question = Column(String, nullable=False)
     content = Column(Text, nullable=False)
-    embedding = Column(Vector(1536), nullable=False)
+    # NULL on parent rows, whose chunks carry the embeddings
+    embedding = Column(embedding_type(EMBEDDING_TYPE, EMBEDDING_DIMENSION), nullable=True)
     dataset = Column(String, nullable=True)
     link = Column(String, nullable=True)
+    parent_id = Column(Integer, ForeignKey("contents.id", ondelete="CASCADE"), nullable=True, index=True)
+    chunk_index = Column(Integer, nullable=True)
+    source = Column(String, nullable=True)
+    source_key = Column(String, nullable=True)
+    content_hash = Column(String(64), nullable=True)
+    # only read by the "hybrid" search mode, so not loaded with the row
+    search_vector = deferred(Column(
+        TSVECTOR, Computed(tsvector_document(TEXT_SEARCH_CONFIG, "question", "content"), persisted=True)
+    ))
+
+    __table_args__ = (
+        Index("idx_contents_source_key", "source", "source_key"),
+        Index("idx_contents_search_vector", "search_vector", postgresql_using="gin"),
+    )
+
+
+class DatasetVersion(Base):
+    """
+    Counter bumped by every write to a dataset's contents. The row with an
+    empty dataset is bumped by every write and versions unfiltered searches.
+    """
+    __tablename__ = "dataset_versions"
+
+    dataset = Column(String, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+
+
+class RetrievalCacheEntry(Base):
+    __tablename__ = "retrieval_cache"
+
+    key = Column(String(64), primary_key=True)
+    dataset = Column(String, nullable=False)
+    version = Column(BigInteger, nullable=False)
+    documents = Column(JSON().with_variant(JSONB(), "postgresql"), nullable=False)
+    created_at = Column(
+        DateTime, nullable=False, server_default=text("CURRENT_TIMESTAMP"), index=True
+    )
+
+
+class DatasetShard(Base):
+    """
+    Shard holding a dataset's contents and chats (see `dialog_lib.db.shards`).
+    Lives in the default database; unlisted datasets stay there.
+    """
+    __tablename__ = "dataset_shards"
+
+    dataset = Column(String, primary_key=True)
+    shard = Column(String, nullable=False)
+    updated_at = Column(
+        DateTime, nullable=False, server_default=text("CURRENT_TIMESTAMP"), onupdate=text("CURRENT_TIMESTAMP")
+    )
+
+
+class ShardMove(Base):
+    """
+    Progress of a dataset being copied to another shard, stored on that
+    shard in the same transactions as the copied rows.
+    """
+    __tablename__ = "shard_moves"
+
+    dataset = Column(String, primary_key=True)
+    source = Column(String, nullable=False)
+    target = Column(String, nullable=False)
+    status = Column(String, nullable=False)
+    contents_version = Column(BigInteger, nullable=True)
+    message_watermark = Column(BigInteger, nullable=False, default=0)
+    messages_copied = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(
+        DateTime, nullable=False, server_default=text("CURRENT_TIMESTAMP"), onupdate=text("CURRENT_TIMESTAMP")
+    )
+
+
+class EmbeddingMigrationState(Base):
+    """
+    Progress of a shadow column embedding migration (see `dialog_lib.embeddings.migration`).
+    """
+    __tablename__ = "embedding_migrations"
+
+    name = Column(String, primary_key=True)
+    embedding_type = Column(String, nullable=False)
+    dimension = Column(Integer, nullable=False)
+    status = Column(String, nullable=False)
+    last_id = Column(Integer, nullable=False, default=0)
+    rows_done = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(
+        DateTime, nullable=False, server_default=text("CURRENT_TIMESTAMP"), onupdate=text("CURRENT_TIMESTAMP")
+    )
@@ -0,0 +1,130 @@
+import logging
+
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import sqlalchemy as sa
+from psycopg import sql
+from psycopg.rows import namedtuple_row
+from pgvector.psycopg import register_vector
+from pgvector.sqlalchemy import Vector
+
+from .models import CompanyContent
+from .types import HalfVector
+
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=16)
+def content_columns(model=CompanyContent) -> Tuple[str, ...]:
+    """
+    The `model`'s columns read by the prepared search: all of them but the
+    embeddings (of any vector type) and the deferred ones (i.e. `search_vector`).
+    """
+    return tuple(
+        column.name
+        for attribute in sa.inspect(model).column_attrs
+        if not attribute.deferred
+        for column in attribute.columns
+        if isinstance(column, sa.Column) and not isinstance(column.type, Vector)
+    )
+
+
+def psycopg_connection(session):
+    """
+    The psycopg 3 connection behind the session's pooled connection, with
+    pgvector's adapters registered once per connection, or None when the
+    session runs on another driver (i.e. psycopg2 or SQLite).
+
+    Statements sent with `prepare=True` on it stay prepared for the life of
+    the pooled connection, so they are parsed and planned once per connection.
+    """
+    connection = session.connection()
+    if connection.dialect.driver != "psycopg":
+        return None
+    pooled = connection.connection
+    if "pgvector_registered" not in pooled.info:
+        register_vector(pooled.driver_connection)
+        pooled.info["pgvector_registered"] = True
+    return pooled.driver_connection
+
+
+@lru_cache(maxsize=64)
+def contents_search_sql(
+    table_name: str, embedding_column: str, embedding_type: str, by_dataset: bool, columns: Tuple[str, ...]
+):
+    """
+    Exact cosine search matching `build_relevant_contents_query` in the
+    "vector" mode, selecting `columns`. The query embedding is sent once, in
+    pgvector's binary format.
+    """
+    column = sql.Identifier(embedding_column)
+    embedding = sql.SQL("%(embedding)b::{}").format(sql.SQL(embedding_type))
+    distance = sql.SQL("{} <=> {}").format(column, embedding)
+    dataset_filter = sql.SQL(" AND dataset = %(dataset)s") if by_dataset else sql.SQL("")
+    return sql.SQL(
+        "SELECT {columns}, {distance} AS distance FROM {table} "
+        "WHERE {distance} < %(threshold)s{dataset_filter} ORDER BY {distance} LIMIT %(top)s"
+    ).format(
+        columns=sql.SQL(", ").join(map(sql.Identifier, columns)),
+        distance=distance,
+        table=sql.Identifier(table_name),
+        dataset_filter=dataset_filter,
+    )
+
+
+def search_contents(
+    session,
+    message_embedding: Sequence[float],
+    top: int = 5,
+    dataset: Optional[str] = None,
+    cosine_similarity_threshold: float = 0.5,
+    model=CompanyContent,
+    embedding_column: str = "embedding",
+) -> Optional[List[Tuple[Any, float]]]:
+    """
+    Runs the vector search as a prepared statement and returns (row, cosine
+    similarity) pairs, rows being named tuples with the `content_columns` of
+    `model` (plus `distance`) instead of ORM entities. Returns None when the
+    session isn't on psycopg 3.
+    """
+    connection = psycopg_connection(session)
+    if connection is None:
+        return None
+    column_type = getattr(model, embedding_column).type
+    query = contents_search_sql(
+        model.__tablename__,
+        embedding_column,
+        "halfvec" if isinstance(column_type, HalfVector) else "vector",
+        dataset is not None,
+        content_columns(model),
+    )
+    params: Dict[str, Any] = {
+        "embedding": np.asarray(message_embedding, dtype=np.float32),
+        "threshold": cosine_similarity_threshold,
+        "top": top,
+        "dataset": dataset,
+    }
+    with connection.cursor(row_factory=namedtuple_row) as cursor:
+        cursor.execute(query, params, prepare=True)
+        return [(row, 1 - row.distance) for row in cursor.fetchall()]
+
+
+@lru_cache(maxsize=16)
+def messages_sql(table_name: str):
+    return sql.SQL("SELECT message FROM {} WHERE session_id = %s ORDER BY timestamp, id").format(sql.Identifier(table_name))
+
+
+def fetch_messages(session, table_name: str, session_id: str) -> Optional[List[Tuple[Dict]]]:
+    """
+    Reads a chat session's messages as a prepared statement, or returns
+    None when the session isn't on psycopg 3.
+    """
+    connection = psycopg_connection(session)
+    if connection is None:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(messages_sql(table_name), (session_id,), prepare=True)
+        return cursor.fetchall()
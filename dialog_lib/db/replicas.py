@@ -0,0 +1,134 @@
+import time
+import logging
+import threading
+
+from typing import Callable, Dict, Iterable, Optional
+
+import sqlalchemy as sa
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+logger = logging.getLogger(__name__)
+
+LAG_QUERY = "SELECT COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)"
+
+
+class Replica:
+    def __init__(self, url: str, engine_factory: Callable[[str], Engine]):
+        self.url = url
+        self._engine_factory = engine_factory
+        self._engine = None
+        self.healthy = True
+        self.checked_at = 0.0
+
+    @property
+    def engine(self) -> Engine:
+        if self._engine is None:
+            self._engine = self._engine_factory(self.url)
+            event.listen(self._engine, "handle_error", self._on_error)
+        return self._engine
+
+    def _on_error(self, context):
+        if context.is_disconnect or isinstance(context.sqlalchemy_exception, sa.exc.OperationalError):
+            self.mark_unhealthy()
+
+    def mark_unhealthy(self):
+        logger.warning(f"Replica {sa.engine.make_url(self.url).host} marked unhealthy")
+        self.healthy = False
+        self.checked_at = time.monotonic()
+
+
+class ReplicaRouter:
+    """
+    Hands out read replica engines round-robin, skipping unhealthy ones and
+    falling back to the primary when no replica is healthy (or configured).
+
+    A replica is checked at most every `health_check_interval` seconds, with
+    `SELECT 1` or, with `max_lag_seconds`, by its replay lag. Connection
+    errors raised while using a replica mark it unhealthy until the next check.
+    """
+
+    def __init__(
+        self,
+        urls: Iterable[str],
+        primary: Callable[[], Engine],
+        health_check_interval: float = 5.0,
+        max_lag_seconds: Optional[float] = None,
+        engine_factory: Callable[[str], Engine] = sa.create_engine,
+    ):
+        self.replicas = [Replica(url, engine_factory) for url in urls]
+        self.primary = primary
+        self.health_check_interval = health_check_interval
+        self.max_lag_seconds = max_lag_seconds
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def dispose(self) -> None:
+        """
+        Closes the pooled connections of the replica engines created so far.
+        """
+        for replica in self.replicas:
+            if replica._engine is not None:
+                replica._engine.dispose()
+
+    def check(self, replica: Replica) -> bool:
+        try:
+            with replica.engine.connect() as connection:
+                if self.max_lag_seconds is None:
+                    connection.execute(sa.text("SELECT 1"))
+                    healthy = True
+                else:
+                    healthy = connection.execute(sa.text(LAG_QUERY)).scalar() <= self.max_lag_seconds
+        except sa.exc.DBAPIError as exc:
+            logger.warning(f"Replica health check failed: {exc}")
+            healthy = False
+        replica.healthy = healthy
+        replica.checked_at = time.monotonic()
+        return healthy
+
+    def is_healthy(self, replica: Replica) -> bool:
+        if time.monotonic() - replica.checked_at < self.health_check_interval:
+            return replica.healthy
+        return self.check(replica)
+
+    def engine(self) -> Engine:
+        for _ in range(len(self.replicas)):
+            with self._lock:
+                replica = self.replicas[self._next % len(self.replicas)]
+                self._next += 1
+            if self.is_healthy(replica):
+                return replica.engine
+        return self.primary()
+
+
+class ReadYourWrites:
+    """
+    Remembers the keys (i.e. chat session ids) written in the last `window`
+    seconds by this process, whose reads must go to the primary until the
+    replicas caught up.
+
+    Only this process's writes are known: with several workers, a session
+    whose turns land on different workers may read a replica that doesn't
+    have its latest messages yet. Route a session's requests to one worker
+    (sticky load balancing), or bound the lag with DATABASE_REPLICA_MAX_LAG.
+    """
+
+    def __init__(self, window: float = 30.0, maxsize: int = 100000):
+        self.window = window
+        self.maxsize = maxsize
+        self._written: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def mark_written(self, key: str) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._written[key] = now
+            if len(self._written) > self.maxsize:
+                self._written = {
+                    key: written_at for key, written_at in self._written.items() if now - written_at < self.window
+                }
+
+    def needs_primary(self, key: str) -> bool:
+        written_at = self._written.get(key)
+        return written_at is not None and time.monotonic() - written_at < self.window
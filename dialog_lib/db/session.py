@@ -1,20 +1,102 @@
 import os
+import logging
 from functools import lru_cache
 
 import sqlalchemy as sa
-from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.orm import Session
 
 from contextlib import contextmanager, asynccontextmanager
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from psycopg_pool import AsyncConnectionPool
 
+from .bulk import psycopg_url
+from .replicas import ReadYourWrites, ReplicaRouter
+from .shards import DEFAULT_SHARD, ShardRouter, parse_shard_urls
+
+logger = logging.getLogger(__name__)
+
+def engine_pool_options():
+    """
+    `create_engine` pool arguments read from DATABASE_POOL_SIZE,
+    DATABASE_MAX_OVERFLOW, DATABASE_POOL_TIMEOUT (seconds waiting for a
+    connection), DATABASE_POOL_RECYCLE (seconds before a connection is
+    replaced) and DATABASE_POOL_PRE_PING. Unset ones keep SQLAlchemy's defaults.
+    """
+    options = {}
+    for name, option, cast in (
+        ("DATABASE_POOL_SIZE", "pool_size", int),
+        ("DATABASE_MAX_OVERFLOW", "max_overflow", int),
+        ("DATABASE_POOL_TIMEOUT", "pool_timeout", float),
+        ("DATABASE_POOL_RECYCLE", "pool_recycle", int),
+    ):
+        if os.environ.get(name):
+            options[option] = cast(os.environ[name])
+    if os.environ.get("DATABASE_POOL_PRE_PING"):
+        options["pool_pre_ping"] = os.environ["DATABASE_POOL_PRE_PING"].lower() in ("1", "true", "yes")
+    return options
+
+def psycopg_pool_options():
+    """
+    `AsyncConnectionPool` arguments matching `engine_pool_options`: it keeps
+    DATABASE_POOL_SIZE connections (5 by default) and grows by up to
+    DATABASE_MAX_OVERFLOW (10 by default) under load.
+    """
+    options = engine_pool_options()
+    min_size = options.get("pool_size", 5)
+    pool_options = {
+        "min_size": min_size,
+        "max_size": min_size + options.get("max_overflow", 10),
+        "timeout": options.get("pool_timeout", 30.0),
+    }
+    if options.get("pool_recycle", -1) > 0:
+        pool_options["max_lifetime"] = float(options["pool_recycle"])
+    return pool_options
+
 @lru_cache()
 def get_sync_engine():
-    return sa.create_engine(os.environ.get("DATABASE_URL"))
+    return sa.create_engine(os.environ.get("DATABASE_URL"), **engine_pool_options())
+
+@lru_cache()
+def get_shard_router():
+    """
+    The `ShardRouter` over DATABASE_SHARDS (name=url pairs, DATABASE_URL
+    being the "default" shard), or None when no shard is configured.
+    """
+    urls = parse_shard_urls(os.environ.get("DATABASE_SHARDS", ""))
+    if not urls:
+        return None
+    return ShardRouter(
+        urls,
+        primary=get_sync_engine,
+        refresh_interval=float(os.environ.get("DATABASE_SHARD_REFRESH_INTERVAL", 30)),
+        engine_factory=lambda url: sa.create_engine(url, **engine_pool_options()),
+    )
+
+def get_shard(dataset=None):
+    router = get_shard_router()
+    return DEFAULT_SHARD if router is None else router.shard(dataset)
+
+def get_engine(dataset=None):
+    """
+    The engine of the shard holding `dataset`, the DATABASE_URL one
+    without shards or dataset.
+    """
+    if get_shard(dataset) == DEFAULT_SHARD:
+        return get_sync_engine()
+    return get_shard_router().engine(dataset)
+
+def get_database_url(dataset=None, default=None):
+    """
+    The database URL of the shard holding `dataset`: `default` (or
+    DATABASE_URL) for the default shard.
+    """
+    if get_shard(dataset) == DEFAULT_SHARD:
+        return default if default is not None else os.environ.get("DATABASE_URL")
+    return get_shard_router().url(dataset)
 
 @contextmanager
-def sync_session_scope():
-    with Session(bind=get_sync_engine()) as session:
+def sync_session_scope(dataset=None):
+    with Session(bind=get_engine(dataset)) as session:
         try:
             yield session
             session.commit()
@@ -24,40 +106,125 @@ def sync_session_scope():
         finally:
             session.close()
 
-def get_session():
-    with sync_session_scope() as session:
+def get_session(dataset=None):
+    with sync_session_scope(dataset) as session:
         return session
 
+@contextmanager
+def checkout(session: Session):
+    """
+    Scopes one unit of work on a long lived session (i.e. the one handed to a
+    retriever): when the session wasn't already in a transaction, the one
+    started inside is committed (rolled back on errors), so the connection
+    goes back to the pool instead of idling in transaction between turns.
+    """
+    if session.in_transaction():
+        yield session
+        return
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+
+def get_replica_urls():
+    return [url.strip() for url in os.environ.get("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+
+@lru_cache()
+def get_replica_router():
+    max_lag = os.environ.get("DATABASE_REPLICA_MAX_LAG")
+    return ReplicaRouter(
+        get_replica_urls(),
+        primary=get_sync_engine,
+        health_check_interval=float(os.environ.get("DATABASE_REPLICA_HEALTH_INTERVAL", 5)),
+        max_lag_seconds=float(max_lag) if max_lag else None,
+        engine_factory=lambda url: sa.create_engine(url, **engine_pool_options()),
+    )
+
 @lru_cache()
-def get_async_engine():
-    return create_async_engine(os.environ.get("DATABASE_URL"))
+def get_read_your_writes():
+    return ReadYourWrites(window=float(os.environ.get("DATABASE_REPLICA_STICKINESS", 30)))
+
+@contextmanager
+def read_session_scope(dataset=None):
+    """
+    Session on a read replica (see DATABASE_REPLICA_URLS), or on the
+    primary when none is configured or healthy. Never commits.
+
+    Datasets on another shard than the default one are read from that shard.
+    """
+    engine = get_replica_router().engine() if get_shard(dataset) == DEFAULT_SHARD else get_engine(dataset)
+    with Session(bind=engine) as session:
+        try:
+            yield session
+        finally:
+            session.rollback()
+            session.close()
+
+def get_read_session(dataset=None):
+    with read_session_scope(dataset) as session:
+        return session
+
+_async_engines = {}
+_async_sessionmakers = {}
+
+def get_async_engine(dataset=None):
+    """
+    The async engine of the shard holding `dataset`, the DATABASE_URL one
+    without shards or dataset.
+    """
+    shard = get_shard(dataset)
+    if shard not in _async_engines:
+        _async_engines[shard] = create_async_engine(get_database_url(dataset), **engine_pool_options())
+    return _async_engines[shard]
+
+def get_async_sessionmaker(dataset=None):
+    shard = get_shard(dataset)
+    if shard not in _async_sessionmakers:
+        _async_sessionmakers[shard] = async_sessionmaker(get_async_engine(dataset), expire_on_commit=False)
+    return _async_sessionmakers[shard]
 
 @asynccontextmanager
-async def async_session_scope():
-    async_session = sessionmaker(
-        get_async_engine(), class_=AsyncSession, expire_on_commit=False
-    )
-    async with async_session() as session:
+async def async_session_scope(dataset=None):
+    async with get_async_sessionmaker(dataset)() as session:
         try:
             yield session
             await session.commit()
         except Exception as exc:
             await session.rollback()
             raise exc
-        finally:
-            await session.close()
 
-async def get_async_session():
-    async with async_session_scope() as session:
-        return session
+async def get_async_session(dataset=None):
+    """
+    A new `AsyncSession` on the shard holding `dataset`, owned by the
+    caller: close it (or use it as an async context manager) to give its
+    connection back to the pool. Prefer `async_session_scope`.
+    """
+    return get_async_sessionmaker(dataset)()
 
-@lru_cache()
-def create_async_psycopg_pool():
-    return AsyncConnectionPool(os.environ.get("DATABASE_URL"))
+_psycopg_pools = {}
+
+def create_async_psycopg_pool(dataset=None):
+    """
+    The async psycopg pool of the shard holding `dataset`, created closed.
+    """
+    shard = get_shard(dataset)
+    if shard not in _psycopg_pools:
+        _psycopg_pools[shard] = AsyncConnectionPool(
+            psycopg_url(get_database_url(dataset)), open=False, name=f"dialog-{shard}", **psycopg_pool_options()
+        )
+    return _psycopg_pools[shard]
 
 @asynccontextmanager
-async def async_psycopg_connection():
-    pool = create_async_psycopg_pool()
+async def async_psycopg_connection(dataset=None):
+    """
+    Checks a connection out of the async psycopg pool of `dataset`'s shard
+    (opening the pool on first use), committing on success and rolling back
+    on errors.
+    """
+    pool = create_async_psycopg_pool(dataset)
+    await pool.open()
     async with pool.connection() as conn:
         try:
             yield conn
@@ -66,6 +233,103 @@ async def async_psycopg_connection():
             await conn.rollback()
             raise
 
-async def get_async_psycopg_connection():
-    async with async_psycopg_connection() as conn:
-        return conn
\ No newline at end of file
+async def get_async_psycopg_connection(dataset=None):
+    """
+    A connection checked out of the async psycopg pool, owned by the caller
+    until it is handed back with `release_async_psycopg_connection`.
+    Prefer `async_psycopg_connection`.
+    """
+    pool = create_async_psycopg_pool(dataset)
+    await pool.open()
+    return await pool.getconn()
+
+async def release_async_psycopg_connection(conn, dataset=None):
+    await create_async_psycopg_pool(dataset).putconn(conn)
+
+async def startup(timeout: float = 30.0):
+    """
+    Opens the async pools before the first request, i.e. in a FastAPI
+    lifespan: waits for the psycopg pool's minimum connections and checks
+    the async engine can connect.
+    """
+    await create_async_psycopg_pool().open(wait=True, timeout=timeout)
+    async with get_async_engine().connect():
+        pass
+    logger.info(f"Database pools ready: {pool_stats()}")
+
+async def shutdown():
+    """
+    Closes every pool this module created (async psycopg pools, async and
+    sync engines, replica and shard engines). Later calls build new ones,
+    so it also suits tests and event loop restarts.
+    """
+    for pool in list(_psycopg_pools.values()):
+        await pool.close()
+    _psycopg_pools.clear()
+    for engine in list(_async_engines.values()):
+        await engine.dispose()
+    _async_engines.clear()
+    _async_sessionmakers.clear()
+    if get_replica_router.cache_info().currsize:
+        get_replica_router().dispose()
+        get_replica_router.cache_clear()
+    if get_shard_router.cache_info().currsize:
+        if get_shard_router() is not None:
+            get_shard_router().dispose()
+        get_shard_router.cache_clear()
+    if get_sync_engine.cache_info().currsize:
+        get_sync_engine().dispose()
+        get_sync_engine.cache_clear()
+
+def engine_pool_stats(engine):
+    """
+    Size, idle (checked in), in use (checked out) and overflow connections
+    of a SQLAlchemy engine's pool. Pools without a counter report None.
+    """
+    pool = engine.pool
+    stats = {}
+    for key, method in (("size", "size"), ("idle", "checkedin"), ("in_use", "checkedout"), ("overflow", "overflow")):
+        stats[key] = getattr(pool, method)() if hasattr(pool, method) else None
+    return stats
+
+def pool_stats():
+    """
+    Stats of the pools created so far, keyed by "sync", "async" and
+    "psycopg" (all shards together for both) and "shards" (per shard
+    engine). Never creates an engine or a pool.
+    """
+    stats = {}
+    if get_sync_engine.cache_info().currsize:
+        stats["sync"] = engine_pool_stats(get_sync_engine())
+    if _async_engines:
+        engines = [engine_pool_stats(engine.sync_engine) for engine in _async_engines.values()]
+        stats["async"] = {
+            key: None if any(engine[key] is None for engine in engines) else sum(engine[key] for engine in engines)
+            for key in engines[0]
+        }
+    if _psycopg_pools:
+        pools = [pool.get_stats() for pool in _psycopg_pools.values()]
+        size = sum(pool.get("pool_size", 0) for pool in pools)
+        idle = sum(pool.get("pool_available", 0) for pool in pools)
+        stats["psycopg"] = {
+            "size": size,
+            "idle": idle,
+            "in_use": size - idle,
+            "waiting": sum(pool.get("requests_waiting", 0) for pool in pools),
+        }
+    if get_shard_router.cache_info().currsize and get_shard_router() is not None:
+        stats["shards"] = get_shard_router().pool_stats(engine_pool_stats)
+    return stats
+
+def register_pool_gauges(exporter, name: str = "db_pool"):
+    """
+    Exposes `pool_stats` on a `PrometheusExporter` as `{name}_{pool}_{stat}`
+    gauges, i.e. `db_pool_async_in_use`. Pools not created yet read as 0.
+    """
+    def gauge(pool, stat):
+        return lambda: pool_stats().get(pool, {}).get(stat) or 0
+
+    engine_stats = ("size", "idle", "in_use", "overflow")
+    for pool, stats in (("sync", engine_stats), ("async", engine_stats), ("psycopg", ("size", "idle", "in_use", "waiting"))):
+        for stat in stats:
+            exporter.add_gauge(f"{name}_{pool}_{stat}", gauge(pool, stat), f"Connections {stat} in the {pool} pool.")
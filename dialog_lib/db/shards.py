@@ -0,0 +1,384 @@
+import time
+import logging
+import threading
+
+from typing import Callable, Dict, Iterable, Optional
+
+import sqlalchemy as sa
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from .models import Chat, ChatMessages, CompanyContent, DatasetShard, DatasetVersion, ShardMove
+from .versions import bump_dataset_versions, dataset_version
+
+
+logger = logging.getLogger(__name__)
+
+# the DATABASE_URL database, which also holds the dataset_shards directory
+DEFAULT_SHARD = "default"
+
+CONTENT_COPY_COLUMNS = [
+    column for column in CompanyContent.__table__.columns
+    if column.key not in ("id", "search_vector")
+]
+
+
+def parse_shard_urls(value: str) -> Dict[str, str]:
+    """
+    Parses DATABASE_SHARDS, i.e. "eu=postgresql+psycopg://...,us=postgresql+psycopg://...".
+    """
+    urls = {}
+    for entry in value.split(","):
+        if not entry.strip():
+            continue
+        name, separator, url = entry.partition("=")
+        if not separator or not name.strip() or not url.strip():
+            raise ValueError(f"Invalid shard {entry.strip()!r}, expected name=url")
+        urls[name.strip()] = url.strip()
+    if DEFAULT_SHARD in urls:
+        raise ValueError(f"The {DEFAULT_SHARD!r} shard is DATABASE_URL and can't be redefined")
+    return urls
+
+
+def session_prefix(dataset: str) -> str:
+    # `AbstractLLM` prefixes session ids with their dataset
+    return f"{dataset}_"
+
+
+def check_dataset_name(dataset: Optional[str]) -> None:
+    """
+    Sessions are matched to their dataset by the `{dataset}_` prefix of
+    their id, so with shards a dataset name can't contain "_": the sessions
+    of "acme_eu" would also be taken for sessions of "acme".
+    """
+    if dataset is not None and "_" in dataset:
+        raise ValueError(f"Dataset {dataset!r} can't contain '_' when using shards")
+
+
+class ShardRouter:
+    """
+    Maps datasets to shards, each with its own engine (and pool), using the
+    `dataset_shards` directory in the default database. Datasets without a
+    directory row live in the default shard.
+
+    The directory is cached for `refresh_interval` seconds, so a dataset
+    moved by another process is picked up within that delay. When the
+    directory can't be read, the last known assignments are kept.
+    """
+
+    def __init__(
+        self,
+        urls: Dict[str, str],
+        primary: Callable[[], Engine],
+        refresh_interval: float = 30.0,
+        engine_factory: Callable[[str], Engine] = sa.create_engine,
+    ):
+        self.urls = dict(urls)
+        self.primary = primary
+        self.refresh_interval = refresh_interval
+        self._engine_factory = engine_factory
+        self._engines: Dict[str, Engine] = {}
+        self._assignments: Dict[str, str] = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def shards(self):
+        return [DEFAULT_SHARD, *self.urls]
+
+    def shard_engine(self, shard: str) -> Engine:
+        if shard == DEFAULT_SHARD:
+            return self.primary()
+        if shard not in self.urls:
+            raise KeyError(f"Unknown shard {shard!r}")
+        with self._lock:
+            if shard not in self._engines:
+                self._engines[shard] = self._engine_factory(self.urls[shard])
+            return self._engines[shard]
+
+    def shard_url(self, shard: str) -> str:
+        if shard == DEFAULT_SHARD:
+            return self.primary().url.render_as_string(hide_password=False)
+        return self.urls[shard]
+
+    def assignments(self, refresh: bool = False) -> Dict[str, str]:
+        now = time.monotonic()
+        if refresh or self._loaded_at is None or now - self._loaded_at >= self.refresh_interval:
+            try:
+                with Session(self.primary()) as session:
+                    rows = session.execute(select(DatasetShard.dataset, DatasetShard.shard)).all()
+                self._assignments = {dataset: shard for dataset, shard in rows}
+            except sa.exc.SQLAlchemyError as exc:
+                logger.warning(f"Failed to read the dataset_shards directory, keeping the last one: {exc}")
+            self._loaded_at = now
+        return self._assignments
+
+    def shard(self, dataset: Optional[str], refresh: bool = False) -> str:
+        if dataset is None or not self.urls:
+            return DEFAULT_SHARD
+        return self.assignments(refresh).get(dataset, DEFAULT_SHARD)
+
+    def engine(self, dataset: Optional[str]) -> Engine:
+        return self.shard_engine(self.shard(dataset))
+
+    def url(self, dataset: Optional[str]) -> str:
+        return self.shard_url(self.shard(dataset))
+
+    def assign(self, dataset: str, shard: str) -> None:
+        """
+        Points `dataset` to `shard` in the directory, without moving rows
+        (see `DatasetMove` for that).
+        """
+        check_dataset_name(dataset)
+        self.shard_engine(shard)
+        with Session(self.primary()) as session:
+            session.merge(DatasetShard(dataset=dataset, shard=shard))
+            session.commit()
+        self.assignments(refresh=True)
+
+    def dispose(self) -> None:
+        for engine in self._engines.values():
+            engine.dispose()
+
+    def pool_stats(self, stats: Callable[[Engine], Dict]) -> Dict[str, Dict]:
+        return {shard: stats(engine) for shard, engine in self._engines.items()}
+
+
+class DatasetMove:
+    """
+    Moves a dataset's contents and chats to another shard while it keeps
+    serving:
+
+    1. `copy_contents` copies the contents (with new ids) in one target
+       transaction, then `copy_messages` copies the chat messages in
+       batches. Both can run again; progress is a `ShardMove` row on the
+       target, committed with the copied rows.
+    2. `cutover` copies again what changed, points the directory to the
+       target, waits for every router to pick it up (`wait` seconds,
+       the routers' refresh interval by default) and copies the messages
+       written to the source in between.
+    3. `cleanup` keeps copying the messages still written to the source
+       until none came for a whole refresh interval, then deletes the
+       dataset from the source.
+
+    Copied messages keep their timestamp, which orders chat histories:
+    the ones caught up late get ids above newer messages of the target.
+
+    Contents loaded into the dataset during the move are copied again at
+    cutover, but not after it: don't load it while `cutover` waits.
+    """
+
+    def __init__(self, router: ShardRouter, dataset: str, target: str, batch_size: int = 1000):
+        self.router = router
+        self.dataset = dataset
+        self.target = target
+        self.batch_size = batch_size
+        check_dataset_name(dataset)
+        self.source = router.shard(dataset, refresh=True)
+        router.shard_engine(target)
+        state = self.state() if self.source == target else None
+        if state is not None and state.status == "switched":
+            # switched, but the former shard may still get writes until cleanup
+            self.source = state.source
+        self._check_overlapping_datasets()
+
+    def _check_overlapping_datasets(self):
+        # datasets named before shards were enabled may still share the prefix
+        prefix = session_prefix(self.dataset)
+        overlapping = set(self.router.assignments(refresh=True))
+        for shard in {self.source, self.target}:
+            with Session(self.router.shard_engine(shard)) as session:
+                overlapping.update(session.scalars(select(CompanyContent.dataset).distinct().where(
+                    CompanyContent.dataset.startswith(prefix, autoescape=True)
+                )))
+        overlapping = sorted(dataset for dataset in overlapping if dataset and dataset.startswith(prefix))
+        if overlapping:
+            raise ValueError(
+                f"Sessions of {', '.join(overlapping)} would be taken for sessions of {self.dataset!r}, "
+                "rename those datasets first"
+            )
+
+    def _sessions(self, source: Optional[str] = None):
+        return (
+            Session(self.router.shard_engine(source or self.source)),
+            Session(self.router.shard_engine(self.target)),
+        )
+
+    def state(self, session: Optional[Session] = None) -> Optional[ShardMove]:
+        if session is None:
+            with Session(self.router.shard_engine(self.target)) as session:
+                return session.get(ShardMove, self.dataset)
+        return session.get(ShardMove, self.dataset)
+
+    def _state_for_update(self, session: Session) -> ShardMove:
+        state = session.get(ShardMove, self.dataset)
+        if state is None or state.status == "done":
+            if self.source == self.target:
+                raise ValueError(f"Dataset {self.dataset!r} is already on shard {self.target!r}")
+            state = session.merge(ShardMove(
+                dataset=self.dataset, source=self.source, target=self.target, status="copying",
+                message_watermark=0, messages_copied=0,
+            ))
+        elif state.source != self.source:
+            raise ValueError(f"Dataset {self.dataset!r} moved from {state.source!r} since this move started")
+        return state
+
+    def copy_contents(self) -> int:
+        """
+        Replaces the dataset's contents on the target with the source's.
+        Chunks point to their copied parents.
+        """
+        source, target = self._sessions()
+        with source, target:
+            version = dataset_version(source, self.dataset)
+            state = self._state_for_update(target)
+            target.execute(delete(CompanyContent).where(CompanyContent.dataset == self.dataset))
+            columns = [CompanyContent.id, *(getattr(CompanyContent, column.key) for column in CONTENT_COPY_COLUMNS)]
+            new_ids, copied = {}, 0
+            for children in (False, True):
+                query = select(*columns).where(
+                    CompanyContent.dataset == self.dataset,
+                    CompanyContent.parent_id.isnot(None) if children else CompanyContent.parent_id.is_(None),
+                ).order_by(CompanyContent.id).execution_options(yield_per=self.batch_size)
+                for partition in source.execute(query).partitions():
+                    rows = [row._asdict() for row in partition]
+                    for row in rows:
+                        if children:
+                            row["parent_id"] = new_ids[row["parent_id"]]
+                    ids = target.scalars(
+                        insert(CompanyContent).returning(CompanyContent.id, sort_by_parameter_order=True),
+                        [{key: value for key, value in row.items() if key != "id"} for row in rows],
+                    ).all()
+                    new_ids.update(zip((row["id"] for row in rows), ids))
+                    copied += len(rows)
+            # target versions must not go back to ones its caches already saw
+            bump_dataset_versions(target, [self.dataset])
+            if dataset_version(target, self.dataset) <= version:
+                target.merge(DatasetVersion(dataset=self.dataset, version=version + 1))
+            state.contents_version = version
+            target.commit()
+        logger.info(f"Copied {copied} contents of {self.dataset} from {self.source} to {self.target}")
+        return copied
+
+    def copy_messages(self, max_batches: Optional[int] = None) -> int:
+        """
+        Copies the chat messages of the dataset's sessions written since the
+        last copy, and upserts their chats (tags).
+        """
+        copied, batches = 0, 0
+        source, target = self._sessions()
+        messages = ChatMessages.__table__
+        prefix = session_prefix(self.dataset)
+        with source, target:
+            while max_batches is None or batches < max_batches:
+                state = self._state_for_update(target)
+                rows = source.execute(
+                    select(messages).where(
+                        messages.c.session_id.startswith(prefix, autoescape=True),
+                        messages.c.id > state.message_watermark,
+                    ).order_by(messages.c.id).limit(self.batch_size)
+                ).all()
+                if not rows:
+                    target.commit()
+                    break
+                target.execute(insert(messages), [
+                    {key: value for key, value in row._asdict().items() if key != "id"} for row in rows
+                ])
+                self._copy_chats(source, target, {row.session_id for row in rows})
+                state.message_watermark = rows[-1].id
+                state.messages_copied += len(rows)
+                target.commit()
+                copied += len(rows)
+                batches += 1
+        logger.info(f"Copied {copied} messages of {self.dataset} from {self.source} to {self.target}")
+        return copied
+
+    def _copy_chats(self, source: Session, target: Session, session_ids: Optional[Iterable[str]] = None) -> None:
+        query = select(Chat.session_id, Chat.tags)
+        if session_ids is None:
+            query = query.where(Chat.session_id.startswith(session_prefix(self.dataset), autoescape=True))
+        else:
+            query = query.where(Chat.session_id.in_(list(session_ids)))
+        for session_id, tags in source.execute(query).all():
+            target.merge(Chat(session_id=session_id, tags=tags))
+
+    def cutover(self, wait: Optional[float] = None) -> None:
+        """
+        Switches the dataset to the target, catching up on the messages its
+        sessions wrote to the source until every router switched.
+        """
+        with Session(self.router.shard_engine(self.source)) as source:
+            version = dataset_version(source, self.dataset)
+        state = self.state()
+        if state is None or state.contents_version != version:
+            self.copy_contents()
+        self.copy_messages()
+
+        self.router.assign(self.dataset, self.target)
+        time.sleep(self.router.refresh_interval if wait is None else wait)
+        self.copy_messages()
+
+        source, target = self._sessions()
+        with source, target:
+            self._copy_chats(source, target)
+            self._state_for_update(target).status = "switched"
+            target.commit()
+        logger.info(f"Dataset {self.dataset} now lives on {self.target}")
+
+    def run(self, wait: Optional[float] = None) -> None:
+        self.copy_contents()
+        self.copy_messages()
+        self.cutover(wait=wait)
+
+    def cleanup(self, wait: Optional[float] = None) -> Dict[str, int]:
+        """
+        Deletes the moved dataset from its former shard, once no message was
+        written there for `wait` seconds (the routers' refresh interval by
+        default): processes that didn't refresh yet still write to it.
+        Messages newer than the last copied one are left in place.
+        """
+        state = self.state()
+        if state is None or state.status != "switched":
+            raise ValueError(f"Dataset {self.dataset!r} hasn't been moved to {self.target!r}")
+        if self.router.shard(self.dataset, refresh=True) != self.target:
+            raise ValueError(f"Dataset {self.dataset!r} isn't served by {self.target!r}")
+
+        self.copy_messages()
+        while True:
+            time.sleep(self.router.refresh_interval if wait is None else wait)
+            if not self.copy_messages():
+                break
+
+        prefix = session_prefix(self.dataset)
+        source, target = self._sessions()
+        with source, target:
+            self._copy_chats(source, target)
+            state = self._state_for_update(target)
+            deleted = {
+                "contents": source.execute(
+                    delete(CompanyContent).where(CompanyContent.dataset == self.dataset)
+                ).rowcount,
+                "messages": source.execute(
+                    delete(ChatMessages).where(
+                        ChatMessages.session_id.startswith(prefix, autoescape=True),
+                        ChatMessages.id <= state.message_watermark,
+                    )
+                ).rowcount,
+                "chats": source.execute(
+                    delete(Chat).where(Chat.session_id.startswith(prefix, autoescape=True))
+                ).rowcount,
+            }
+            # kept and bumped rather than deleted: unfiltered searches are
+            # versioned by the sum of the rows, which must never go back
+            bump_dataset_versions(source, [self.dataset])
+            source.commit()
+            left = source.scalar(select(func.count()).select_from(ChatMessages).where(
+                ChatMessages.session_id.startswith(prefix, autoescape=True)
+            ))
+            state.status = "done"
+            target.commit()
+        if left:
+            logger.warning(f"{left} messages of {self.dataset} were written to {self.source} during cleanup, left there")
+        logger.info(f"Deleted {self.dataset} from {self.source}: {deleted}")
+        return deleted
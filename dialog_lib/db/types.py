@@ -0,0 +1,77 @@
+import re
+
+from pgvector.sqlalchemy import Vector
+from sqlalchemy import String
+from sqlalchemy.sql.expression import FunctionElement
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.dialects.postgresql.base import ischema_names
+
+
+class HalfVector(Vector):
+    """
+    pgvector's `halfvec` (float16) column. Values travel in the same text
+    format as `vector`, so binding, parsing and distance operators are shared.
+    """
+    cache_ok = True
+
+    def get_col_spec(self, **kw):
+        if self.dim is None:
+            return "HALFVEC"
+        return "HALFVEC(%d)" % self.dim
+
+
+EMBEDDING_TYPES = {
+    "vector": Vector,
+    "halfvec": HalfVector,
+}
+
+
+def embedding_type(kind: str = "vector", dimension: int = 1536):
+    """
+    Returns the column type used to store embeddings.
+    """
+    if kind not in EMBEDDING_TYPES:
+        raise ValueError(f"Invalid embedding type {kind}, expected one of {list(EMBEDDING_TYPES)}")
+    return EMBEDDING_TYPES[kind](dimension)
+
+
+TEXT_SEARCH_CONFIG_NAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)?$")
+
+
+def text_search_config(name: str) -> str:
+    """
+    Checks that `name` is a text search configuration name (optionally
+    schema qualified, i.e. `english` or `pg_catalog.english`), since it ends
+    up in DDL where it can't be a bound parameter.
+    """
+    if not TEXT_SEARCH_CONFIG_NAME.match(name):
+        raise ValueError(f"Invalid text search configuration {name!r}")
+    return name
+
+
+class tsvector_document(FunctionElement):
+    """
+    Generated column expression indexing `columns` for full-text search:
+    `to_tsvector(config, coalesce(a, '') || ' ' || coalesce(b, ''))`.
+    Only compiles on PostgreSQL.
+    """
+    type = TSVECTOR()
+    inherit_cache = True
+
+    def __init__(self, config, *columns):
+        self.config = text_search_config(config)
+        self.columns = columns
+        super().__init__()
+
+
+@compiles(tsvector_document, "postgresql")
+def _compile_tsvector_document_postgresql(element, compiler, **kw):
+    quote = compiler.preparer.quote
+    document = " || ' ' || ".join(f"coalesce({quote(column)}, '')" for column in element.columns)
+    config = compiler.render_literal_value(element.config, String())
+    return f"to_tsvector({config}::regconfig, {document})"
+
+
+# for reflection
+ischema_names["halfvec"] = HalfVector
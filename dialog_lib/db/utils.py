@@ -3,7 +3,9 @@ from .session import get_session
 from .models import Chat
 
 
-def create_chat_session(identifier=None, dbsession=get_session(), model=Chat):
+def create_chat_session(identifier=None, dbsession=None, model=Chat):
+    if dbsession is None:
+        dbsession = get_session()
     if identifier is None:
         identifier = uuid.uuid4().hex
 
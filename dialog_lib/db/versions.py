@@ -0,0 +1,61 @@
+from typing import Iterable, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from .models import DatasetVersion
+
+
+# versions the contents without a dataset; searches not filtered by dataset
+# are versioned by the sum of every row (see `dataset_version`)
+ALL_DATASETS = ""
+
+BUMP_SQL = (
+    "INSERT INTO dataset_versions (dataset, version) VALUES (%s, 1) "
+    "ON CONFLICT (dataset) DO UPDATE SET version = dataset_versions.version + 1"
+)
+
+
+def version_keys(datasets: Iterable[Optional[str]]):
+    """
+    The dataset_versions rows touched by a write to `datasets` (None being
+    the contents without a dataset), sorted so concurrent writers lock them
+    in the same order. Writers of different datasets don't share a row.
+    """
+    return sorted({ALL_DATASETS if dataset is None else dataset for dataset in datasets})
+
+
+def bump_dataset_versions(dbsession, datasets: Iterable[Optional[str]]) -> None:
+    """
+    Increments the version of `datasets` in the session's transaction, so it
+    commits together with the written rows.
+    """
+    keys = version_keys(datasets)
+    if not keys:
+        return
+    dialect = dbsession.get_bind().dialect.name
+    insert = sqlite.insert if dialect == "sqlite" else postgresql.insert
+    statement = insert(DatasetVersion).values([{"dataset": key, "version": 1} for key in keys])
+    dbsession.execute(statement.on_conflict_do_update(
+        index_elements=[DatasetVersion.dataset],
+        set_={"version": DatasetVersion.version + 1},
+    ))
+
+
+def all_datasets_version():
+    """
+    The version of searches not filtered by dataset: the sum of every
+    dataset's version, which goes up with any write without a global row
+    for every writer to lock.
+    """
+    return select(func.coalesce(func.sum(DatasetVersion.version), 0)).scalar_subquery()
+
+
+def dataset_version(dbsession, dataset: Optional[str]) -> int:
+    """
+    The version of `dataset`, or of unfiltered searches when None.
+    """
+    if dataset is None:
+        return dbsession.scalar(select(all_datasets_version()))
+    version = dbsession.scalar(select(DatasetVersion.version).where(DatasetVersion.dataset == dataset))
+    return version or 0
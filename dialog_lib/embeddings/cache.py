@@ -0,0 +1,146 @@
+import json
+import hashlib
+import logging
+import threading
+
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from sqlalchemy import case, delete, select
+from langchain_core.documents import Document
+
+from dialog_lib.db.models import DatasetVersion, RetrievalCacheEntry
+from dialog_lib.db.session import get_session
+from dialog_lib.db.versions import ALL_DATASETS, all_datasets_version
+
+
+logger = logging.getLogger(__name__)
+
+
+def retrieval_cache_key(query: str, dataset: Optional[str], version: int, **params) -> str:
+    """
+    Hash of everything a retrieval result depends on. `params` holds the
+    retriever settings (embedding model, threshold, top_k, search mode...).
+    """
+    payload = json.dumps([query, dataset, version, params], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def embedding_model_key(embedding_llm) -> Optional[str]:
+    """
+    Identifies an embedding model by its class, model name and dimension
+    (when it has them), so retrievers of different models don't share
+    cached results.
+    """
+    if embedding_llm is None:
+        return None
+    name = getattr(embedding_llm, "model", None) or getattr(embedding_llm, "model_name", None)
+    dimension = getattr(embedding_llm, "dimensions", None) or getattr(embedding_llm, "size", None)
+    return ":".join(str(part) for part in (type(embedding_llm).__name__, name, dimension) if part is not None)
+
+
+def dump_documents(documents: List[Document]) -> List[Dict]:
+    return [{"page_content": document.page_content, "metadata": document.metadata} for document in documents]
+
+
+def load_documents(documents: List[Dict]) -> List[Document]:
+    return [Document(page_content=document["page_content"], metadata=dict(document["metadata"])) for document in documents]
+
+
+class LocalCache:
+    """
+    Thread safe in-process LRU of serialized documents.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            documents = self._entries.get(key)
+            if documents is not None:
+                self._entries.move_to_end(key)
+            return documents
+
+    def set(self, key, documents):
+        with self._lock:
+            self._entries[key] = documents
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RetrievalCache:
+    """
+    Two-tier retrieval result cache: an in-process LRU and, with `shared`,
+    the `retrieval_cache` table, read on local misses so workers share hits.
+
+    Keys include the dataset version (see `dialog_lib.db.versions`), so a
+    write to the dataset makes every older entry unreachable. The table keeps
+    at most `shared_max_rows` entries: every `prune_every` writes, entries of
+    older versions and the oldest entries beyond the limit are deleted.
+
+    Entries are read with the retriever's session (possibly on a replica)
+    and written with `write_session()`, a primary session of the dataset's
+    shard (`get_session(dataset)`) by default.
+    """
+
+    def __init__(
+        self, maxsize: int = 1024, shared: bool = False, shared_max_rows: int = 10000, prune_every: int = 100,
+        write_session=None,
+    ):
+        self.local = LocalCache(maxsize)
+        self.write_session = write_session
+        self.shared = shared
+        self.shared_max_rows = shared_max_rows
+        self.prune_every = prune_every
+        self._writes = 0
+
+    def get(self, session, key: str) -> Optional[List[Document]]:
+        documents = self.local.get(key)
+        if documents is None and self.shared:
+            documents = session.scalar(select(RetrievalCacheEntry.documents).where(RetrievalCacheEntry.key == key))
+            if documents is not None:
+                self.local.set(key, documents)
+        return load_documents(documents) if documents is not None else None
+
+    def set(self, session, key: str, dataset: Optional[str], version: int, documents: List[Document]) -> None:
+        documents = dump_documents(documents)
+        self.local.set(key, documents)
+        if not self.shared:
+            return
+        session = self.write_session() if self.write_session is not None else get_session(dataset)
+        try:
+            session.merge(RetrievalCacheEntry(
+                key=key, dataset=ALL_DATASETS if dataset is None else dataset, version=version, documents=documents
+            ))
+            self._writes += 1
+            if self._writes % self.prune_every == 0:
+                self.prune(session)
+            session.commit()
+        except Exception as exc:
+            session.rollback()
+            logger.warning(f"Failed to store the retrieval cache entry: {exc}")
+
+    def prune(self, session) -> None:
+        """
+        Deletes entries of outdated dataset versions and the oldest entries
+        beyond `shared_max_rows`.
+        """
+        entries = RetrievalCacheEntry.__table__
+        current = case(
+            (entries.c.dataset == ALL_DATASETS, all_datasets_version()),
+            else_=select(DatasetVersion.version).where(DatasetVersion.dataset == entries.c.dataset).scalar_subquery(),
+        )
+        session.execute(delete(RetrievalCacheEntry).where(RetrievalCacheEntry.version < current))
+        oldest = (
+            select(RetrievalCacheEntry.key)
+            .order_by(RetrievalCacheEntry.created_at.desc())
+            .offset(self.shared_max_rows)
+        )
+        session.execute(delete(RetrievalCacheEntry).where(RetrievalCacheEntry.key.in_(oldest)))
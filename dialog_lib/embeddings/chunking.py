@@ -0,0 +1,34 @@
+from typing import List, Optional
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+
+def default_chunk_overlap(chunk_size: int) -> int:
+    """
+    Characters shared by consecutive chunks when none is given: a tenth of
+    `chunk_size`, at most 100.
+    """
+    return min(100, chunk_size // 10)
+
+
+def split_content(content: str, chunk_size: int = 1000, chunk_overlap: Optional[int] = None) -> List[str]:
+    """
+    Splits a content into chunks of at most `chunk_size` characters,
+    preferring paragraph, line and word boundaries. Consecutive chunks share
+    `chunk_overlap` characters (see `default_chunk_overlap`), which must be
+    smaller than `chunk_size`.
+    """
+    if chunk_overlap is None:
+        chunk_overlap = default_chunk_overlap(chunk_size)
+    if chunk_size < 1 or not 0 <= chunk_overlap < chunk_size:
+        raise ValueError(f"Invalid chunking: chunk_size={chunk_size}, chunk_overlap={chunk_overlap}")
+    if len(content) <= chunk_size:
+        return [content]
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return splitter.split_text(content)
+
+def chunk_text(question: str, chunk: str) -> str:
+    """
+    The text embedded for a chunk row, matching the retriever's page content.
+    """
+    return f"{question}\n\n{chunk}"
@@ -0,0 +1,89 @@
+from typing import List, Sequence
+
+import numpy as np
+
+
+def normalize(embeddings) -> np.ndarray:
+    """
+    Returns the embeddings as unit-length float32 rows (zero rows stay zero).
+    """
+    matrix = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def cosine_similarities(query_embedding, embeddings) -> np.ndarray:
+    """
+    Cosine similarity of each embedding to the query embedding.
+    """
+    if len(embeddings) == 0:
+        return np.zeros(0, dtype=np.float32)
+    return normalize(embeddings) @ normalize(query_embedding)[0]
+
+
+def collapse_near_duplicates(embeddings, threshold: float = 0.95) -> List[int]:
+    """
+    Returns the indices to keep, in order, dropping every row whose cosine
+    similarity to an earlier kept row reaches `threshold`.
+    """
+    if len(embeddings) == 0:
+        return []
+    matrix = normalize(embeddings)
+    similarities = matrix @ matrix.T
+    kept = [0]
+    for index in range(1, len(matrix)):
+        if similarities[index, kept].max() < threshold:
+            kept.append(index)
+    return kept
+
+
+def maximal_marginal_relevance(query_embedding, embeddings, k: int, lambda_mult: float = 0.5) -> List[int]:
+    """
+    Picks `k` indices, each maximizing
+    `lambda_mult * sim(query, d) - (1 - lambda_mult) * max(sim(d, selected))`.
+
+    Similarities are computed once as matrices; each pick only updates the
+    running maximum similarity to the selected rows.
+    """
+    if len(embeddings) == 0 or k <= 0:
+        return []
+    matrix = normalize(embeddings)
+    relevance = matrix @ normalize(query_embedding)[0]
+    similarities = matrix @ matrix.T
+
+    selected = [int(np.argmax(relevance))]
+    redundancy = similarities[selected[0]].copy()
+    available = np.ones(len(matrix), dtype=bool)
+    available[selected[0]] = False
+
+    while len(selected) < min(k, len(matrix)):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        index = int(np.argmax(scores))
+        selected.append(index)
+        available[index] = False
+        np.maximum(redundancy, similarities[index], out=redundancy)
+    return selected
+
+
+def diversify_contents(
+    query_embedding,
+    contents: Sequence,
+    top: int,
+    embedding_column: str = "embedding",
+    lambda_mult: float = 0.5,
+    duplicate_threshold: float = 0.95,
+):
+    """
+    Collapses near-duplicate contents, then re-ranks the rest with MMR and
+    keeps `top`. Contents must carry their embeddings.
+    """
+    contents = [content for content in contents if getattr(content, embedding_column) is not None]
+    if not contents:
+        return []
+    embeddings = np.stack([np.asarray(getattr(content, embedding_column), dtype=np.float32) for content in contents])
+
+    kept = collapse_near_duplicates(embeddings, duplicate_threshold)
+    picks = maximal_marginal_relevance(query_embedding, embeddings[kept], top, lambda_mult)
+    return [contents[kept[index]] for index in picks]
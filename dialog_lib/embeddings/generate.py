@@ -1,8 +1,72 @@
+import os
 from typing import List
 
-from sqlalchemy import select
+import numpy as np
+from sqlalchemy import Float, cast, func, literal, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import BIT, REGCONFIG
 from langchain_core.embeddings import Embeddings
-from dialog_lib.db.models import CompanyContent
+from sqlalchemy.schema import CreateIndex
+from dialog_lib.db.models import CompanyContent, EMBEDDING_DIMENSION, TEXT_SEARCH_CONFIG
+from dialog_lib.db.prepared import psycopg_connection, search_contents
+from dialog_lib.db.session import get_read_session
+from dialog_lib.embeddings.diversify import cosine_similarities, diversify_contents
+from dialog_lib.instrumentation import get_instrumentation
+
+
+# Matryoshka-trained models: a prefix of their embedding is a valid, shorter one
+SHORTENABLE_MODELS = ("text-embedding-3-",)
+FIXED_DIMENSION_MODELS = {"text-embedding-ada-002": 1536}
+
+
+def openai_embeddings(api_key=None, dimension=EMBEDDING_DIMENSION, **kwargs):
+    """
+    Builds the OpenAI embeddings model matching the configured dimension.
+    Dimensions other than 1536 use a text-embedding-3 model (overridable with
+    DIALOG_EMBEDDING_MODEL), which returns shortened embeddings natively.
+    Models with a fixed size (i.e. text-embedding-ada-002) are refused for
+    other dimensions.
+    """
+    from langchain_openai import OpenAIEmbeddings
+
+    model = os.environ.get("DIALOG_EMBEDDING_MODEL")
+    if model is None and dimension != 1536:
+        model = "text-embedding-3-small"
+    if model:
+        kwargs["model"] = model
+        if model.startswith(SHORTENABLE_MODELS):
+            kwargs["dimensions"] = dimension
+        elif FIXED_DIMENSION_MODELS.get(model, dimension) != dimension:
+            raise ValueError(f"{model} embeddings have {FIXED_DIMENSION_MODELS[model]} dimensions, not {dimension}")
+    return OpenAIEmbeddings(openai_api_key=api_key, **kwargs)
+
+
+def supports_shortening(embedding_llm) -> bool:
+    """
+    Whether the embeddings of `embedding_llm` can be truncated, by its
+    `model` name (i.e. text-embedding-3-small).
+    """
+    model = getattr(embedding_llm, "model", None)
+    return isinstance(model, str) and model.startswith(SHORTENABLE_MODELS)
+
+
+def fit_embedding(embedding, dimension=None, shorten=False):
+    """
+    Checks that an embedding has `dimension` values. With `shorten` (see
+    `supports_shortening`), longer embeddings are truncated and
+    re-normalized, which is how Matryoshka-trained models (i.e.
+    text-embedding-3) are shortened; otherwise a mismatch raises ValueError.
+    """
+    if dimension is None or len(embedding) == dimension:
+        return embedding
+    if len(embedding) < dimension or not shorten:
+        raise ValueError(
+            f"Expected an embedding with {dimension} dimensions, got {len(embedding)}: "
+            "check the embedding model against DIALOG_EMBEDDING_DIMENSION"
+        )
+    truncated = np.asarray(embedding[:dimension], dtype=np.float32)
+    norm = np.linalg.norm(truncated)
+    return (truncated / norm if norm else truncated).tolist()
 
 
 def generate_embeddings(
@@ -25,29 +89,305 @@ def generate_embedding(document: str, embedding_llm_instance: Embeddings = None)
     return embedding_llm_instance.embed_query(document)
 
 
-def get_most_relevant_contents_from_message(
+def binary_quantized(column):
+    """
+    The `binary_quantize(column)::bit(dim)` expression, matching the index
+    created by `binary_quantized_index_ddl`.
+    """
+    return cast(func.binary_quantize(column), BIT(column.type.dim))
+
+
+def binary_quantized_index_ddl(model=CompanyContent, embedding_column="embedding"):
+    """
+    DDL for the HNSW Hamming index used by the "binary" search mode (pgvector 0.7+).
+    """
+    table = model.__tablename__
+    dimension = getattr(model, embedding_column).type.dim
+    return (
+        f"CREATE INDEX IF NOT EXISTS idx_{table}_{embedding_column}_bq ON {table} "
+        f"USING hnsw ((binary_quantize({embedding_column})::bit({dimension})) bit_hamming_ops)"
+    )
+
+
+def text_search_ddl(model=CompanyContent):
+    """
+    DDL adding the generated `search_vector` column and its GIN index to an
+    existing contents table, for the "hybrid" search mode.
+    """
+    table = model.__table__
+    column = table.c.search_vector
+    dialect = postgresql.dialect()
+    expression = column.computed.sqltext.compile(dialect=dialect)
+    index = next(index for index in table.indexes if column.name in index.columns)
+    return [
+        f"ALTER TABLE {table.name} ADD COLUMN IF NOT EXISTS {column.name} tsvector "
+        f"GENERATED ALWAYS AS ({expression}) STORED",
+        str(CreateIndex(index, if_not_exists=True).compile(dialect=dialect)),
+    ]
+
+
+def hybrid_contents_query(
     message,
+    message_embedding,
     top=5,
     dataset=None,
-    session=None,
-    embeddings_llm=None,
     cosine_similarity_threshold=0.5,
     model=CompanyContent,
     embedding_column="embedding",
+    candidate_factor=10,
+    vector_weight=1.0,
+    text_weight=1.0,
+    rrf_k=60,
 ):
-    message_embedding = generate_embedding(message, embeddings_llm)
-    filters = [
-        model.embedding.cosine_distance(message_embedding)
-        < cosine_similarity_threshold,
-    ]
+    """
+    Fuses the vector and full-text rankings with reciprocal rank fusion:
+    each list contributes `weight / (rrf_k + rank)` to a content's score.
 
+    Both lists keep `top * candidate_factor` embedded rows. The similarity
+    threshold only applies to the vector list, so exact lexical matches
+    (codes, names) are kept even when their embedding is far from the message.
+    """
+    column = getattr(model, embedding_column)
+    distance = column.cosine_distance(message_embedding)
+    candidates = top * candidate_factor
+    filters = [column.isnot(None)]
     if dataset is not None:
         filters.append(model.dataset == dataset)
 
-    possible_contents = session.scalars(
+    vector_hits = (
+        select(model.id, func.row_number().over(order_by=distance).label("rank"))
+        .filter(distance < cosine_similarity_threshold, *filters)
+        .order_by(distance)
+        .limit(candidates)
+        .cte("vector_hits")
+    )
+    tsquery = func.websearch_to_tsquery(cast(literal(TEXT_SEARCH_CONFIG), REGCONFIG), message)
+    text_rank = func.ts_rank_cd(model.search_vector, tsquery)
+    text_hits = (
+        select(model.id, func.row_number().over(order_by=text_rank.desc()).label("rank"))
+        .filter(model.search_vector.op("@@")(tsquery), *filters)
+        .order_by(text_rank.desc())
+        .limit(candidates)
+        .cte("text_hits")
+    )
+
+    score = (
+        func.coalesce(literal(vector_weight, Float) / (rrf_k + vector_hits.c.rank), 0)
+        + func.coalesce(literal(text_weight, Float) / (rrf_k + text_hits.c.rank), 0)
+    )
+    fused = (
+        select(func.coalesce(vector_hits.c.id, text_hits.c.id).label("id"), score.label("score"))
+        .select_from(vector_hits.join(text_hits, vector_hits.c.id == text_hits.c.id, full=True))
+        .subquery("fused")
+    )
+    return (
         select(model)
-        .filter(*filters)
-        .order_by(getattr(model, embedding_column).cosine_distance(message_embedding))
+        .join(fused, model.id == fused.c.id)
+        .order_by(fused.c.score.desc(), model.id)
         .limit(top)
-    ).all()
-    return possible_contents
+    )
+
+
+def build_relevant_contents_query(
+    message_embedding,
+    top=5,
+    dataset=None,
+    cosine_similarity_threshold=0.5,
+    model=CompanyContent,
+    embedding_column="embedding",
+    search_mode="vector",
+    candidate_factor=10,
+    message=None,
+    vector_weight=1.0,
+    text_weight=1.0,
+    rrf_k=60,
+):
+    """
+    Builds the select returning the `top` contents closest to the embedding.
+
+    search_mode "vector" runs an exact cosine search. "binary" first picks
+    `top * candidate_factor` candidates by Hamming distance over the
+    binary-quantized embeddings, then re-ranks them by exact cosine distance.
+    "hybrid" fuses the vector and full-text search over `message`, see
+    `hybrid_contents_query`.
+    """
+    if search_mode == "hybrid":
+        if message is None:
+            raise ValueError("The hybrid search mode needs the message text")
+        return hybrid_contents_query(
+            message,
+            message_embedding,
+            top=top,
+            dataset=dataset,
+            cosine_similarity_threshold=cosine_similarity_threshold,
+            model=model,
+            embedding_column=embedding_column,
+            candidate_factor=candidate_factor,
+            vector_weight=vector_weight,
+            text_weight=text_weight,
+            rrf_k=rrf_k,
+        )
+
+    column = getattr(model, embedding_column)
+    distance = column.cosine_distance(message_embedding)
+    filters = [distance < cosine_similarity_threshold]
+    dataset_filters = [model.dataset == dataset] if dataset is not None else []
+
+    query = select(model)
+    if search_mode == "binary":
+        query_bits = binary_quantized(cast(message_embedding, column.type))
+        candidates = (
+            select(model.id)
+            .filter(column.isnot(None), *dataset_filters)
+            .order_by(binary_quantized(column).op("<~>")(query_bits))
+            .limit(top * candidate_factor)
+            .subquery()
+        )
+        query = query.join(candidates, model.id == candidates.c.id)
+    elif search_mode != "vector":
+        raise ValueError(f"Invalid search mode {search_mode}")
+
+    return query.filter(*filters, *dataset_filters).order_by(distance).limit(top)
+
+
+def get_most_relevant_contents_from_message(
+    message,
+    top=5,
+    dataset=None,
+    session=None,
+    embeddings_llm=None,
+    cosine_similarity_threshold=0.5,
+    model=CompanyContent,
+    embedding_column="embedding",
+    return_parents=False,
+    parent_fetch_factor=4,
+    search_mode="vector",
+    candidate_factor=10,
+    vector_weight=1.0,
+    text_weight=1.0,
+    rrf_k=60,
+    diversify=False,
+    diversify_fetch_factor=4,
+    mmr_lambda=0.5,
+    duplicate_threshold=0.95,
+    with_scores=False,
+    prepared=False,
+):
+    """
+    Returns the `top` contents closest to the message. Chunk rows are scored
+    like any other row; with `return_parents`, each chunk is replaced by its
+    parent content and parents are deduplicated, keeping the best chunk rank.
+
+    With `diversify`, `top * diversify_fetch_factor` candidates are fetched,
+    near-duplicates (cosine similarity >= `duplicate_threshold`) are collapsed
+    and the rest are re-ranked with maximal marginal relevance (`mmr_lambda`
+    trades relevance for diversity), reusing the message embedding.
+
+    With `with_scores`, returns (content, score) pairs, the score being the
+    cosine similarity of the content (or of its best chunk) to the message.
+
+    Without a `session`, the query runs on a read replica when configured.
+
+    With `prepared` and a psycopg 3 session, plain "vector" searches run as
+    a prepared statement (see `dialog_lib.db.prepared.search_contents`): the
+    contents are then named tuples of the model's columns (without the
+    embeddings and the deferred ones, plus `distance`) instead of `model`
+    entities, detached from the session. Only pass it when the caller reads
+    columns (as `DialogRetriever` does).
+
+    See `build_relevant_contents_query` for the search modes.
+    """
+    if session is None:
+        session = get_read_session(dataset)
+    instrumentation = get_instrumentation()
+    column = getattr(model, embedding_column)
+    with instrumentation.stage("query_embedding"):
+        message_embedding = fit_embedding(
+            generate_embedding(message, embeddings_llm), column.type.dim, shorten=supports_shortening(embeddings_llm)
+        )
+
+    fast_path = prepared and search_mode == "vector" and not diversify and not return_parents
+    if fast_path and psycopg_connection(session) is not None:
+        with instrumentation.stage("vector_query", search_mode=search_mode, prepared=True) as record:
+            scored = search_contents(
+                session,
+                message_embedding,
+                top=top,
+                dataset=dataset,
+                cosine_similarity_threshold=cosine_similarity_threshold,
+                model=model,
+                embedding_column=embedding_column,
+            )
+            record.set(rows=len(scored))
+        return scored if with_scores else [content for content, _ in scored]
+
+    limit = top * parent_fetch_factor if return_parents else top
+    if diversify:
+        limit = max(limit, top * diversify_fetch_factor)
+    with instrumentation.stage("vector_query", search_mode=search_mode) as record:
+        possible_contents = session.scalars(
+            build_relevant_contents_query(
+                message_embedding,
+                top=limit,
+                dataset=dataset,
+                cosine_similarity_threshold=cosine_similarity_threshold,
+                model=model,
+                embedding_column=embedding_column,
+                search_mode=search_mode,
+                candidate_factor=candidate_factor,
+                message=message,
+                vector_weight=vector_weight,
+                text_weight=text_weight,
+                rrf_k=rrf_k,
+            )
+        ).all()
+        record.set(rows=len(possible_contents))
+
+    if diversify:
+        with instrumentation.stage("diversify", candidates=len(possible_contents)) as record:
+            possible_contents = diversify_contents(
+                message_embedding,
+                possible_contents,
+                top=len(possible_contents) if return_parents else top,
+                embedding_column=embedding_column,
+                lambda_mult=mmr_lambda,
+                duplicate_threshold=duplicate_threshold,
+            )
+            record.set(rows=len(possible_contents))
+
+    if return_parents:
+        contents = resolve_parents(session, possible_contents, top, model=model)
+    else:
+        contents = possible_contents
+    if not with_scores:
+        return contents
+
+    def score_key(content):
+        return (content.parent_id or content.id) if return_parents else content.id
+
+    scores = {}
+    embedded = [content for content in possible_contents if getattr(content, embedding_column) is not None]
+    similarities = cosine_similarities(
+        message_embedding, [getattr(content, embedding_column) for content in embedded]
+    )
+    for content, similarity in zip(embedded, similarities):
+        scores.setdefault(score_key(content), float(similarity))
+    return [(content, scores.get(score_key(content))) for content in contents]
+
+
+def resolve_parents(session, contents, top, model=CompanyContent):
+    """
+    Maps chunk rows to their parent rows, deduplicated and in rank order.
+    """
+    ranked = {}
+    for content in contents:
+        ranked.setdefault(content.parent_id or content.id, content)
+        if len(ranked) == top:
+            break
+
+    parent_ids = [key for key, content in ranked.items() if content.parent_id is not None]
+    parents = {
+        parent.id: parent
+        for parent in session.scalars(select(model).where(model.id.in_(parent_ids)))
+    } if parent_ids else {}
+    return [parents.get(key, content) for key, content in ranked.items()]
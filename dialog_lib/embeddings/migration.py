@@ -0,0 +1,362 @@
+import re
+import time
+import logging
+import threading
+
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import Column, Integer, MetaData, Table, bindparam, column, select, table, text, update
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import DeclarativeBase, deferred
+
+from dialog_lib.db.models import CompanyContent, EmbeddingMigrationState
+from dialog_lib.db.types import embedding_type
+from dialog_lib.embeddings.chunking import chunk_text
+from dialog_lib.embeddings.generate import fit_embedding, supports_shortening
+from dialog_lib.instrumentation import get_instrumentation
+from dialog_lib.loaders.executor import IngestionExecutor
+
+
+logger = logging.getLogger(__name__)
+
+SHADOW_COLUMN = "embedding_next"
+PREVIOUS_COLUMN = "embedding_previous"
+INDEX_OPS = {"vector": "vector_cosine_ops", "halfvec": "halfvec_cosine_ops"}
+# a migration can be swapped once backfilled; indexing first is recommended
+SWAPPABLE = ("backfilled", "indexed")
+
+
+# migration names end up in identifiers (trigger, function, index), where
+# they can't be bound parameters; 32 characters keep those within 63
+MIGRATION_NAME = re.compile(r"^[a-z_][a-z0-9_]{0,31}$")
+
+
+class MigrationError(RuntimeError):
+    pass
+
+
+def migration_name(name: str) -> str:
+    """
+    Checks that `name` is a lowercase identifier of at most 32 characters.
+    """
+    if not MIGRATION_NAME.match(name):
+        raise ValueError(f"Invalid migration name {name!r}, expected lowercase letters, digits and underscores")
+    return name
+
+
+def shadow_column_ddl(name: str, kind: str, dimension: int, model=CompanyContent):
+    """
+    DDL adding the shadow column plus a trigger that clears it when a row's
+    question or content changes, so the backfill re-embeds edited rows.
+    """
+    table_name = model.__tablename__
+    column_type = embedding_type(kind, dimension).compile(dialect=postgresql.dialect())
+    function = f"{table_name}_{migration_name(name)}_reset_{SHADOW_COLUMN}"
+    return [
+        f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS {SHADOW_COLUMN} {column_type}",
+        f"CREATE OR REPLACE FUNCTION {function}() RETURNS trigger AS $$ "
+        f"BEGIN NEW.{SHADOW_COLUMN} := NULL; RETURN NEW; END; $$ LANGUAGE plpgsql",
+        f"DROP TRIGGER IF EXISTS {function} ON {table_name}",
+        f"CREATE TRIGGER {function} BEFORE UPDATE OF question, content ON {table_name} FOR EACH ROW "
+        f"WHEN (OLD.question IS DISTINCT FROM NEW.question OR OLD.content IS DISTINCT FROM NEW.content) "
+        f"EXECUTE FUNCTION {function}()",
+    ]
+
+
+def drop_trigger_ddl(name: str, model=CompanyContent):
+    table_name = model.__tablename__
+    function = f"{table_name}_{migration_name(name)}_reset_{SHADOW_COLUMN}"
+    return [
+        f"DROP TRIGGER IF EXISTS {function} ON {table_name}",
+        f"DROP FUNCTION IF EXISTS {function}()",
+    ]
+
+
+def shadow_index_ddl(name: str, kind: str, model=CompanyContent):
+    """
+    HNSW cosine index on the shadow column, named after the migration so
+    it keeps a unique name once the column is renamed.
+    """
+    table_name = model.__tablename__
+    return (
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_{table_name}_embedding_{migration_name(name)} ON {table_name} "
+        f"USING hnsw ({SHADOW_COLUMN} {INDEX_OPS[kind]})"
+    )
+
+
+def swap_ddl(name: str, model=CompanyContent):
+    table_name = model.__tablename__
+    return [
+        f"ALTER TABLE {table_name} RENAME COLUMN embedding TO {PREVIOUS_COLUMN}",
+        f"ALTER TABLE {table_name} RENAME COLUMN {SHADOW_COLUMN} TO embedding",
+        *drop_trigger_ddl(name, model),
+        "UPDATE dataset_versions SET version = version + 1",
+    ]
+
+
+_content_models: Dict[Tuple, type] = {}
+
+
+def content_model_for(kind: str, dimension: int, model=CompanyContent):
+    """
+    A class mapping `model`'s table with an `embedding` column of another
+    type or dimension, to query the table after a migration swapped it in
+    while this process is still configured for the previous embeddings.
+    """
+    key = (model, kind, dimension)
+    if key not in _content_models:
+        metadata = MetaData()
+        columns = [column._copy() for column in model.__table__.columns if column.name != "embedding"]
+        mapped_table = Table(
+            model.__tablename__, metadata, *columns, Column("embedding", embedding_type(kind, dimension))
+        )
+        base = type(f"{model.__name__}Base", (DeclarativeBase,), {"metadata": metadata})
+        attributes = {"__table__": mapped_table, "__tablename__": model.__tablename__}
+        if "search_vector" in mapped_table.c:
+            attributes["search_vector"] = deferred(mapped_table.c.search_vector)
+        _content_models[key] = type(model.__name__, (base,), attributes)
+    return _content_models[key]
+
+
+class EmbeddingMigration:
+    """
+    Moves the contents to another embedding model without downtime:
+
+    1. `prepare` adds a shadow `embedding_next` column and records the
+       migration in `embedding_migrations`.
+    2. `backfill` embeds `question`/`content` of every embedded row into it,
+       batch by batch, committing its progress with each batch so it can be
+       stopped and resumed. Rows written or edited meanwhile are caught up.
+    3. `build_index` builds the HNSW index of the shadow column concurrently.
+    4. `swap` renames `embedding` to `embedding_previous` and the shadow
+       column to `embedding` in one transaction, and bumps every dataset
+       version so cached retrievals are dropped.
+    5. `finish` drops the previous column.
+
+    Retrievers configured with an `EmbeddingSwitch` move to the new model
+    when the swap commits.
+    """
+
+    def __init__(
+        self,
+        dbsession,
+        embedding_llm=None,
+        name: str = "default",
+        embedding_type: str = "vector",
+        dimension: Optional[int] = None,
+        model=CompanyContent,
+        batch_size: int = 256,
+        executor: Optional[IngestionExecutor] = None,
+        pause: float = 0.0,
+        lock_timeout: str = "5s",
+    ):
+        self.dbsession = dbsession
+        self.embedding_llm = embedding_llm
+        self.name = migration_name(name)
+        self.embedding_type = embedding_type
+        self.dimension = dimension
+        self.model = model
+        self.batch_size = batch_size
+        self.executor = executor or IngestionExecutor(embedding_llm)
+        self.pause = pause
+        self.lock_timeout = lock_timeout
+
+    def state(self) -> Optional[EmbeddingMigrationState]:
+        return self.dbsession.get(EmbeddingMigrationState, self.name, populate_existing=True)
+
+    def _require(self, *statuses) -> EmbeddingMigrationState:
+        state = self.state()
+        if state is None:
+            raise MigrationError(f"Migration {self.name} was not prepared")
+        if state.status not in statuses:
+            raise MigrationError(f"Migration {self.name} is {state.status}, expected {' or '.join(statuses)}")
+        self.embedding_type, self.dimension = state.embedding_type, state.dimension
+        return state
+
+    def _table(self):
+        return table(
+            self.model.__tablename__,
+            column("id", Integer),
+            column("question"),
+            column("content"),
+            column("embedding"),
+            column(SHADOW_COLUMN, embedding_type(self.embedding_type, self.dimension)),
+        )
+
+    def prepare(self) -> EmbeddingMigrationState:
+        if self.dimension is None:
+            raise MigrationError("prepare needs the dimension of the new embeddings")
+        EmbeddingMigrationState.__table__.create(self.dbsession.get_bind(), checkfirst=True)
+        if self.state() is not None:
+            raise MigrationError(f"Migration {self.name} already exists")
+        running = self.dbsession.scalar(
+            select(EmbeddingMigrationState.name).where(EmbeddingMigrationState.status.not_in(("swapped", "finished")))
+        )
+        if running is not None:
+            raise MigrationError(f"Migration {running} is still running")
+        for statement in shadow_column_ddl(self.name, self.embedding_type, self.dimension, self.model):
+            self.dbsession.execute(text(statement))
+        state = EmbeddingMigrationState(
+            name=self.name, embedding_type=self.embedding_type, dimension=self.dimension,
+            status="prepared", last_id=0, rows_done=0,
+        )
+        self.dbsession.add(state)
+        self.dbsession.commit()
+        return state
+
+    def _pending(self, contents, after_id=0, limit=None):
+        query = (
+            select(contents.c.id, contents.c.question, contents.c.content)
+            .where(contents.c.embedding.isnot(None), contents.c[SHADOW_COLUMN].is_(None), contents.c.id > after_id)
+            .order_by(contents.c.id)
+        )
+        if limit is not None:
+            query = query.limit(limit)
+        return self.dbsession.execute(query).all()
+
+    def _write(self, contents, rows) -> int:
+        """
+        Embeds `rows` into the shadow column, skipping rows edited since they
+        were read (the trigger cleared them, so a later pass takes them again).
+        """
+        embeddings = self.executor.embed([chunk_text(row.question, row.content) for row in rows])
+        statement = (
+            update(contents)
+            .where(
+                contents.c.id == bindparam("row_id"),
+                contents.c.question == bindparam("row_question"),
+                contents.c.content == bindparam("row_content"),
+            )
+            .values({SHADOW_COLUMN: bindparam("shadow")})
+        )
+        shorten = supports_shortening(self.embedding_llm)
+        self.dbsession.execute(statement, [
+            dict(row_id=row.id, row_question=row.question, row_content=row.content,
+                 shadow=fit_embedding(embedding, self.dimension, shorten))
+            for row, embedding in zip(rows, embeddings)
+        ])
+        return len(rows)
+
+    def backfill(self, max_batches: Optional[int] = None) -> EmbeddingMigrationState:
+        """
+        Embeds up to `max_batches` batches (all of them by default), resuming
+        after the last committed batch. Once a pass reaches the end of the
+        table, a catch-up pass from the start takes rows that were inserted
+        or edited during the previous one; the migration is backfilled when
+        a pass from the start finds nothing left.
+        """
+        state = self._require("prepared", "backfilling", "backfilled", "indexed")
+        contents = self._table()
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            rows = self._pending(contents, state.last_id, self.batch_size)
+            if not rows:
+                if state.last_id == 0:
+                    state.status = "backfilled" if state.status in ("prepared", "backfilling") else state.status
+                    self.dbsession.commit()
+                    break
+                state.last_id = 0
+                self.dbsession.commit()
+                continue
+
+            with get_instrumentation().stage("embedding_backfill", rows=len(rows)):
+                written = self._write(contents, rows)
+                state.last_id = rows[-1].id
+                state.rows_done += written
+                if state.status == "prepared":
+                    state.status = "backfilling"
+                self.dbsession.commit()
+            batches += 1
+            logger.info(f"Migration {self.name}: {state.rows_done} rows embedded, up to id {state.last_id}")
+            if self.pause:
+                time.sleep(self.pause)
+        return state
+
+    def build_index(self) -> EmbeddingMigrationState:
+        state = self._require("backfilling", "backfilled")
+        # CREATE INDEX CONCURRENTLY can't run inside a transaction block
+        with self.dbsession.get_bind().connect() as connection:
+            connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+            connection.execute(text(shadow_index_ddl(self.name, self.embedding_type, self.model)))
+        if state.status == "backfilled":
+            state.status = "indexed"
+        self.dbsession.commit()
+        return state
+
+    def swap(self) -> EmbeddingMigrationState:
+        """
+        Renames the columns under an exclusive lock. Rows written since the
+        last backfill pass are embedded while holding it, so run `backfill`
+        right before to keep the lock short.
+        """
+        state = self._require(*SWAPPABLE)
+        self.dbsession.commit()
+        self.dbsession.execute(text(f"SET LOCAL lock_timeout = '{self.lock_timeout}'"))
+        self.dbsession.execute(text(f"LOCK TABLE {self.model.__tablename__} IN ACCESS EXCLUSIVE MODE"))
+        contents = self._table()
+        rows = self._pending(contents)
+        if rows:
+            logger.info(f"Migration {self.name}: embedding {len(rows)} late rows before the swap")
+            state.rows_done += self._write(contents, rows)
+        for statement in swap_ddl(self.name, self.model):
+            self.dbsession.execute(text(statement))
+        state.status = "swapped"
+        self.dbsession.commit()
+        return state
+
+    def finish(self) -> EmbeddingMigrationState:
+        state = self._require("swapped")
+        self.dbsession.execute(text(f"SET LOCAL lock_timeout = '{self.lock_timeout}'"))
+        self.dbsession.execute(text(f"ALTER TABLE {self.model.__tablename__} DROP COLUMN {PREVIOUS_COLUMN}"))
+        state.status = "finished"
+        self.dbsession.commit()
+        return state
+
+    def abort(self) -> None:
+        """
+        Drops the shadow column and forgets a migration that wasn't swapped.
+        """
+        state = self._require("prepared", "backfilling", "backfilled", "indexed")
+        for statement in drop_trigger_ddl(self.name, self.model):
+            self.dbsession.execute(text(statement))
+        self.dbsession.execute(text(f"ALTER TABLE {self.model.__tablename__} DROP COLUMN IF EXISTS {SHADOW_COLUMN}"))
+        self.dbsession.delete(state)
+        self.dbsession.commit()
+
+
+class EmbeddingSwitch:
+    """
+    Picks the embedding model matching the `embedding` column for a
+    `DialogRetriever` during a migration: `previous_llm` until the swap
+    commits, then `next_llm` with the migration's column type.
+
+    The state is re-read at most every `refresh_interval` seconds and no
+    longer once the swap is seen, so retrievals may use the previous model
+    for up to `refresh_interval` after the swap.
+    """
+
+    def __init__(self, previous_llm, next_llm, name: str = "default", refresh_interval: float = 1.0):
+        self.previous_llm = previous_llm
+        self.next_llm = next_llm
+        self.name = name
+        self.refresh_interval = refresh_interval
+        self._swapped_model = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def resolve(self, session, model=CompanyContent):
+        """
+        Returns the (embedding model, content model) to query `model`'s table with.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._swapped_model is None and (
+                self._checked_at is None or now - self._checked_at >= self.refresh_interval
+            ):
+                self._checked_at = now
+                state = session.get(EmbeddingMigrationState, self.name, populate_existing=True)
+                if state is not None and state.status in ("swapped", "finished"):
+                    self._swapped_model = content_model_for(state.embedding_type, state.dimension, model)
+            if self._swapped_model is None:
+                return self.previous_llm, model
+            return self.next_llm, self._swapped_model
@@ -1,11 +1,16 @@
 from typing import TYPE_CHECKING, Any, Dict, List, Optional
 
 from dialog_lib.db.models import CompanyContent
+from dialog_lib.db.session import checkout
 from sqlalchemy.orm import DeclarativeBase, Session
 
 from langchain_core.retrievers import BaseRetriever
 from langchain_core.documents import Document
+from dialog_lib.coalescing import normalize_input, request_key, retrieval_flights
+from dialog_lib.db.versions import dataset_version
+from dialog_lib.embeddings.cache import RetrievalCache, embedding_model_key, retrieval_cache_key
 from dialog_lib.embeddings.generate import get_most_relevant_contents_from_message
+from dialog_lib.instrumentation import get_instrumentation
 
 class DialogRetriever(BaseRetriever):
     content_model: DeclarativeBase = CompanyContent
@@ -15,17 +20,100 @@ class DialogRetriever(BaseRetriever):
     embedding_llm: Optional[Any] = None
     embedding_column: str = "embedding"
     top_k: int = 5
+    return_parents: bool = False
+    search_mode: str = "vector"
+    candidate_factor: int = 10
+    vector_weight: float = 1.0
+    text_weight: float = 1.0
+    rrf_k: int = 60
+    diversify: bool = False
+    diversify_fetch_factor: int = 4
+    mmr_lambda: float = 0.5
+    duplicate_threshold: float = 0.95
+    cache: Optional[RetrievalCache] = None
+    coalesce: bool = False
+    embedding_switch: Optional[Any] = None
+
+    @property
+    def cache_params(self) -> Dict[str, Any]:
+        if self.embedding_switch is not None:
+            embedding_models = [
+                embedding_model_key(self.embedding_switch.previous_llm),
+                embedding_model_key(self.embedding_switch.next_llm),
+            ]
+        else:
+            embedding_models = [embedding_model_key(self.embedding_llm)]
+        return dict(
+            model=self.content_model.__tablename__,
+            embedding_models=embedding_models,
+            threshold=self.threshold,
+            embedding_column=self.embedding_column,
+            top_k=self.top_k,
+            return_parents=self.return_parents,
+            search_mode=self.search_mode,
+            candidate_factor=self.candidate_factor,
+            vector_weight=self.vector_weight,
+            text_weight=self.text_weight,
+            rrf_k=self.rrf_k,
+            diversify=self.diversify,
+            diversify_fetch_factor=self.diversify_fetch_factor,
+            mmr_lambda=self.mmr_lambda,
+            duplicate_threshold=self.duplicate_threshold,
+        )
 
     def _get_relevant_documents(self, query, *, run_manager):
+        if not self.coalesce:
+            return self._checkout_retrieve(query)
+        # concurrent identical queries share one embedding + retrieval
+        key = request_key(normalize_input(query), self.dataset, self.cache_params)
+        return list(retrieval_flights.do(key, lambda: self._checkout_retrieve(query)))
+
+    def _checkout_retrieve(self, query):
+        # the session outlives the query: don't keep its connection between turns
+        with checkout(self.session):
+            return self._retrieve(query)
+
+    def _retrieve(self, query):
+        if self.cache is None:
+            return self._search(query)
+
+        with get_instrumentation().stage("retrieval_cache") as record:
+            version = dataset_version(self.session, self.dataset)
+            key = retrieval_cache_key(query, self.dataset, version, **self.cache_params)
+            documents = self.cache.get(self.session, key)
+            record.set(cache_hit=documents is not None)
+        if documents is None:
+            documents = self._search(query)
+            self.cache.set(self.session, key, self.dataset, version, documents)
+        return documents
+
+    def _search(self, query):
+        embedding_llm, content_model = self.embedding_llm, self.content_model
+        if self.embedding_switch is not None:
+            # see `dialog_lib.embeddings.migration.EmbeddingSwitch`
+            embedding_llm, content_model = self.embedding_switch.resolve(self.session, content_model)
         relevant_contents = get_most_relevant_contents_from_message(
             query,
             top=self.top_k,
             dataset=self.dataset,
             session=self.session,
-            embeddings_llm=self.embedding_llm,
+            embeddings_llm=embedding_llm,
             cosine_similarity_threshold=self.threshold,
-            model=self.content_model,
+            model=content_model,
             embedding_column=self.embedding_column,
+            return_parents=self.return_parents,
+            search_mode=self.search_mode,
+            candidate_factor=self.candidate_factor,
+            vector_weight=self.vector_weight,
+            text_weight=self.text_weight,
+            rrf_k=self.rrf_k,
+            diversify=self.diversify,
+            diversify_fetch_factor=self.diversify_fetch_factor,
+            mmr_lambda=self.mmr_lambda,
+            duplicate_threshold=self.duplicate_threshold,
+            with_scores=True,
+            # documents only read columns: the prepared statement's tuples do
+            prepared=True,
         )
         return [
             Document(
@@ -36,9 +124,11 @@ class DialogRetriever(BaseRetriever):
                     "subcategory": content.subcategory,
                     "dataset": content.dataset,
                     "link": content.link,
+                    "id": content.id,
+                    "score": score,
                 },
             )
-            for content in relevant_contents
+            for content, score in relevant_contents
         ]
 
 
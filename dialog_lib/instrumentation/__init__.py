@@ -0,0 +1,9 @@
+from .core import (
+    Exporter,
+    Instrumentation,
+    StageRecord,
+    get_instrumentation,
+    set_instrumentation,
+)
+from .exporters import InMemoryExporter, OpenTelemetryExporter, PrometheusExporter
+from .callbacks import InstrumentationCallbackHandler
@@ -0,0 +1,92 @@
+import time
+
+from typing import Any, Dict, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from .core import Instrumentation
+
+
+CHAIN_STAGES = {"AnswerChain": "answer"}
+
+
+def token_usage(response) -> Dict[str, int]:
+    """
+    Reads token usage from an LLMResult, either from the provider's
+    `llm_output` or from the message `usage_metadata`.
+    """
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    if usage:
+        return {
+            "prompt_tokens": usage.get("prompt_tokens", 0),
+            "completion_tokens": usage.get("completion_tokens", 0),
+            "tokens": usage.get("total_tokens", 0),
+        }
+    for generations in response.generations:
+        for generation in generations:
+            metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if metadata:
+                return {
+                    "prompt_tokens": metadata.get("input_tokens", 0),
+                    "completion_tokens": metadata.get("output_tokens", 0),
+                    "tokens": metadata.get("total_tokens", 0),
+                }
+    return {}
+
+
+class InstrumentationCallbackHandler(BaseCallbackHandler):
+    """
+    Turns LangChain runs into stages: `retrieval` (with the number of
+    documents), `llm` (with token usage) and the named chains in `CHAIN_STAGES`.
+    """
+
+    run_inline = True
+
+    def __init__(self, instrumentation: Instrumentation):
+        self.instrumentation = instrumentation
+        self._runs: Dict[UUID, tuple] = {}
+
+    def _start(self, run_id, stage):
+        self._runs[run_id] = (stage, time.time_ns(), time.perf_counter())
+
+    def _end(self, run_id, error=None, **attributes):
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        stage, start_time, started_at = run
+        self.instrumentation.record(
+            stage, start_time, time.perf_counter() - started_at, error=error, **attributes
+        )
+
+    def on_chain_start(self, serialized, inputs, *, run_id: UUID, name: Optional[str] = None, **kwargs: Any):
+        stage = CHAIN_STAGES.get(name)
+        if stage is not None:
+            self._start(run_id, stage)
+
+    def on_chain_end(self, outputs, *, run_id: UUID, **kwargs: Any):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id: UUID, **kwargs: Any):
+        self._end(run_id, error=type(error).__name__)
+
+    def on_retriever_start(self, serialized, query, *, run_id: UUID, **kwargs: Any):
+        self._start(run_id, "retrieval")
+
+    def on_retriever_end(self, documents, *, run_id: UUID, **kwargs: Any):
+        self._end(run_id, rows=len(documents))
+
+    def on_retriever_error(self, error, *, run_id: UUID, **kwargs: Any):
+        self._end(run_id, error=type(error).__name__)
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, **kwargs: Any):
+        self._start(run_id, "llm")
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs: Any):
+        self._start(run_id, "llm")
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs: Any):
+        self._end(run_id, **token_usage(response))
+
+    def on_llm_error(self, error, *, run_id: UUID, **kwargs: Any):
+        self._end(run_id, error=type(error).__name__)
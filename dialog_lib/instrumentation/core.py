@@ -0,0 +1,121 @@
+import time
+import logging
+
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class StageRecord:
+    """
+    One timed pipeline stage. Well-known attributes are `rows`, `tokens`,
+    `prompt_tokens`, `completion_tokens` and `cache_hit`.
+    """
+    stage: str
+    start_time: int
+    duration: float = 0.0
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+class _NullRecord:
+    def set(self, **attributes):
+        pass
+
+
+class _NullStage:
+    record = _NullRecord()
+
+    def __enter__(self):
+        return self.record
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+NULL_STAGE = _NullStage()
+
+
+class Exporter:
+    """
+    Receives every finished stage. Exporters must be thread safe.
+    """
+
+    def export(self, record: StageRecord) -> None:
+        raise NotImplementedError("Exporters must implement export")
+
+
+class Instrumentation:
+    """
+    Times pipeline stages and hands them to the exporters. Without exporters
+    it is disabled and `stage` returns a shared no-op context manager.
+    """
+
+    def __init__(self, exporters: Iterable[Exporter] = ()):
+        self.exporters = list(exporters)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.exporters)
+
+    def add_exporter(self, exporter: Exporter) -> None:
+        self.exporters.append(exporter)
+
+    def stage(self, name: str, **attributes):
+        """
+        Context manager timing `name`; the yielded record takes extra
+        attributes through `record.set(rows=...)`.
+        """
+        if not self.exporters:
+            return NULL_STAGE
+        return self._stage(name, attributes)
+
+    @contextmanager
+    def _stage(self, name, attributes):
+        record = StageRecord(name, time.time_ns(), attributes=attributes)
+        started_at = time.perf_counter()
+        try:
+            yield record
+        except BaseException as exc:
+            record.error = type(exc).__name__
+            raise
+        finally:
+            record.duration = time.perf_counter() - started_at
+            self.emit(record)
+
+    def record(self, name: str, start_time: int, duration: float, error=None, **attributes) -> None:
+        """
+        Emits a stage timed elsewhere (i.e. by a callback handler).
+        """
+        if self.exporters:
+            self.emit(StageRecord(name, start_time, duration, attributes, error))
+
+    def emit(self, record: StageRecord) -> None:
+        for exporter in self.exporters:
+            try:
+                exporter.export(record)
+            except Exception as exc:
+                logger.warning(f"{type(exporter).__name__} failed to export {record.stage}: {exc}")
+
+
+_instrumentation = Instrumentation()
+
+
+def get_instrumentation() -> Instrumentation:
+    return _instrumentation
+
+
+def set_instrumentation(instrumentation: Instrumentation) -> Instrumentation:
+    """
+    Replaces the process wide instrumentation used when none is passed explicitly.
+    """
+    global _instrumentation
+    _instrumentation = instrumentation
+    return instrumentation
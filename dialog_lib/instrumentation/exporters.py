@@ -0,0 +1,128 @@
+import bisect
+import threading
+
+from collections import defaultdict
+from typing import Callable, Sequence
+
+from .core import Exporter, StageRecord
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNTED_ATTRIBUTES = ("rows", "tokens", "prompt_tokens", "completion_tokens")
+
+
+class InMemoryExporter(Exporter):
+    """
+    Keeps every record, mostly useful in tests and notebooks.
+    """
+
+    def __init__(self):
+        self.records = []
+        self._lock = threading.Lock()
+
+    def export(self, record: StageRecord) -> None:
+        with self._lock:
+            self.records.append(record)
+
+    def stages(self):
+        return [record.stage for record in self.records]
+
+
+class PrometheusExporter(Exporter):
+    """
+    Aggregates stages into Prometheus metrics rendered in the text
+    exposition format by `render`, to be served from a `/metrics` endpoint.
+    """
+
+    content_type = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self, namespace: str = "dialog", buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.namespace = namespace
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._histograms = defaultdict(lambda: [[0] * len(self.buckets), 0, 0.0])
+        self._counters = defaultdict(float)
+        self._gauges = {}
+
+    def add_gauge(self, name: str, value: Callable[[], float], help: str = "") -> None:
+        """
+        Adds a gauge read from `value()` on every render (i.e. a queue depth).
+        """
+        self._gauges[name] = (value, help)
+
+    def export(self, record: StageRecord) -> None:
+        with self._lock:
+            histogram = self._histograms[record.stage]
+            index = bisect.bisect_left(self.buckets, record.duration)
+            if index < len(self.buckets):
+                histogram[0][index] += 1
+            histogram[1] += 1
+            histogram[2] += record.duration
+
+            for attribute in COUNTED_ATTRIBUTES:
+                value = record.attributes.get(attribute)
+                if value:
+                    self._counters[(f"stage_{attribute}_total", record.stage)] += value
+            cache_hit = record.attributes.get("cache_hit")
+            if cache_hit is not None:
+                self._counters[("cache_hits_total" if cache_hit else "cache_misses_total", record.stage)] += 1
+            if record.error:
+                self._counters[("stage_errors_total", record.stage)] += 1
+
+    def render(self) -> str:
+        name = f"{self.namespace}_stage_duration_seconds"
+        lines = [
+            f"# HELP {name} Duration of dialog pipeline stages.",
+            f"# TYPE {name} histogram",
+        ]
+        with self._lock:
+            for stage, (buckets, count, total) in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, bucket in zip(self.buckets, buckets):
+                    cumulative += bucket
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {count}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {total}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {count}')
+
+            counters = defaultdict(list)
+            for (metric, stage), value in sorted(self._counters.items()):
+                counters[f"{self.namespace}_{metric}"].append((stage, value))
+        for metric, values in counters.items():
+            lines.append(f"# TYPE {metric} counter")
+            lines.extend(f'{metric}{{stage="{stage}"}} {value:g}' for stage, value in values)
+        for gauge, (value, help) in sorted(self._gauges.items()):
+            metric = f"{self.namespace}_{gauge}"
+            if help:
+                lines.append(f"# HELP {metric} {help}")
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {value():g}")
+        return "\n".join(lines) + "\n"
+
+
+class OpenTelemetryExporter(Exporter):
+    """
+    Emits one span per stage through an OpenTelemetry tracer. Requires the
+    `opentelemetry-api` package; spans are parented to the span current
+    when the stage finishes.
+    """
+
+    def __init__(self, tracer=None, tracer_name: str = "dialog_lib"):
+        try:
+            from opentelemetry import trace
+        except ImportError as exc:
+            raise ImportError(
+                "OpenTelemetryExporter requires opentelemetry-api: pip install opentelemetry-api"
+            ) from exc
+        self._trace = trace
+        self.tracer = tracer or trace.get_tracer(tracer_name)
+
+    def export(self, record: StageRecord) -> None:
+        attributes = {
+            f"dialog.{key}": value for key, value in record.attributes.items()
+            if isinstance(value, (str, bool, int, float))
+        }
+        span = self.tracer.start_span(record.stage, start_time=record.start_time, attributes=attributes)
+        if record.error:
+            span.set_status(self._trace.Status(self._trace.StatusCode.ERROR, record.error))
+        span.end(end_time=record.start_time + int(record.duration * 1e9))
@@ -0,0 +1,181 @@
+import asyncio
+import logging
+
+from collections import defaultdict
+from typing import Iterable, List, Optional
+from urllib.parse import urlparse
+from xml.etree import ElementTree
+
+import aiohttp
+from bs4 import BeautifulSoup
+from langchain_core.documents import Document
+
+from dialog_lib.db import get_session
+from dialog_lib.db.models import CompanyContent
+from dialog_lib.embeddings.chunking import chunk_text
+from dialog_lib.loaders.executor import IngestionExecutor, run_sync, store_contents
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_html(html: str):
+    """
+    Returns the (title, visible text) of an HTML page.
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    for tag in soup(["script", "style", "noscript"]):
+        tag.decompose()
+    title = soup.title.get_text(strip=True) if soup.title else ""
+    body = soup.body or soup
+    text = "\n".join(line.strip() for line in body.get_text("\n").splitlines() if line.strip())
+    return title, text
+
+
+def parse_sitemap(xml: str):
+    """
+    Returns (page urls, nested sitemap urls) listed in a sitemap or sitemap index.
+    """
+    root = ElementTree.fromstring(xml)
+    locations = [
+        element.text.strip() for element in root.iter()
+        if element.tag.endswith("loc") and element.text
+    ]
+    if root.tag.endswith("sitemapindex"):
+        return [], locations
+    return locations, []
+
+
+class WebCrawler:
+    """
+    Fetches pages concurrently, capping both the total number of in-flight
+    requests and the requests sent to a single host.
+    """
+
+    def __init__(self, concurrency: int = 16, per_host_limit: int = 4, timeout: float = 30):
+        self.concurrency = concurrency
+        self.per_host_limit = per_host_limit
+        self.timeout = timeout
+
+    async def _get(self, http, url, semaphore, host_semaphores):
+        async with host_semaphores[urlparse(url).netloc], semaphore:
+            try:
+                async with http.get(url) as response:
+                    response.raise_for_status()
+                    return await response.text()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                logger.warning(f"Failed to fetch {url}: {exc}")
+                return None
+
+    async def _sitemap_urls(self, http, sitemap_url, semaphore, host_semaphores):
+        urls, pending, visited = [], [sitemap_url], set()
+        while pending:
+            sitemap_url = pending.pop()
+            if sitemap_url in visited:
+                continue
+            visited.add(sitemap_url)
+            xml = await self._get(http, sitemap_url, semaphore, host_semaphores)
+            if xml is None:
+                continue
+            page_urls, nested = parse_sitemap(xml)
+            urls.extend(page_urls)
+            pending.extend(nested)
+        return urls
+
+    async def crawl(self, urls: Iterable[str] = (), sitemap_url: Optional[str] = None) -> List[Document]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        host_semaphores = defaultdict(lambda: asyncio.Semaphore(self.per_host_limit))
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+
+        async with aiohttp.ClientSession(timeout=timeout) as http:
+            urls = list(urls)
+            if sitemap_url:
+                urls += await self._sitemap_urls(http, sitemap_url, semaphore, host_semaphores)
+            urls = list(dict.fromkeys(urls))
+
+            pages = await asyncio.gather(
+                *[self._get(http, url, semaphore, host_semaphores) for url in urls]
+            )
+
+        documents = []
+        for url, html in zip(urls, pages):
+            if html is None:
+                continue
+            title, text = parse_html(html)
+            documents.append(Document(page_content=text, metadata={"title": title or url, "source": url}))
+        return documents
+
+
+def _store_pages(documents, embeddings_model_instance, dbsession, company_id, chunk_size, chunk_overlap, executor, writer):
+    if dbsession is None:
+        dbsession = get_session(company_id)
+    executor = executor or IngestionExecutor(embeddings_model_instance)
+    rows = [
+        dict(
+            link=document.metadata["source"],
+            category="web",
+            subcategory="website-content",
+            question=document.metadata["title"],
+            content=document.page_content,
+            dataset=company_id,
+            source=document.metadata["source"],
+        )
+        for document in documents
+    ]
+    texts = [chunk_text(row["question"], row["content"]) for row in rows]
+
+    logger.info(f"Crawled {len(documents)} pages")
+    return store_contents(
+        dbsession, CompanyContent, rows, texts, executor, chunk_size=chunk_size, chunk_overlap=chunk_overlap,
+        writer=writer,
+    )
+
+
+def load_webpages(
+    urls: Iterable[str] = (),
+    sitemap_url: Optional[str] = None,
+    embeddings_model_instance=None,
+    dbsession=None,
+    company_id=None,
+    chunk_size: int = 1000,
+    chunk_overlap: Optional[int] = None,
+    crawler: Optional[WebCrawler] = None,
+    executor: Optional[IngestionExecutor] = None,
+    writer=None,
+):
+    """
+    Crawls the given urls (and every page listed in `sitemap_url`) and
+    stores each page as a parent content row with one embedded row per chunk.
+    Without a `dbsession`, writes to the database (shard) of `company_id`.
+
+    From a running event loop, await `aload_webpages` instead (see `run_sync`).
+    """
+    crawler = crawler or WebCrawler()
+    documents = run_sync(crawler.crawl(urls, sitemap_url=sitemap_url), "aload_webpages")
+    return _store_pages(
+        documents, embeddings_model_instance, dbsession, company_id, chunk_size, chunk_overlap, executor, writer
+    )
+
+
+async def aload_webpages(
+    urls: Iterable[str] = (),
+    sitemap_url: Optional[str] = None,
+    embeddings_model_instance=None,
+    dbsession=None,
+    company_id=None,
+    chunk_size: int = 1000,
+    chunk_overlap: Optional[int] = None,
+    crawler: Optional[WebCrawler] = None,
+    executor: Optional[IngestionExecutor] = None,
+    writer=None,
+):
+    """
+    Asynchronous `load_webpages`: the pages are embedded and written in a
+    worker thread, so the session is used from that thread.
+    """
+    crawler = crawler or WebCrawler()
+    documents = await crawler.crawl(urls, sitemap_url=sitemap_url)
+    return await asyncio.to_thread(
+        _store_pages,
+        documents, embeddings_model_instance, dbsession, company_id, chunk_size, chunk_overlap, executor, writer,
+    )
@@ -1,29 +1,46 @@
+import os
 import logging
 from dialog_lib.db import get_session
 from dialog_lib.db.models import CompanyContent
-from dialog_lib.embeddings.generate import generate_embedding
-
-from langchain_openai import OpenAIEmbeddings
-from langchain_community.document_loaders.csv_loader import CSVLoader
+from dialog_lib.embeddings.generate import openai_embeddings
+from dialog_lib.loaders.executor import IngestionExecutor
+from dialog_lib.loaders.sync import row_key, sync_contents, append_contents
 
 
 logger = logging.getLogger(__name__)
 
 
 def load_csv(
-        file_path, dbsession=get_session(), embeddings_model_instance=None,
-        embedding_llm_model=None, embedding_llm_api_key=None, company_id=None
+        file_path, dbsession=None, embeddings_model_instance=None,
+        embedding_llm_model=None, embedding_llm_api_key=None, company_id=None,
+        executor=None, sync=False, key_column=None, chunk_size=None,
+        writer=None, allow_empty=False
     ):
+    """
+    Loads a CSV file into the contents table. With `sync=True`, only new or
+    changed rows are embedded and rows removed from the file are deleted.
+    With `chunk_size`, contents longer than it are stored as chunks linked to their row.
+    With a `writer` (see `dialog_lib.db.bulk`), new rows are written through COPY.
+    """
+
+    from langchain_community.document_loaders.csv_loader import CSVLoader
+
+    if dbsession is None:
+        dbsession = get_session(company_id)
 
     loader = CSVLoader(file_path=file_path)
     contents = loader.load()
 
     if not embeddings_model_instance:
         if embedding_llm_model.lower() == "openai":
-            embeddings_model_instance = OpenAIEmbeddings(openai_api_key=embedding_llm_api_key)
+            embeddings_model_instance = openai_embeddings(embedding_llm_api_key)
         else:
             raise ValueError("Invalid embeddings model")
 
+    if executor is None:
+        executor = IngestionExecutor(embeddings_model_instance)
+
+    records = []
     for csv_content in contents:
         content = {}
 
@@ -31,19 +48,23 @@ def load_csv(
             values = line.split(": ")
             content[values[0]] = values[1]
 
-        if not dbsession.query(CompanyContent).filter(
-            CompanyContent.question == content["question"], CompanyContent.content == content["content"]
-        ).first():
-            company_content = CompanyContent(
-                category="csv",
-                subcategory="csv-content",
-                question=content["question"],
-                content=content["content"],
-                dataset=company_id,
-                embedding=generate_embedding(csv_content.page_content, embeddings_model_instance)
-            )
-            dbsession.add(company_content)
-        else:
-            logger.warning(f"Question: {content['question']} already exists in the database. Skipping.")
+        records.append(dict(
+            category="csv",
+            subcategory="csv-content",
+            question=content["question"],
+            content=content["content"],
+            source_key=row_key(content, key_column),
+            text=csv_content.page_content,
+        ))
+
+    source = os.path.abspath(file_path)
+    if sync:
+        return sync_contents(
+            dbsession, CompanyContent, records, source=source, dataset=company_id, executor=executor,
+            chunk_size=chunk_size, writer=writer, allow_empty=allow_empty,
+        )
 
-        dbsession.commit()
\ No newline at end of file
+    return append_contents(
+        dbsession, CompanyContent, records, source=source, dataset=company_id, executor=executor,
+        chunk_size=chunk_size, writer=writer,
+    )
@@ -0,0 +1,330 @@
+import time
+import random
+import asyncio
+import logging
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+from typing import Callable, Dict, List, Optional, Sequence
+
+from sqlalchemy import delete, insert, update
+
+from dialog_lib.db.versions import bump_dataset_versions
+from dialog_lib.embeddings.chunking import chunk_text, split_content
+from dialog_lib.embeddings.generate import fit_embedding, supports_shortening
+from dialog_lib.instrumentation import get_instrumentation
+from dialog_lib.tokens import estimate_tokens
+
+
+logger = logging.getLogger(__name__)
+
+
+def is_rate_limit_error(exc: Exception) -> bool:
+    """
+    Returns True when the exception looks like an HTTP 429 from the provider.
+    """
+    status_code = getattr(exc, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(exc, "response", None), "status_code", None)
+    return status_code == 429 or "RateLimit" in type(exc).__name__
+
+
+@dataclass
+class IngestionMetrics:
+    rows: int = 0
+    tokens: int = 0
+    requests: int = 0
+    retries: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def tokens_per_second(self) -> float:
+        return self.tokens / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self) -> Dict:
+        return {
+            **asdict(self),
+            "rows_per_second": self.rows_per_second,
+            "tokens_per_second": self.tokens_per_second,
+        }
+
+
+class RateBudget:
+    """
+    Sliding one-minute window over requests and (estimated) tokens.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, window=60.0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.window = window
+        self._entries = deque()
+        self._tokens = 0
+        self._lock = asyncio.Lock()
+
+    def _prune(self, now):
+        while self._entries and now - self._entries[0][0] >= self.window:
+            _, tokens = self._entries.popleft()
+            self._tokens -= tokens
+
+    def _fits(self, tokens):
+        if self.requests_per_minute and len(self._entries) >= self.requests_per_minute:
+            return False
+        # A single oversized request is let through on an empty window.
+        if self.tokens_per_minute and self._entries and self._tokens + tokens > self.tokens_per_minute:
+            return False
+        return True
+
+    async def acquire(self, tokens: int = 0) -> None:
+        if not self.requests_per_minute and not self.tokens_per_minute:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._prune(now)
+                if self._fits(tokens):
+                    self._entries.append((now, tokens))
+                    self._tokens += tokens
+                    return
+                await asyncio.sleep(self.window - (now - self._entries[0][0]))
+
+
+class IngestionExecutor:
+    """
+    Runs `aembed_documents` batches concurrently under a requests/tokens per
+    minute budget, retrying rate limited calls with exponential backoff.
+
+    Results are handed to `on_batch` in input order, so callers can commit
+    rows batch by batch while later batches are still in flight.
+    """
+
+    def __init__(
+        self,
+        embeddings_model_instance,
+        concurrency: int = 4,
+        batch_size: int = 64,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+        max_retries: int = 6,
+        backoff_base: float = 1.0,
+        max_backoff: float = 60.0,
+    ):
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+
+        self.embeddings_model_instance = embeddings_model_instance
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.max_backoff = max_backoff
+        self.metrics = IngestionMetrics()
+
+    async def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        aembed_documents = getattr(self.embeddings_model_instance, "aembed_documents", None)
+        if aembed_documents is not None:
+            return await aembed_documents(texts)
+        return await asyncio.to_thread(self.embeddings_model_instance.embed_documents, texts)
+
+    async def _embed_with_retries(self, texts, tokens, budget):
+        attempt = 0
+        while True:
+            await budget.acquire(tokens)
+            self.metrics.requests += 1
+            try:
+                with get_instrumentation().stage("ingestion_embedding", rows=len(texts), tokens=tokens):
+                    return await self._embed_batch(texts)
+            except Exception as exc:
+                if not is_rate_limit_error(exc) or attempt >= self.max_retries:
+                    raise
+                delay = min(self.max_backoff, self.backoff_base * 2 ** attempt)
+                delay += random.uniform(0, delay / 2)
+                attempt += 1
+                self.metrics.retries += 1
+                logger.warning(f"Embedding batch rate limited, retry {attempt} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+    async def aembed(
+        self,
+        texts: Sequence[str],
+        on_batch: Optional[Callable[[int, List[List[float]]], None]] = None,
+    ) -> List[List[float]]:
+        """
+        Embeds all texts and returns the embeddings in input order.
+
+        :param on_batch: called as `on_batch(start, embeddings)` for each batch,
+            strictly in input order.
+        """
+        texts = list(texts)
+        batches = [
+            texts[start:start + self.batch_size]
+            for start in range(0, len(texts), self.batch_size)
+        ]
+        budget = RateBudget(self.requests_per_minute, self.tokens_per_minute)
+        results: List[Optional[List[List[float]]]] = [None] * len(batches)
+        pending = iter(range(len(batches)))
+        next_to_commit = 0
+        started_at = time.monotonic()
+
+        def flush():
+            nonlocal next_to_commit
+            while next_to_commit < len(batches) and results[next_to_commit] is not None:
+                if on_batch is not None:
+                    on_batch(next_to_commit * self.batch_size, results[next_to_commit])
+                next_to_commit += 1
+
+        async def worker():
+            for index in pending:
+                batch = batches[index]
+                tokens = sum(estimate_tokens(text) for text in batch)
+                results[index] = await self._embed_with_retries(batch, tokens, budget)
+                self.metrics.rows += len(batch)
+                self.metrics.tokens += tokens
+                flush()
+
+        try:
+            workers = [
+                asyncio.create_task(worker())
+                for _ in range(min(self.concurrency, len(batches)))
+            ]
+            try:
+                await asyncio.gather(*workers)
+            except BaseException:
+                for task in workers:
+                    task.cancel()
+                raise
+        finally:
+            self.metrics.elapsed += time.monotonic() - started_at
+
+        return [embedding for batch in results for embedding in batch]
+
+    def embed(self, texts, on_batch=None):
+        """
+        Synchronous wrapper around `aembed` (see `run_sync`).
+        """
+        return run_sync(self.aembed(texts, on_batch=on_batch), "IngestionExecutor.aembed")
+
+
+def run_sync(coroutine, alternative: str):
+    """
+    Runs `coroutine` from synchronous code. Called from a running event loop
+    (i.e. a notebook or an async endpoint), it runs on its own loop in a
+    worker thread, blocking the caller's loop until it is done: await
+    `alternative` there instead.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    logger.warning(f"Called synchronously from a running event loop; await {alternative} instead")
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(asyncio.run, coroutine).result()
+
+
+def store_parents(dbsession, model, contents, texts, chunk_size, chunk_overlap=None):
+    """
+    Stores every row whose content is longer than `chunk_size` as an
+    unembedded parent and returns the rows left to embed (short rows as they
+    are plus one row per chunk, pointing to its parent) and the
+    `(parent id, content_hash)` to set once the row at each index is written.
+
+    Rows carrying an `id` are updated in place and lose their previous chunks.
+    Parents are stored without their `content_hash` until their last chunk is
+    written, so a load failing in between is synced again on the next run.
+    """
+    rows, row_texts, parents = [], [], []
+    for row, text in zip(contents, texts):
+        chunks = split_content(row["content"], chunk_size, chunk_overlap)
+        if len(chunks) > 1:
+            parents.append((row, chunks))
+        else:
+            rows.append(row)
+            row_texts.append(text)
+
+    if not parents:
+        return rows, row_texts, {}
+
+    new_parents = [dict(row, embedding=None, content_hash=None) for row, _ in parents if "id" not in row]
+    new_ids = iter(dbsession.scalars(
+        insert(model).returning(model.id, sort_by_parameter_order=True), new_parents
+    ).all() if new_parents else [])
+    updated = [dict(row, embedding=None, content_hash=None) for row, _ in parents if "id" in row]
+    if updated:
+        dbsession.execute(delete(model).where(model.parent_id.in_([row["id"] for row in updated])))
+        dbsession.execute(update(model), updated)
+    bump_dataset_versions(dbsession, {row.get("dataset") for row, _ in parents})
+    dbsession.commit()
+
+    parent_hashes = {}
+    for row, chunks in parents:
+        parent_id = row["id"] if "id" in row else next(new_ids)
+        for chunk_index, chunk in enumerate(chunks):
+            chunk_row = {key: value for key, value in row.items() if key not in ("id", "source_key")}
+            rows.append(dict(chunk_row, content=chunk, parent_id=parent_id, chunk_index=chunk_index))
+            row_texts.append(chunk_text(row["question"], chunk))
+        if row.get("content_hash") is not None:
+            parent_hashes[len(rows) - 1] = (parent_id, row["content_hash"])
+    return rows, row_texts, parent_hashes
+
+
+def store_contents(
+    dbsession, model, contents, texts, executor, chunk_size=None, chunk_overlap=None, writer=None
+):
+    """
+    Embeds `texts` with the executor and writes one `model` row per entry
+    of `contents` (the row kwargs), committing once per batch in order.
+    Rows carrying an `id` are updated, the others are bulk inserted. Every
+    batch bumps the version of the datasets it wrote (see `dialog_lib.db.versions`).
+
+    With `chunk_size`, long contents are split into chunk rows linked to
+    their parent row (see `store_parents`), overlapping by `chunk_overlap`
+    characters (see `split_content`). With a `writer` (i.e. a
+    `ContentsCopyWriter`), inserts are streamed through it instead of the session.
+    """
+    instrumentation = get_instrumentation()
+    parent_hashes = {}
+    if chunk_size:
+        with instrumentation.stage("ingestion_parents"):
+            contents, texts, parent_hashes = store_parents(
+                dbsession, model, contents, texts, chunk_size, chunk_overlap
+            )
+    # don't hold the session's read locks while a writer streams rows
+    dbsession.commit()
+    dimension = model.embedding.type.dim
+    shorten = supports_shortening(executor.embeddings_model_instance)
+
+    def write_batch(start, embeddings):
+        inserts, updates = [], []
+        for row, embedding in zip(contents[start:start + len(embeddings)], embeddings):
+            row = dict(row, embedding=fit_embedding(embedding, dimension, shorten))
+            (updates if "id" in row else inserts).append(row)
+        # parents whose last chunk is in this batch, set in the chunks' transaction
+        hashes = [parent_hashes[index] for index in range(start, start + len(embeddings)) if index in parent_hashes]
+        with instrumentation.stage("ingestion_write", rows=len(embeddings)):
+            if inserts and writer is not None:
+                writer.write(inserts)
+            elif inserts:
+                dbsession.execute(insert(model), inserts)
+            if updates:
+                dbsession.execute(update(model), updates)
+            if hashes and writer is not None:
+                writer.set_content_hashes(hashes)
+            elif hashes:
+                dbsession.execute(update(model), [{"id": id, "content_hash": hash} for id, hash in hashes])
+            bump_dataset_versions(dbsession, {row.get("dataset") for row in inserts + updates})
+            dbsession.commit()
+
+    with instrumentation.stage("ingestion") as record:
+        executor.embed(texts, on_batch=write_batch)
+        record.set(rows=len(texts))
+    logger.info(f"Ingestion metrics: {executor.metrics.as_dict()}")
+    return executor.metrics
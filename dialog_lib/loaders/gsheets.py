@@ -3,10 +3,11 @@ import logging
 
 from dialog_lib.db.models import CompanyContent
 from dialog_lib.db.session import get_session
-from dialog_lib.embeddings.generate import generate_embedding
+from dialog_lib.embeddings.generate import openai_embeddings
+from dialog_lib.loaders.executor import IngestionExecutor
+from dialog_lib.loaders.sync import row_key, sync_contents, append_contents
 
 from pathlib import Path
-from langchain_openai import OpenAIEmbeddings
 from langchain_core.documents import Document
 from langchain_community.document_loaders.base import BaseLoader
 from langchain_community.document_loaders.csv_loader import CSVLoader
@@ -42,19 +43,34 @@ class GoogleSheetsLoader(BaseLoader):
 
 
 def load_google_sheets(
-        credentials_path, spreadsheet_url, sheet_name, dbsession=get_session(),
+        credentials_path, spreadsheet_url, sheet_name, dbsession=None,
         embeddings_model_instance=None, embedding_llm_model=None, embedding_llm_api_key=None,
-        company_id=None
+        company_id=None, executor=None, sync=False, key_column=None, chunk_size=None,
+        writer=None, allow_empty=False
     ):
+    """
+    Loads a Google Sheets worksheet into the contents table. With `sync=True`,
+    only new or changed rows are embedded and rows removed from the sheet are deleted
+    (see `sync_contents`; an empty sheet only deletes them with `allow_empty`).
+    With `chunk_size`, contents longer than it are stored as chunks linked to their row.
+    With a `writer` (see `dialog_lib.db.bulk`), new rows are written through COPY.
+    """
+    if dbsession is None:
+        dbsession = get_session(company_id)
+
     loader = GoogleSheetsLoader(credentials_path, spreadsheet_url, sheet_name)
     contents = loader.load()
 
     if not embeddings_model_instance:
         if embedding_llm_model.lower() == "openai":
-            embeddings_model_instance = OpenAIEmbeddings(openai_api_key=embedding_llm_api_key)
+            embeddings_model_instance = openai_embeddings(embedding_llm_api_key)
         else:
             raise ValueError("Invalid embeddings model")
 
+    if executor is None:
+        executor = IngestionExecutor(embeddings_model_instance)
+
+    records = []
     for csv_content in contents:
         content = {}
 
@@ -63,19 +79,23 @@ def load_google_sheets(
                 values = line.split(": ")
                 content[values[0]] = values[1]
 
-        if not dbsession.query(CompanyContent).filter(
-            CompanyContent.question == content["question"], CompanyContent.content == content["content"]
-        ).first():
-            company_content = CompanyContent(
-                category="csv",
-                subcategory="csv-content",
-                question=content["question"],
-                content=content["content"],
-                dataset=company_id,
-                embedding=generate_embedding(csv_content.page_content, embeddings_model_instance)
-            )
-            dbsession.add(company_content)
-        else:
-            logger.warning(f"Question: {content['question']} already exists in the database. Skipping.")
+        records.append(dict(
+            category="csv",
+            subcategory="csv-content",
+            question=content["question"],
+            content=content["content"],
+            source_key=row_key(content, key_column),
+            text=csv_content.page_content,
+        ))
+
+    source = f"{spreadsheet_url}#{sheet_name}"
+    if sync:
+        return sync_contents(
+            dbsession, CompanyContent, records, source=source, dataset=company_id, executor=executor,
+            chunk_size=chunk_size, writer=writer, allow_empty=allow_empty,
+        )
 
-    dbsession.commit()
\ No newline at end of file
+    return append_contents(
+        dbsession, CompanyContent, records, source=source, dataset=company_id, executor=executor,
+        chunk_size=chunk_size, writer=writer,
+    )
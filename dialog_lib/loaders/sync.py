@@ -0,0 +1,168 @@
+import hashlib
+import logging
+
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from sqlalchemy import delete, or_, select, update
+
+from dialog_lib.db.versions import bump_dataset_versions
+from dialog_lib.loaders.executor import IngestionMetrics, store_contents
+
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def row_key(content: Dict[str, str], key_column: Optional[str] = None) -> str:
+    """
+    Returns the stable identity of a source row: the `key_column` value when
+    given, otherwise an `id` column if the source has one, otherwise the question.
+    """
+    if key_column is None:
+        key_column = "id" if content.get("id") else "question"
+    return str(content[key_column])
+
+
+@dataclass
+class SyncSummary:
+    inserted: int = 0
+    updated: int = 0
+    deleted: int = 0
+    skipped: int = 0
+    adopted: int = 0
+    metrics: IngestionMetrics = field(default_factory=IngestionMetrics)
+
+    def __str__(self):
+        return (
+            f"{self.inserted} inserted, {self.updated} updated, "
+            f"{self.deleted} deleted, {self.skipped} skipped, {self.adopted} adopted"
+        )
+
+
+def append_contents(
+    dbsession, model, records: List[Dict], source: str, dataset=None, executor=None, chunk_size=None,
+    writer=None
+):
+    """
+    Inserts the records whose (question, content) pair is not stored yet,
+    keeping their source identity and hash so a later sync can reconcile them.
+    """
+    rows, texts, seen = [], [], set()
+    for record in records:
+        record = dict(record)
+        key = (record["question"], record["content"])
+        if key not in seen and not dbsession.query(model).filter(
+            model.question == record["question"], model.content == record["content"]
+        ).first():
+            seen.add(key)
+            text = record.pop("text")
+            rows.append(dict(record, dataset=dataset, source=source, content_hash=content_hash(text)))
+            texts.append(text)
+        else:
+            logger.warning(f"Question: {record['question']} already exists in the database. Skipping.")
+
+    return store_contents(
+        dbsession, model, rows, texts, executor, chunk_size=chunk_size, writer=writer
+    )
+
+
+def sync_contents(
+    dbsession, model, records: List[Dict], source: str, dataset=None, executor=None, chunk_size=None,
+    writer=None, adopt=True, allow_empty=False
+):
+    """
+    Reconciles the rows stored for (`source`, `dataset`) with `records`.
+
+    Each record holds the row fields plus `source_key` and `text` (the text
+    that gets embedded). Only new rows and rows whose text hash changed are
+    embedded; unchanged rows are skipped and rows missing from `records`
+    are deleted, together with their chunks.
+
+    With `adopt`, rows of the dataset loaded before syncing existed (without
+    a source) and holding a record's question are taken over by this source
+    instead of being duplicated; they are only embedded again when their
+    content differs. Unclaimed ones are left alone.
+
+    An empty `records` would delete every row of the source, which is more
+    likely an export or read failure: it raises ValueError unless `allow_empty`.
+    """
+    summary = SyncSummary()
+    stored = {
+        key: (id, hash)
+        for id, key, hash in dbsession.execute(
+            select(model.id, model.source_key, model.content_hash).filter(
+                model.source == source, model.dataset == dataset, model.parent_id.is_(None)
+            )
+        )
+    }
+    if not records and stored and not allow_empty:
+        raise ValueError(
+            f"{source} has no rows, refusing to delete its {len(stored)} stored rows (allow_empty or --allow-empty does)"
+        )
+
+    unsourced = {}
+    if adopt:
+        for id, question, content in dbsession.execute(
+            select(model.id, model.question, model.content).filter(
+                model.source.is_(None), model.dataset == dataset, model.parent_id.is_(None)
+            ).order_by(model.id)
+        ):
+            unsourced.setdefault(question, (id, content))
+
+    pending, texts, seen = [], [], set()
+    for record in records:
+        record = dict(record)
+        text = record.pop("text")
+        key = record["source_key"]
+        if key in seen:
+            logger.warning(f"Row key {key} is duplicated in {source}. Skipping.")
+            summary.skipped += 1
+            continue
+        seen.add(key)
+
+        record.update(source=source, dataset=dataset, content_hash=content_hash(text))
+        stored_id, stored_hash = stored.get(key, (None, None))
+        if stored_id is None and record["question"] in unsourced:
+            stored_id, content = unsourced.pop(record["question"])
+            summary.adopted += 1
+            if content == record["content"]:
+                dbsession.execute(update(model).where(model.id == stored_id).values(
+                    source=source, source_key=key, content_hash=record["content_hash"]
+                ))
+                summary.skipped += 1
+                continue
+        if stored_id is not None and stored_hash == record["content_hash"]:
+            summary.skipped += 1
+            continue
+        if stored_id is not None:
+            record["id"] = stored_id
+        pending.append(record)
+        texts.append(text)
+
+    updated = [record["id"] for record in pending if "id" in record]
+    summary.updated = len(updated)
+    summary.inserted = len(pending) - len(updated)
+    if updated:
+        dbsession.execute(delete(model).where(model.parent_id.in_(updated)))
+    if pending:
+        summary.metrics = store_contents(
+            dbsession, model, pending, texts, executor, chunk_size=chunk_size, writer=writer
+        )
+
+    removed = [id for key, (id, _) in stored.items() if key not in seen]
+    if removed:
+        dbsession.execute(
+            delete(model).where(or_(model.id.in_(removed), model.parent_id.in_(removed)))
+        )
+        bump_dataset_versions(dbsession, [dataset])
+        dbsession.commit()
+        summary.deleted = len(removed)
+    if summary.adopted:
+        dbsession.commit()
+
+    logger.info(f"Synced {source}: {summary}")
+    return summary
@@ -1,10 +1,15 @@
 from dialog_lib.db.models import CompanyContent
 from dialog_lib.embeddings.generate import generate_embedding
 from dialog_lib.db import get_session
-from langchain_community.document_loaders import WebBaseLoader
+from dialog_lib.db.versions import bump_dataset_versions
 
 
-def load_webpage(url, embeddings_model_instance, session=get_session(), company_id=None):
+def load_webpage(url, embeddings_model_instance, session=None, company_id=None):
+    from langchain_community.document_loaders import WebBaseLoader
+
+    if session is None:
+        session = get_session(company_id)
+
     loader = WebBaseLoader(url)
     contents = loader.load()
 
@@ -20,4 +25,6 @@ def load_webpage(url, embeddings_model_instance, session=get_session(), company_
         )
         session.add(company_content)
 
+    bump_dataset_versions(session, [company_id])
+    session.commit()
     return company_content
\ No newline at end of file
@@ -1,13 +1,9 @@
 import os
 import click
-from sqlalchemy import create_engine
-from sqlalchemy.orm import Session
-from dialog_lib.loaders.csv import load_csv as csv_loader
-from dialog_lib.loaders.gsheets import load_google_sheets as gsheets_loader
-from dialog_lib.agents import DialogOpenAI, DialogAnthropic
-from dialog_lib.memory import generate_local_memory_instance
+import contextlib
 
-from langchain_openai import OpenAIEmbeddings
+# Providers, loaders and database drivers are imported inside the commands
+# so `dialog --help` and unrelated commands start without loading them.
 
 @click.group()
 def cli():
@@ -42,6 +38,9 @@ def run_llm(agent, instance_name, memory, debug=False):
 @click.option("--prompt", default="You are a bot called Sara. Be nice to other human beings.", help="The prompt for the dialog")
 @click.option("--debug", default=False, help="Prints the memory after the dialog ends", is_flag=True)
 def openai(model, temperature, llm_api_key, prompt, debug):
+    from dialog_lib.agents.openai import DialogOpenAI
+    from dialog_lib.memory import generate_local_memory_instance
+
     memory = generate_local_memory_instance()
     dialog = DialogOpenAI(
         model=model,
@@ -59,6 +58,9 @@ def openai(model, temperature, llm_api_key, prompt, debug):
 @click.option("--prompt", default="You are a bot called Sara. Be nice to other human beings.", help="The prompt for the dialog")
 @click.option("--debug", default=False, help="Prints the memory after the dialog ends", is_flag=True)
 def anthropic(model, temperature, llm_api_key, prompt, debug):
+    from dialog_lib.agents.anthropic import DialogAnthropic
+    from dialog_lib.memory import generate_local_memory_instance
+
     memory = generate_local_memory_instance()
     dialog = DialogAnthropic(
         model=model,
@@ -69,21 +71,97 @@ def anthropic(model, temperature, llm_api_key, prompt, debug):
     )
     run_llm(dialog, "Anthropic", memory, debug=debug)
 
+def ingestion_options(command):
+    command = click.option("--dataset", default=None, help="The dataset the contents belong to")(command)
+    command = click.option("--rpm", default=None, type=int, help="Max embedding requests per minute")(command)
+    command = click.option("--concurrency", default=4, help="Number of concurrent embedding requests")(command)
+    command = click.option(
+        "--defer-indexes", default=False, is_flag=True,
+        help="With --copy, drop the contents indexes during the load and rebuild them at the end"
+    )(command)
+    command = click.option(
+        "--copy", "use_copy", default=False, is_flag=True,
+        help="Write new rows with COPY (FORMAT BINARY) instead of INSERT"
+    )(command)
+    command = click.option(
+        "--chunk-size", default=None, type=click.IntRange(min=1),
+        help="Split contents longer than this many characters into chunks"
+    )(command)
+    command = click.option(
+        "--allow-empty", default=False, is_flag=True,
+        help="With --sync, let an empty source delete every row previously loaded from it"
+    )(command)
+    command = click.option("--key-column", default=None, help="Column holding the stable row identity used by --sync")(command)
+    command = click.option(
+        "--sync", default=False, is_flag=True,
+        help="Only embed new or changed rows, update them in place and delete rows removed from the source"
+    )(command)
+    return command
+
+@contextlib.contextmanager
+def copy_writer(database_url, use_copy, defer_indexes, sync=False):
+    if not use_copy:
+        yield None
+        return
+    if defer_indexes and sync:
+        raise click.UsageError("--defer-indexes can't be combined with --sync")
+
+    import psycopg
+    from dialog_lib.db.bulk import ContentsCopyWriter, psycopg_url
+
+    with psycopg.connect(psycopg_url(database_url)) as connection:
+        with ContentsCopyWriter(connection, defer_indexes=defer_indexes) as writer:
+            yield writer
+
+def shard_database_url(dataset, database_url):
+    from dialog_lib.db.session import get_database_url
+
+    return get_database_url(dataset, default=database_url)
+
+def echo_ingestion_metrics(metrics):
+    from dialog_lib.loaders.sync import SyncSummary
+
+    if isinstance(metrics, SyncSummary):
+        click.echo(f"## Sync summary: {metrics}")
+        metrics = metrics.metrics
+    click.echo(
+        f"## {metrics.rows} rows, {metrics.rows_per_second:.1f} rows/s, "
+        f"{metrics.tokens_per_second:.1f} tokens/s, {metrics.retries} retries"
+    )
+
 @cli.command()
 @click.option("--database-url", default=os.environ.get("DATABASE_URL"), help="The postgres database URL")
 @click.option("--llm-api-key", default=get_llm_key(), help="The LLM API key", required=True)
 @click.option("--file", help="The CSV file to load the data from", required=True)
-def load_csv(database_url, llm_api_key, file):
+@ingestion_options
+def load_csv(
+    database_url, llm_api_key, file, concurrency, rpm, sync, key_column, allow_empty, chunk_size, use_copy,
+    defer_indexes, dataset
+):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+    from dialog_lib.embeddings.generate import openai_embeddings
+    from dialog_lib.loaders.csv import load_csv as csv_loader
+    from dialog_lib.loaders.executor import IngestionExecutor
+
+    database_url = shard_database_url(dataset, database_url)
     engine = create_engine(database_url)
-    dbsession = Session(engine.connect())
-    with Session(engine.connect()) as session:
-        csv_loader(
+    embeddings = openai_embeddings(llm_api_key)
+    with Session(engine.connect()) as session, copy_writer(database_url, use_copy, defer_indexes, sync) as writer:
+        metrics = csv_loader(
             file_path=file,
             dbsession=session,
-            embedding_llm_model="openai",
-            embedding_llm_api_key=llm_api_key
+            company_id=dataset,
+            embeddings_model_instance=embeddings,
+            executor=IngestionExecutor(embeddings, concurrency=concurrency, requests_per_minute=rpm),
+            sync=sync,
+            key_column=key_column,
+            allow_empty=allow_empty,
+            chunk_size=chunk_size,
+            writer=writer,
         )
     click.echo("## Loaded the CSV file to the database")
+    echo_ingestion_metrics(metrics)
 
 @cli.command()
 @click.option("--spreadsheet-url", help="The Google Sheets URL", required=True)
@@ -95,16 +173,386 @@ def load_csv(database_url, llm_api_key, file):
 )
 @click.option("--database-url", default=os.environ.get("DATABASE_URL"), help="The postgres database URL")
 @click.option("--llm-api-key", default=get_llm_key(), help="The OpenAI API key")
-def load_google_sheets(spreadsheet_url, sheet_name, credentials_path, database_url, llm_api_key):
+@ingestion_options
+def load_google_sheets(
+    spreadsheet_url, sheet_name, credentials_path, database_url, llm_api_key, concurrency, rpm, sync, key_column,
+    allow_empty, chunk_size, use_copy, defer_indexes, dataset
+):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+    from dialog_lib.embeddings.generate import openai_embeddings
+    from dialog_lib.loaders.executor import IngestionExecutor
+    from dialog_lib.loaders.gsheets import load_google_sheets as gsheets_loader
+
+    database_url = shard_database_url(dataset, database_url)
     engine = create_engine(database_url)
     dbsession = Session(engine.connect())
-    gsheets_loader(
-        credentials_path=credentials_path,
-        spreadsheet_url=spreadsheet_url,
-        sheet_name=sheet_name,
-        dbsession=dbsession,
-        embeddings_model_instance=OpenAIEmbeddings(openai_api_key=llm_api_key)
+    embeddings = openai_embeddings(llm_api_key)
+    with copy_writer(database_url, use_copy, defer_indexes, sync) as writer:
+        metrics = gsheets_loader(
+            credentials_path=credentials_path,
+            spreadsheet_url=spreadsheet_url,
+            sheet_name=sheet_name,
+            dbsession=dbsession,
+            company_id=dataset,
+            embeddings_model_instance=embeddings,
+            executor=IngestionExecutor(embeddings, concurrency=concurrency, requests_per_minute=rpm),
+            sync=sync,
+            key_column=key_column,
+            allow_empty=allow_empty,
+            chunk_size=chunk_size,
+            writer=writer,
+        )
+    echo_ingestion_metrics(metrics)
+
+@cli.command()
+@click.option("--url", "urls", multiple=True, help="A page to load, can be repeated")
+@click.option("--sitemap-url", default=None, help="A sitemap (or sitemap index) listing the pages to load")
+@click.option("--database-url", default=os.environ.get("DATABASE_URL"), help="The postgres database URL")
+@click.option("--llm-api-key", default=get_llm_key(), help="The OpenAI API key")
+@click.option("--chunk-size", default=1000, type=click.IntRange(min=1), help="Max characters per stored chunk")
+@click.option("--per-host-limit", default=4, help="Max concurrent requests to a single host")
+@click.option("--fetch-concurrency", default=16, help="Max concurrent page fetches")
+@click.option("--concurrency", default=4, help="Number of concurrent embedding requests")
+@click.option("--rpm", default=None, type=int, help="Max embedding requests per minute")
+@click.option("--copy", "use_copy", default=False, is_flag=True, help="Write new rows with COPY (FORMAT BINARY)")
+@click.option("--defer-indexes", default=False, is_flag=True, help="With --copy, rebuild the indexes after the load")
+@click.option("--dataset", default=None, help="The dataset the pages belong to")
+def load_web(
+    urls, sitemap_url, database_url, llm_api_key, chunk_size, per_host_limit, fetch_concurrency, concurrency, rpm,
+    use_copy, defer_indexes, dataset
+):
+    if not urls and not sitemap_url:
+        raise click.UsageError("Provide at least one --url or a --sitemap-url")
+
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+    from dialog_lib.embeddings.generate import openai_embeddings
+    from dialog_lib.loaders.crawler import WebCrawler, load_webpages as web_loader
+    from dialog_lib.loaders.executor import IngestionExecutor
+
+    database_url = shard_database_url(dataset, database_url)
+    engine = create_engine(database_url)
+    embeddings = openai_embeddings(llm_api_key)
+    with Session(engine) as session, copy_writer(database_url, use_copy, defer_indexes) as writer:
+        metrics = web_loader(
+            urls=urls,
+            sitemap_url=sitemap_url,
+            embeddings_model_instance=embeddings,
+            dbsession=session,
+            company_id=dataset,
+            chunk_size=chunk_size,
+            crawler=WebCrawler(concurrency=fetch_concurrency, per_host_limit=per_host_limit),
+            executor=IngestionExecutor(embeddings, concurrency=concurrency, requests_per_minute=rpm),
+            writer=writer,
+        )
+    click.echo("## Loaded the web pages to the database")
+    echo_ingestion_metrics(metrics)
+
+@cli.command()
+@click.option("--database-url", default=os.environ.get("DATABASE_URL"), help="The postgres database URL")
+@click.option("--output", default="bench_output.json", help="Where to write the JSON results")
+@click.option("--contents", default=500, help="Number of contents loaded before the run")
+@click.option("--turns", default=100, help="Turns per stage and per concurrency level")
+@click.option("--concurrency", default="1,4,16", help="Comma separated concurrency levels")
+@click.option("--chat-latency", default=0.0, help="Simulated chat model latency, in seconds")
+@click.option("--embedding-latency", default=0.0, help="Simulated embedding model latency, in seconds")
+def benchmark(database_url, output, contents, turns, concurrency, chat_latency, embedding_latency):
+    """
+    Benchmarks the turn pipeline against a local Postgres with fake models.
+    """
+    from dialog_lib.benchmarks.pipeline import PipelineBenchmark, write_results
+
+    results = PipelineBenchmark(
+        database_url,
+        contents=contents,
+        turns=turns,
+        concurrency_levels=[int(level) for level in concurrency.split(",")],
+        chat_latency=chat_latency,
+        embedding_latency=embedding_latency,
+    ).run()
+    write_results(results, output)
+    for level in results["turns"]:
+        click.echo(
+            f"## concurrency {level['concurrency']}: {level['turns_per_second']:.1f} turns/s, "
+            f"p95 {level['latency']['p95_ms']:.1f} ms, {level['round_trips_per_turn']:.1f} round trips/turn"
+        )
+    click.echo(f"## Results written to {output}")
+
+@cli.command()
+@click.option("--database-url", default=os.environ.get("DATABASE_URL"), help="The postgres database URL")
+@click.option("--output", default="-", help="Output file, - for stdout (jsonl only)")
+@click.option("--format", "export_format", default="jsonl", type=click.Choice(["jsonl", "parquet"]))
+@click.option("--since", default=None, type=click.DateTime(), help="Only messages at or after this time")
+@click.option("--until", default=None, type=click.DateTime(), help="Only messages before this time")
+@click.option("--dataset", default=None, help="Only sessions of this dataset")
+@click.option("--tag", "tags", multiple=True, help="Only sessions with this tag, can be repeated")
+@click.option("--batch-size", default=5000, help="Rows fetched per round trip")
+def export(database_url, output, export_format, since, until, dataset, tags, batch_size):
+    """
+    Streams chat messages to JSONL or Parquet.
+    """
+    from dialog_lib.db.export import export_messages
+
+    database_url = shard_database_url(dataset, database_url)
+    written = export_messages(
+        database_url, output, format=export_format, batch_size=batch_size,
+        since=since, until=until, dataset=dataset, tags=tags,
     )
+    if output != "-":
+        click.echo(f"## Exported {written} messages to {output}")
+
+@cli.command()
+@click.option("--database-url", default=os.environ.get("DATABASE_URL"), help="The postgres database URL")
+@click.option("--output", default="loadtest_output.json", help="Where to write the JSON results")
+@click.option("--sessions", default="1,8,32", help="Comma separated concurrent session levels")
+@click.option("--turns", default=5, help="Messages sent by each session")
+@click.option("--think-time", default=1.0, help="Mean pause between a session's messages, in seconds")
+@click.option("--contents", default=200, help="Number of contents loaded before the run")
+@click.option("--pool-size", default=10, help="Database pool size of the simulated worker")
+@click.option("--max-overflow", default=0, help="Database pool overflow of the simulated worker")
+@click.option("--llm-latency", default=0.5, help="Fake LLM latency before the first token, in seconds")
+@click.option("--token-latency", default=0.01, help="Fake LLM latency per streamed token, in seconds")
+@click.option("--error-rate", default=0.0, help="Share of fake LLM requests failing with a 500")
+@click.option("--stream", default=False, is_flag=True, help="Stream the chat completions")
+def loadtest(
+    database_url, output, sessions, turns, think_time, contents, pool_size, max_overflow, llm_latency, token_latency,
+    error_rate, stream
+):
+    """
+    Ramps up concurrent chat sessions against a local fake OpenAI server.
+    """
+    from dialog_lib.benchmarks.fake_openai import FakeOpenAIServer
+    from dialog_lib.benchmarks.load import LoadTest
+    from dialog_lib.benchmarks.pipeline import write_results
+
+    results = LoadTest(
+        database_url,
+        session_levels=[int(level) for level in sessions.split(",")],
+        turns=turns,
+        think_time=think_time,
+        contents=contents,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        server=FakeOpenAIServer(latency=llm_latency, token_latency=token_latency, error_rate=error_rate),
+        streaming=stream,
+    ).run()
+    write_results(results, output)
+    for level in results["levels"]:
+        click.echo(
+            f"## {level['sessions']} sessions: {level['turns_per_second']:.1f} turns/s, "
+            f"p95 {level['latency']['p95_ms']:.1f} ms, pool wait p95 {level['pool_wait']['p95_ms']:.1f} ms, "
+            f"{level['error_rate']:.1%} errors"
+        )
+    click.echo(f"## Results written to {output}")
+
+@cli.group("migrate-embeddings")
+def migrate_embeddings():
+    """
+    Moves the contents to another embedding model through a shadow column.
+    """
+
+@contextlib.contextmanager
+def embedding_migration(database_url, name, llm_api_key=None, rpm=None, concurrency=4, **kwargs):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+    from dialog_lib.embeddings.generate import openai_embeddings
+    from dialog_lib.embeddings.migration import EmbeddingMigration, MigrationError
+    from dialog_lib.loaders.executor import IngestionExecutor
+
+    engine = create_engine(database_url)
+    with Session(engine) as session:
+        migration = EmbeddingMigration(session, name=name, **kwargs)
+        state = migration.state() if llm_api_key else None
+        if state is not None:
+            migration.embedding_llm = openai_embeddings(llm_api_key, dimension=state.dimension)
+            migration.executor = IngestionExecutor(
+                migration.embedding_llm, concurrency=concurrency, requests_per_minute=rpm
+            )
+        try:
+            yield migration
+        except MigrationError as exc:
+            raise click.ClickException(str(exc))
+        click.echo(f"## Migration {name}: {migration.state().status if migration.state() else 'removed'}")
+
+def check_migration_name(ctx, param, value):
+    from dialog_lib.embeddings.migration import migration_name
+
+    try:
+        return migration_name(value)
+    except ValueError as exc:
+        raise click.BadParameter(str(exc))
+
+def migration_options(command):
+    command = click.option(
+        "--name", default="default", callback=check_migration_name, help="The migration name"
+    )(command)
+    command = click.option(
+        "--database-url", default=os.environ.get("DATABASE_URL"), help="The postgres database URL"
+    )(command)
+    return command
+
+@migrate_embeddings.command()
+@migration_options
+@click.option("--dimension", type=int, required=True, help="Dimension of the new embeddings")
+@click.option("--type", "embedding_type", default="vector", type=click.Choice(["vector", "halfvec"]))
+def prepare(database_url, name, dimension, embedding_type):
+    """
+    Adds the shadow column.
+    """
+    with embedding_migration(database_url, name, dimension=dimension, embedding_type=embedding_type) as migration:
+        migration.prepare()
+
+@migrate_embeddings.command()
+@migration_options
+@click.option("--llm-api-key", default=get_llm_key(), help="The OpenAI API key", required=True)
+@click.option("--batch-size", default=256, help="Rows embedded and committed together")
+@click.option("--max-batches", default=None, type=int, help="Stop after this many batches")
+@click.option("--pause", default=0.0, help="Seconds to sleep between batches")
+@click.option("--concurrency", default=4, help="Number of concurrent embedding requests")
+@click.option("--rpm", default=None, type=int, help="Max embedding requests per minute")
+def backfill(database_url, name, llm_api_key, batch_size, max_batches, pause, concurrency, rpm):
+    """
+    Embeds the contents into the shadow column; safe to stop and rerun.
+    """
+    with embedding_migration(
+        database_url, name, llm_api_key, rpm=rpm, concurrency=concurrency, batch_size=batch_size, pause=pause
+    ) as migration:
+        state = migration.backfill(max_batches=max_batches)
+        click.echo(f"## {state.rows_done} rows embedded")
+
+@migrate_embeddings.command()
+@migration_options
+def index(database_url, name):
+    """
+    Builds the shadow column index concurrently.
+    """
+    with embedding_migration(database_url, name) as migration:
+        migration.build_index()
+
+@migrate_embeddings.command()
+@migration_options
+@click.option("--llm-api-key", default=get_llm_key(), help="The OpenAI API key", required=True)
+def swap(database_url, name, llm_api_key):
+    """
+    Catches up and swaps the shadow column in.
+    """
+    with embedding_migration(database_url, name, llm_api_key) as migration:
+        migration.backfill()
+        migration.swap()
+
+@migrate_embeddings.command()
+@migration_options
+def finish(database_url, name):
+    """
+    Drops the previous embedding column.
+    """
+    with embedding_migration(database_url, name) as migration:
+        migration.finish()
+
+@migrate_embeddings.command()
+@migration_options
+def abort(database_url, name):
+    """
+    Drops the shadow column of a migration that wasn't swapped.
+    """
+    with embedding_migration(database_url, name) as migration:
+        migration.abort()
+
+@migrate_embeddings.command()
+@migration_options
+def status(database_url, name):
+    """
+    Shows the progress of a migration.
+    """
+    with embedding_migration(database_url, name) as migration:
+        state = migration.state()
+        if state is None:
+            raise click.ClickException(f"Migration {name} was not prepared")
+        click.echo(
+            f"## {state.embedding_type}({state.dimension}), {state.rows_done} rows embedded, "
+            f"up to id {state.last_id}, updated at {state.updated_at}"
+        )
+
+@cli.group()
+def shards():
+    """
+    Places datasets on the DATABASE_SHARDS databases.
+    """
+
+def shard_router():
+    from dialog_lib.db.session import get_shard_router
+
+    router = get_shard_router()
+    if router is None:
+        raise click.ClickException("Set DATABASE_SHARDS (name=url pairs) to use shards")
+    return router
+
+@shards.command("list")
+def list_shards():
+    """
+    Shows the shards and the datasets assigned to them.
+    """
+    router = shard_router()
+    assignments = router.assignments(refresh=True)
+    for shard in router.shards:
+        datasets = sorted(dataset for dataset, assigned in assignments.items() if assigned == shard)
+        click.echo(f"## {shard}: {', '.join(datasets) or '-'}")
+
+@shards.command()
+@click.option("--dataset", required=True, help="The dataset")
+@click.option("--shard", required=True, help="The shard to serve it from")
+def assign(dataset, shard):
+    """
+    Points a (new or empty) dataset to a shard without copying anything.
+    """
+    router = shard_router()
+    if shard not in router.shards:
+        raise click.ClickException(f"Unknown shard {shard}")
+    router.assign(dataset, shard)
+    click.echo(f"## {dataset} assigned to {shard}")
+
+@shards.command()
+@click.option("--dataset", required=True, help="The dataset to move")
+@click.option("--to", "target", required=True, help="The shard to move it to")
+@click.option("--batch-size", default=1000, help="Rows copied per statement")
+@click.option(
+    "--wait", default=None, type=float,
+    help="Seconds for the other processes to see the new shard (DATABASE_SHARD_REFRESH_INTERVAL by default)",
+)
+def move(dataset, target, batch_size, wait):
+    """
+    Copies a dataset to another shard while it keeps serving, then switches it.
+    """
+    from dialog_lib.db.shards import DatasetMove
+
+    try:
+        dataset_move = DatasetMove(shard_router(), dataset, target, batch_size=batch_size)
+        dataset_move.run(wait=wait)
+    except (KeyError, ValueError) as exc:
+        raise click.ClickException(str(exc))
+    state = dataset_move.state()
+    click.echo(f"## {dataset} moved from {state.source} to {target}, {state.messages_copied} messages copied")
+    click.echo(f"## Run `dialog shards cleanup --dataset {dataset}` to delete it from {state.source}")
+
+@shards.command()
+@click.option("--dataset", required=True, help="The moved dataset")
+@click.option(
+    "--wait", default=None, type=float,
+    help="Seconds without new messages on the former shard before deleting (DATABASE_SHARD_REFRESH_INTERVAL by default)",
+)
+def cleanup(dataset, wait):
+    """
+    Deletes a moved dataset from its former shard, once no more messages are written there.
+    """
+    from dialog_lib.db.shards import DatasetMove
+
+    router = shard_router()
+    try:
+        deleted = DatasetMove(router, dataset, router.shard(dataset, refresh=True)).cleanup(wait=wait)
+    except ValueError as exc:
+        raise click.ClickException(str(exc))
+    click.echo(f"## Deleted {deleted['contents']} contents, {deleted['messages']} messages, {deleted['chats']} chats")
 
 def main():
     cli()
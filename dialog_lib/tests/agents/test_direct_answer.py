@@ -0,0 +1,48 @@
+import pytest
+from langchain_core.chat_history import InMemoryChatMessageHistory
+from langchain_core.documents import Document
+from langchain_core.language_models import FakeListChatModel
+from langchain_core.runnables import RunnableLambda
+
+from dialog_lib.agents.abstract import AbstractLCEL
+
+
+class FAQAgent(AbstractLCEL):
+    def __init__(self, score, **kwargs):
+        self.score = score
+        self.history = InMemoryChatMessageHistory()
+        super().__init__(
+            model_class=FakeListChatModel(responses=["from the model"]),
+            embedding_llm=None,
+            config={"prompt": {"fallback_not_found_relevant_contents": "Not found"}},
+            **kwargs,
+        )
+
+    @property
+    def retriever(self):
+        doc = Document(
+            page_content="How do I reset my password?\n\nUse the reset link on the login page.",
+            metadata={"title": "How do I reset my password?", "id": 7, "score": self.score, "link": None},
+        )
+        return RunnableLambda(lambda query: [doc])
+
+    def get_session_history(self, something):
+        return self.history
+
+
+def test_near_exact_match_skips_the_model():
+    agent = FAQAgent(score=0.99, direct_answer_distance=0.02)
+    assert agent.process("how do I reset my password") == "Use the reset link on the login page."
+    assert [message.type for message in agent.history.messages] == ["human", "ai"]
+    assert agent.history.messages[1].response_metadata["content_id"] == 7
+
+
+def test_template():
+    agent = FAQAgent(score=0.99, direct_answer_distance=0.02, direct_answer_template="{question}: {content}")
+    assert agent.process("reset password").startswith("How do I reset my password?: Use")
+
+
+@pytest.mark.parametrize("kwargs", [{"direct_answer_distance": 0.02}, {}])
+def test_other_matches_use_the_model(kwargs):
+    agent = FAQAgent(score=0.9, **kwargs)
+    assert agent.process("password") == "from the model"
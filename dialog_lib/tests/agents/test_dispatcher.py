@@ -0,0 +1,108 @@
+import asyncio
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from dialog_lib.agents.dispatcher import DispatcherTimeout, LLMDispatcher, TokenBucket
+from dialog_lib.instrumentation import PrometheusExporter
+
+
+def test_token_bucket_waits_for_refill():
+    bucket = TokenBucket(rate_per_minute=60, capacity=2)
+    assert bucket.wait_time(2) == 0
+    bucket.take(2)
+    assert bucket.wait_time(1) == pytest.approx(1, abs=0.05)
+    # larger than the capacity: only waits for a full bucket
+    assert bucket.wait_time(10) == pytest.approx(2, abs=0.05)
+
+
+def test_max_in_flight_blocks_until_release():
+    dispatcher = LLMDispatcher(max_in_flight=1)
+    dispatcher.acquire()
+    admitted = threading.Event()
+
+    def second():
+        dispatcher.acquire()
+        admitted.set()
+
+    thread = threading.Thread(target=second)
+    thread.start()
+    assert not admitted.wait(0.1)
+    assert dispatcher.metrics()["queue_depth"] == 1
+
+    dispatcher.release()
+    assert admitted.wait(1)
+    thread.join()
+    assert dispatcher.metrics()["in_flight"] == 1
+    assert dispatcher.metrics()["queue_depth"] == 0
+
+
+def test_round_robin_across_datasets():
+    dispatcher = LLMDispatcher(max_in_flight=1)
+    dispatcher.acquire(tenant=("busy", "s0"))
+    order = []
+
+    def call(tenant):
+        dispatcher.acquire(tenant=tenant)
+        order.append(tenant[0])
+        dispatcher.release()
+
+    threads = []
+    for tenant in [("busy", "s1"), ("busy", "s2"), ("busy", "s3"), ("quiet", "s1")]:
+        threads.append(threading.Thread(target=call, args=(tenant,)))
+        threads[-1].start()
+        time.sleep(0.02)
+    dispatcher.release()
+    for thread in threads:
+        thread.join(2)
+
+    assert order.index("quiet") <= 1
+
+
+def test_acquire_times_out():
+    dispatcher = LLMDispatcher(max_in_flight=1, max_wait=0.05)
+    dispatcher.acquire()
+    with pytest.raises(DispatcherTimeout):
+        dispatcher.acquire()
+    assert dispatcher.metrics()["queue_depth"] == 0
+
+
+def test_callback_gates_model_calls():
+    dispatcher = LLMDispatcher(max_in_flight=2, tokens_per_minute=100_000)
+    model = FakeListChatModel(responses=["answer"]).with_config(callbacks=[dispatcher.callback("ds", "s1")])
+
+    assert model.invoke("hello").content == "answer"
+    assert asyncio.run(model.ainvoke("hello")).content == "answer"
+    metrics = dispatcher.metrics()
+    assert metrics["admitted"] == 2
+    assert metrics["in_flight"] == 0
+
+
+def test_prometheus_gauges():
+    dispatcher = LLMDispatcher(max_in_flight=4, name="openai_llm")
+    exporter = PrometheusExporter()
+    dispatcher.register_gauges(exporter)
+    dispatcher.acquire()
+
+    assert "dialog_openai_llm_in_flight 1" in exporter.render()
+
+
+def test_async_calls_dont_hold_executor_threads():
+    # sync handlers of async calls run in the default executor; more waiters
+    # than executor threads used to starve the releases
+    dispatcher = LLMDispatcher(max_in_flight=1, max_wait=5)
+    model = FakeListChatModel(responses=["answer"], sleep=0.02).with_config(
+        callbacks=[dispatcher.callback("ds", "s1")]
+    )
+
+    async def main():
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=2))
+        return await asyncio.gather(*(model.ainvoke("hello") for _ in range(6)))
+
+    assert [message.content for message in asyncio.run(main())] == ["answer"] * 6
+    assert dispatcher.metrics()["admitted"] == 6
+    assert dispatcher.metrics()["in_flight"] == 0
@@ -0,0 +1,175 @@
+import asyncio
+import time
+
+import pytest
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from dialog_lib.agents import hedging
+from dialog_lib.agents.abstract import AbstractLCEL
+from dialog_lib.agents.hedging import CircuitBreaker, CircuitOpenError, HedgedModel, LatencyTracker
+
+
+class PrimaryModel(FakeListChatModel):
+    @property
+    def _llm_type(self):
+        return "primary"
+
+
+class BackupModel(FakeListChatModel):
+    @property
+    def _llm_type(self):
+        return "backup"
+
+
+@pytest.fixture(autouse=True)
+def reset_registries():
+    hedging._trackers.clear()
+    hedging._breakers.clear()
+    yield
+    hedging._trackers.clear()
+    hedging._breakers.clear()
+
+
+def test_latency_percentile():
+    tracker = LatencyTracker()
+    assert tracker.percentile(95) is None
+    for latency in range(1, 101):
+        tracker.record(latency / 100)
+    assert tracker.percentile(50) == pytest.approx(0.51)
+    assert tracker.percentile(99) == pytest.approx(1.0)
+
+
+def test_fast_primary_is_not_hedged():
+    model = HedgedModel(PrimaryModel(responses=["primary"]), BackupModel(responses=["backup"]), initial_delay=0.5)
+    assert model.invoke("hi").content == "primary"
+    assert model.latencies.percentile(50) is not None
+
+
+def test_slow_primary_is_hedged():
+    model = HedgedModel(
+        PrimaryModel(responses=["primary"], sleep=0.3), BackupModel(responses=["backup"]), initial_delay=0.05
+    )
+    started_at = time.monotonic()
+    assert model.invoke("hi").content == "backup"
+    assert time.monotonic() - started_at < 0.3
+
+
+def test_slow_primary_is_hedged_async():
+    model = HedgedModel(
+        PrimaryModel(responses=["primary"], sleep=0.3), BackupModel(responses=["backup"]), initial_delay=0.05
+    )
+    assert asyncio.run(model.ainvoke("hi")).content == "backup"
+
+
+def test_failed_primary_falls_back_to_hedge():
+    model = HedgedModel(
+        PrimaryModel(responses=["primary"], sleep=0.1, error_on_chunk_number=0),
+        BackupModel(responses=["backup"]),
+        initial_delay=0.01,
+    )
+    assert model.invoke("hi").content == "backup"
+
+
+def test_primary_error_fails_over_without_waiting_for_the_delay():
+    model = HedgedModel(
+        PrimaryModel(responses=["primary"], error_on_chunk_number=0),
+        BackupModel(responses=["backup"]),
+        initial_delay=2.0,
+    )
+    started_at = time.monotonic()
+    assert model.invoke("hi").content == "backup"
+    assert time.monotonic() - started_at < 1.0
+
+
+def test_primary_error_fails_over_async():
+    model = HedgedModel(
+        PrimaryModel(responses=["primary"], error_on_chunk_number=0),
+        BackupModel(responses=["backup"]),
+        initial_delay=2.0,
+    )
+    started_at = time.monotonic()
+    assert asyncio.run(model.ainvoke("hi")).content == "backup"
+    assert time.monotonic() - started_at < 1.0
+
+
+def test_primary_error_is_raised_when_the_backup_fails_too():
+    model = HedgedModel(
+        PrimaryModel(responses=["primary"], error_on_chunk_number=0),
+        BackupModel(responses=["backup"], error_on_chunk_number=0),
+        initial_delay=2.0,
+    )
+    with pytest.raises(Exception):
+        model.invoke("hi")
+    breaker = hedging.get_circuit_breaker(hedging.provider_key(model.primary))
+    assert [success for success, _ in breaker._calls] == [False]
+
+
+def test_lost_call_is_recorded_once():
+    attempt = hedging._Attempt("primary", PrimaryModel(responses=["primary"]))
+    attempt.started_at = time.monotonic()
+    attempt.lost()
+    attempt._finish(None)
+    attempt._fail()
+    assert len(attempt.breaker._calls) == 1
+
+
+def test_circuit_breaker_opens_and_recovers():
+    breaker = CircuitBreaker(window=4, min_calls=4, error_rate=0.5, reset_timeout=0.05)
+    for success in (True, False, True, False):
+        assert breaker.allow()
+        breaker.record(success)
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record(True, 0.01)
+    assert breaker.state == "closed"
+
+
+def test_circuit_breaker_opens_on_slow_calls():
+    breaker = CircuitBreaker(min_calls=2, slow_call_rate=1.0, slow_call_seconds=1.0)
+    breaker.record(True, 2.0)
+    breaker.record(True, 3.0)
+    assert breaker.state == "open"
+
+
+def test_open_primary_fails_over():
+    primary, backup = PrimaryModel(responses=["primary"]), BackupModel(responses=["backup"])
+    breaker = CircuitBreaker(min_calls=1, reset_timeout=60)
+    breaker.record(False)
+    hedging.set_circuit_breaker(hedging.provider_key(primary), breaker)
+
+    assert HedgedModel(primary, backup).invoke("hi").content == "backup"
+
+    backup_breaker = CircuitBreaker(min_calls=1, reset_timeout=60)
+    backup_breaker.record(False)
+    hedging.set_circuit_breaker(hedging.provider_key(backup), backup_breaker)
+    with pytest.raises(CircuitOpenError):
+        HedgedModel(primary, backup).invoke("hi")
+
+
+def test_unsent_hedge_keeps_the_backup_trial_slot():
+    primary, backup = PrimaryModel(responses=["primary"]), BackupModel(responses=["backup"])
+    backup_breaker = CircuitBreaker(min_calls=1, reset_timeout=0.01)
+    backup_breaker.record(False)
+    hedging.set_circuit_breaker(hedging.provider_key(backup), backup_breaker)
+    time.sleep(0.02)
+    assert backup_breaker.state == "half_open"
+
+    assert HedgedModel(primary, backup, initial_delay=0.5).invoke("hi").content == "primary"
+    assert asyncio.run(HedgedModel(primary, backup, initial_delay=0.5).ainvoke("hi")).content == "primary"
+
+    assert backup_breaker.allow()
+
+
+def test_agent_hedges_generation():
+    agent = AbstractLCEL(
+        model_class=PrimaryModel(responses=["primary"], sleep=0.3),
+        backup_model=BackupModel(responses=["backup"]),
+        hedging={"initial_delay": 0.05},
+        embedding_llm=None,
+        config={},
+    )
+    assert agent.generation_model.invoke("hi").content == "backup"
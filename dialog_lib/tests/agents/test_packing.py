@@ -0,0 +1,103 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.documents import Document
+from langchain_core.runnables import RunnableLambda
+
+from dialog_lib.agents.abstract import AbstractLCEL
+from dialog_lib.agents.packing import count_tokens, pack_documents, truncate_sentences
+
+
+def words(text):
+    return len(text.split())
+
+
+def doc(text, score):
+    return Document(page_content=text, metadata={"title": text.split()[0], "score": score})
+
+
+LONG = "Refunds take five days. They go to the original card. Contact support otherwise."
+
+
+def test_truncate_sentences_keeps_whole_sentences():
+    assert truncate_sentences(LONG, 10, words) == ("Refunds take five days. They go to the original card.", 10)
+    assert truncate_sentences(LONG, 3, words) == ("", 0)
+
+
+def test_pack_documents_truncates_and_drops_over_budget():
+    docs = [doc("Shipping is free.", 0.9), doc(LONG, 0.8), doc("Returns are free too.", 0.7)]
+    packed, decisions = pack_documents(
+        docs, 16, lambda d: d.page_content, counter=words, separator_tokens=1, min_truncated_tokens=4
+    )
+
+    assert packed == ["Shipping is free.", "Refunds take five days. They go to the original card."]
+    assert [decision.action for decision in decisions] == ["full", "truncated", "dropped"]
+    assert [decision.packed_tokens for decision in decisions] == [3, 10, 0]
+    assert decisions[1].score == 0.8
+
+
+def test_pack_documents_ranks_by_score_and_stops_at_the_first_misfit():
+    docs = [doc("Returns are free too.", 0.7), doc(LONG, 0.9), doc("Shipping", 0.5), doc("Unscored doc", None)]
+    packed, decisions = pack_documents(
+        docs, 16, lambda d: d.page_content, counter=words, separator_tokens=1, min_truncated_tokens=20
+    )
+
+    # "Shipping" would still fit, but comes after a document that did not
+    assert packed == [LONG]
+    assert [decision.title for decision in decisions] == ["Refunds", "Returns", "Shipping", "Unscored"]
+    assert [decision.action for decision in decisions] == ["full", "dropped", "dropped", "dropped"]
+
+
+def test_count_tokens_is_cached():
+    count_tokens.cache_clear()
+    count_tokens("How long do refunds take?")
+    count_tokens("How long do refunds take?")
+    assert count_tokens.cache_info().hits == 1
+
+
+def make_agent(**kwargs):
+    return AbstractLCEL(model_class=None, embedding_llm=None, config={}, token_counter=words, **kwargs)
+
+
+class Collector(BaseCallbackHandler):
+    def __init__(self):
+        self.events = []
+
+    def on_custom_event(self, name, data, **kwargs):
+        self.events.append((name, data))
+
+
+def test_combine_docs_without_budget_joins_everything():
+    agent, collector = make_agent(), Collector()
+    context = RunnableLambda(agent.combine_docs).invoke([doc("a b", 1.0), doc("c d", 0.5)], {"callbacks": [collector]})
+    assert context == "a b\n\nc d"
+    assert collector.events == []
+
+
+def test_combine_docs_reports_packing_decisions():
+    agent, collector = make_agent(context_token_budget=4), Collector()
+    context = RunnableLambda(agent.combine_docs).invoke(
+        [doc("a b c", 1.0), doc("d e f", 0.5)], {"callbacks": [collector]}
+    )
+
+    assert context == "a b c"
+    [(name, report)] = collector.events
+    assert name == "context_packing"
+    assert report["packed_tokens"] == 3
+    assert [item["action"] for item in report["documents"]] == ["full", "dropped"]
+
+
+def test_concurrent_turns_get_their_own_packing_report():
+    agent = make_agent(context_token_budget=4)
+    turns = [([doc("a b c", 1.0)], Collector()), ([doc("d e", 1.0), doc("f g", 0.5)], Collector())]
+
+    def run(turn):
+        docs, collector = turn
+        return RunnableLambda(agent.combine_docs).invoke(docs, {"callbacks": [collector]})
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        list(pool.map(run, turns))
+
+    assert [[item["title"] for item in collector.events[0][1]["documents"]] for _, collector in turns] == [
+        ["a"], ["d", "f"],
+    ]
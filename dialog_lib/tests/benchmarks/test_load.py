@@ -0,0 +1,47 @@
+import sqlalchemy
+from langchain_openai import ChatOpenAI
+
+from dialog_lib.benchmarks.fake_openai import FakeOpenAIServer
+from dialog_lib.benchmarks.stats import PoolWaitTimer
+from dialog_lib.embeddings.generate import openai_embeddings
+
+
+def test_fake_server_answers_chat_completions():
+    with FakeOpenAIServer(response="Hello there friend") as server:
+        model = ChatOpenAI(model="gpt-3.5-turbo", openai_api_key="fake", base_url=server.base_url)
+        assert model.invoke("hi").content == "Hello there friend"
+
+        chunks = [chunk.content for chunk in model.stream("hi")]
+        assert "".join(chunks) == "Hello there friend"
+        assert len(chunks) > 1
+
+
+def test_fake_server_embeddings_are_deterministic():
+    with FakeOpenAIServer() as server:
+        embeddings = openai_embeddings(
+            "fake", dimension=1536, base_url=server.base_url, check_embedding_ctx_length=False
+        )
+        first, second, other = embeddings.embed_documents(["refunds", "refunds", "shipping"])
+        assert first == second != other
+        assert len(first) == 1536
+
+
+def test_fake_server_injects_errors():
+    with FakeOpenAIServer(error_rate=1.0) as server:
+        model = ChatOpenAI(model="gpt-3.5-turbo", openai_api_key="fake", base_url=server.base_url, max_retries=0)
+        try:
+            model.invoke("hi")
+        except Exception as exc:
+            assert "Injected failure" in str(exc)
+        else:
+            raise AssertionError("expected a server error")
+
+
+def test_pool_wait_timer_records_checkouts():
+    engine = sqlalchemy.create_engine("sqlite://")
+    with PoolWaitTimer(engine) as timer:
+        with engine.connect() as connection:
+            connection.execute(sqlalchemy.text("SELECT 1"))
+    assert len(timer.waits) == 1
+    # the pool is restored
+    assert "connect" not in vars(engine.pool)
@@ -0,0 +1,48 @@
+import sqlalchemy
+
+from dialog_lib.benchmarks.fakes import FakeChatModel, FakeEmbeddingModel
+from dialog_lib.benchmarks.stats import RoundTripCounter, StageTimer, percentile, summarize
+
+
+def test_percentile_uses_nearest_rank():
+    values = [float(value) for value in range(1, 101)]
+    assert percentile(values, 50) == 50.0
+    assert percentile(values, 95) == 95.0
+    assert percentile(values, 99) == 99.0
+    assert percentile([], 50) == 0.0
+
+
+def test_summarize_reports_milliseconds():
+    summary = summarize([0.001, 0.002, 0.003])
+    assert summary["count"] == 3
+    assert summary["p50_ms"] == 2.0
+    assert summary["p99_ms"] == 3.0
+
+
+def test_stage_timer_collects_durations():
+    timer = StageTimer()
+    for _ in range(3):
+        with timer.time("retrieval"):
+            pass
+    assert timer.summary()["retrieval"]["count"] == 3
+
+
+def test_round_trip_counter_counts_statements_of_its_engines_only():
+    engine = sqlalchemy.create_engine("sqlite://")
+    other = sqlalchemy.create_engine("sqlite://")
+    with RoundTripCounter(engine) as counter, engine.connect() as connection, other.connect() as unrelated:
+        connection.execute(sqlalchemy.text("SELECT 1"))
+        connection.execute(sqlalchemy.text("SELECT 2"))
+        unrelated.execute(sqlalchemy.text("SELECT 3"))
+    assert counter.count == 2
+
+    with engine.connect() as connection:
+        connection.execute(sqlalchemy.text("SELECT 3"))
+    assert counter.count == 2
+
+
+def test_fake_models_are_deterministic():
+    embeddings = FakeEmbeddingModel()
+    assert embeddings.embed_query("hello") == embeddings.embed_documents(["hello"])[0]
+    assert embeddings.embed_query("hello") != embeddings.embed_query("bye")
+    assert FakeChatModel(response="hi").invoke("anything").content == "hi"
@@ -3,9 +3,23 @@ import pytest
 import sqlalchemy
 
 from aioresponses import aioresponses
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm import Session
-from dialog_lib.db.models import Base
+from dialog_lib.db.models import Base, CompanyContent, DatasetVersion
 from dialog_lib.db import get_session
+from dialog_lib.db.types import tsvector_document
+
+
+# lets the contents table be created on SQLite, without full-text search
+@compiles(tsvector_document, "sqlite")
+def _compile_tsvector_document_sqlite(element, compiler, **kw):
+    return "NULL"
+
+
+@compiles(TSVECTOR, "sqlite")
+def _compile_tsvector_sqlite(element, compiler, **kw):
+    return "TEXT"
 
 
 @pytest.fixture
@@ -18,6 +32,15 @@ def db_session():
     return get_session()
 
 
+@pytest.fixture
+def sqlite_session():
+    engine = sqlalchemy.create_engine("sqlite://")
+    CompanyContent.__table__.create(engine)
+    DatasetVersion.__table__.create(engine)
+    with Session(engine) as session:
+        yield session
+
+
 @pytest.fixture
 def mock_aioresponse():
     with aioresponses() as m:
@@ -0,0 +1,43 @@
+import sqlalchemy
+
+from sqlalchemy.orm import Session
+
+from dialog_lib.db.bulk import COPY_COLUMNS, psycopg_url
+from dialog_lib.db.models import CompanyContent, DatasetVersion
+from dialog_lib.loaders.executor import IngestionExecutor, store_contents
+from dialog_lib.tests.fixtures.embedding_model import FakeEmbeddingModel
+
+
+class RecordingWriter:
+    def __init__(self):
+        self.rows = []
+
+    def write(self, rows):
+        self.rows.extend(rows)
+        return len(rows)
+
+
+def test_psycopg_url_drops_sqlalchemy_driver():
+    assert psycopg_url("postgresql+psycopg2://talkdai:secret@db:5432/talkdai") == (
+        "postgresql://talkdai:secret@db:5432/talkdai"
+    )
+
+
+def test_copy_columns_match_the_contents_table():
+    assert set(COPY_COLUMNS) <= set(CompanyContent.__table__.columns.keys())
+
+
+def test_store_contents_streams_inserts_through_writer():
+    engine = sqlalchemy.create_engine("sqlite://")
+    CompanyContent.__table__.create(engine)
+    DatasetVersion.__table__.create(engine)
+    writer = RecordingWriter()
+    rows = [dict(category="csv", subcategory="csv-content", question="q", content="c")]
+
+    with Session(engine) as session:
+        store_contents(session, CompanyContent, rows, ["q"], IngestionExecutor(FakeEmbeddingModel()), writer=writer)
+        assert session.query(CompanyContent).count() == 0
+
+    assert len(writer.rows) == 1
+    assert writer.rows[0]["question"] == "q"
+    assert len(writer.rows[0]["embedding"]) == 1536
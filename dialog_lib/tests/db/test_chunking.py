@@ -0,0 +1,92 @@
+import pytest
+
+from dialog_lib.db.models import CompanyContent
+from dialog_lib.embeddings.chunking import split_content
+from dialog_lib.embeddings.generate import resolve_parents
+from dialog_lib.loaders.executor import IngestionExecutor, store_contents
+from dialog_lib.loaders.sync import sync_contents
+from dialog_lib.tests.fixtures.embedding_model import FakeEmbeddingModel
+
+
+def make_row(question, content):
+    return dict(category="web", subcategory="website-content", question=question, content=content)
+
+
+def test_split_content_keeps_short_contents_whole():
+    assert split_content("short", chunk_size=100) == ["short"]
+    chunks = split_content("word " * 100, chunk_size=100, chunk_overlap=0)
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 100 for chunk in chunks)
+
+
+def test_small_chunk_sizes_get_a_smaller_default_overlap():
+    chunks = split_content("word " * 40, chunk_size=50)
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 50 for chunk in chunks)
+    with pytest.raises(ValueError):
+        split_content("word " * 40, chunk_size=50, chunk_overlap=50)
+
+
+def test_store_contents_links_chunks_to_parent(sqlite_session):
+    rows = [make_row("long", "word " * 100), make_row("short", "tiny")]
+    store_contents(
+        sqlite_session, CompanyContent, rows, ["long", "short"],
+        IngestionExecutor(FakeEmbeddingModel()), chunk_size=100, chunk_overlap=0,
+    )
+
+    parent = sqlite_session.query(CompanyContent).filter_by(question="long", parent_id=None).one()
+    chunks = sqlite_session.query(CompanyContent).filter_by(parent_id=parent.id).order_by(
+        CompanyContent.chunk_index
+    ).all()
+    short = sqlite_session.query(CompanyContent).filter_by(question="short").one()
+
+    assert parent.embedding is None
+    assert len(chunks) > 1
+    assert [chunk.chunk_index for chunk in chunks] == list(range(len(chunks)))
+    assert all(chunk.embedding is not None for chunk in chunks)
+    assert short.parent_id is None and short.embedding is not None
+
+    ranked = [chunks[1], short, chunks[0]]
+    assert [content.id for content in resolve_parents(sqlite_session, ranked, top=5)] == [parent.id, short.id]
+    assert [content.id for content in resolve_parents(sqlite_session, ranked, top=1)] == [parent.id]
+
+
+def test_sync_rechunks_changed_parents(sqlite_session):
+    executor = IngestionExecutor(FakeEmbeddingModel())
+    record = dict(make_row("long", "word " * 100), source_key="long", text="v1")
+    sync_contents(sqlite_session, CompanyContent, [record], source="s", executor=executor, chunk_size=100)
+    first_chunks = sqlite_session.query(CompanyContent).filter(CompanyContent.parent_id.isnot(None)).count()
+
+    record = dict(make_row("long", "other " * 40), source_key="long", text="v2")
+    summary = sync_contents(sqlite_session, CompanyContent, [record], source="s", executor=executor, chunk_size=100)
+
+    assert summary.updated == 1
+    chunks = sqlite_session.query(CompanyContent).filter(CompanyContent.parent_id.isnot(None)).all()
+    assert 0 < len(chunks) < first_chunks
+    assert all(chunk.content.startswith("other") for chunk in chunks)
+
+
+class FailingEmbeddingModel(FakeEmbeddingModel):
+    def embed_documents(self, contents, token_length=1536):
+        raise RuntimeError("provider down")
+
+
+def test_parent_hash_is_only_stored_with_its_chunks(sqlite_session):
+    record = dict(make_row("long", "word " * 100), source_key="long", text="v1")
+    with pytest.raises(RuntimeError):
+        sync_contents(
+            sqlite_session, CompanyContent, [record], source="s",
+            executor=IngestionExecutor(FailingEmbeddingModel(), max_retries=0), chunk_size=100,
+        )
+    sqlite_session.rollback()
+    parent = sqlite_session.query(CompanyContent).filter_by(parent_id=None).one()
+    assert parent.content_hash is None
+
+    summary = sync_contents(
+        sqlite_session, CompanyContent, [record], source="s",
+        executor=IngestionExecutor(FakeEmbeddingModel()), chunk_size=100,
+    )
+    sqlite_session.refresh(parent)
+    assert summary.updated == 1
+    assert parent.content_hash is not None
+    assert sqlite_session.query(CompanyContent).filter_by(parent_id=parent.id).count() > 1
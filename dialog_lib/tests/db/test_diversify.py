@@ -0,0 +1,76 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from dialog_lib.embeddings.diversify import (
+    collapse_near_duplicates,
+    diversify_contents,
+    maximal_marginal_relevance,
+)
+from dialog_lib.embeddings.generate import get_most_relevant_contents_from_message
+
+
+def content(name, embedding, parent_id=None):
+    return SimpleNamespace(
+        id=name, question=name, embedding=np.asarray(embedding, dtype=np.float32), parent_id=parent_id
+    )
+
+
+FAQ = [
+    content("refund", [1.0, 0.0, 0.0]),
+    content("refund copy", [0.999, 0.01, 0.0]),
+    content("refund policy", [0.9, 0.3, 0.0]),
+    content("shipping", [0.6, 0.0, 0.8]),
+]
+
+
+def test_collapse_near_duplicates_keeps_the_first_of_each_group():
+    embeddings = [item.embedding for item in FAQ]
+    assert collapse_near_duplicates(embeddings, threshold=0.99) == [0, 2, 3]
+    assert collapse_near_duplicates([], threshold=0.99) == []
+
+
+def test_mmr_prefers_diverse_contents():
+    embeddings = [item.embedding for item in FAQ]
+    assert maximal_marginal_relevance([1.0, 0.0, 0.3], embeddings, k=2, lambda_mult=1.0) == [0, 1]
+    assert maximal_marginal_relevance([1.0, 0.0, 0.3], embeddings, k=2, lambda_mult=0.5) == [0, 3]
+
+
+def test_diversify_contents_returns_top_distinct_contents():
+    picked = diversify_contents([1.0, 0.0, 0.3], FAQ, top=3, duplicate_threshold=0.99)
+    assert [item.question for item in picked] == ["refund", "shipping", "refund policy"]
+
+
+class FakeSession:
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    def scalars(self, query):
+        self.queries.append(query)
+        return SimpleNamespace(all=lambda: self.rows)
+
+
+class CountingEmbeddings:
+    calls = 0
+
+    def embed_query(self, text):
+        self.calls += 1
+        return [1.0, 0.0, 0.3]
+
+
+def test_retrieval_diversifies_overfetched_candidates_with_one_embedding_call(monkeypatch):
+    from dialog_lib.db.models import CompanyContent
+
+    monkeypatch.setattr(CompanyContent.embedding.type, "dim", 3)
+    embeddings = CountingEmbeddings()
+    session = FakeSession(FAQ)
+
+    contents = get_most_relevant_contents_from_message(
+        "refund?", top=2, session=session, embeddings_llm=embeddings,
+        diversify=True, diversify_fetch_factor=5, duplicate_threshold=0.99,
+    )
+
+    assert [item.question for item in contents] == ["refund", "shipping"]
+    assert embeddings.calls == 1
+    assert session.queries[0]._limit == 10
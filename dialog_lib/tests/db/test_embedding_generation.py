@@ -1,5 +1,10 @@
+import pytest
+
 from dialog_lib.tests.fixtures.embedding_model import FakeEmbeddingModel
-from dialog_lib.embeddings.generate import generate_embedding, generate_embeddings
+from dialog_lib.db.types import HalfVector, embedding_type
+from dialog_lib.embeddings.generate import (
+    generate_embedding, generate_embeddings, fit_embedding, openai_embeddings, supports_shortening
+)
 
 def test_generate_embedding_for_single_document():
     embedding_model = FakeEmbeddingModel()
@@ -10,4 +15,45 @@ def test_generate_embedding_for_multiple_documents():
     embedding_model = FakeEmbeddingModel()
     embeddings = generate_embeddings(["Hello, world!", "Hello, world 2!"], embedding_model)
     assert len(embeddings) == 2
-    assert len(embeddings[0]) == 1536
\ No newline at end of file
+    assert len(embeddings[0]) == 1536
+
+def test_fit_embedding_truncates_and_normalizes():
+    embedding = fit_embedding([3.0, 4.0, 12.0], 2, shorten=True)
+    assert embedding == pytest.approx([0.6, 0.8])
+    assert fit_embedding([1.0, 2.0], 2) == [1.0, 2.0]
+    with pytest.raises(ValueError):
+        fit_embedding([1.0], 2, shorten=True)
+
+
+def test_fit_embedding_refuses_models_that_cant_be_shortened():
+    with pytest.raises(ValueError):
+        fit_embedding([3.0, 4.0, 12.0], 2)
+    assert supports_shortening(openai_embeddings("sk_test_1234567890", dimension=512))
+    assert not supports_shortening(openai_embeddings("sk_test_1234567890"))
+    assert not supports_shortening(FakeEmbeddingModel())
+
+
+def test_embedding_type_supports_halfvec():
+    column_type = embedding_type("halfvec", 512)
+    assert isinstance(column_type, HalfVector)
+    assert column_type.get_col_spec() == "HALFVEC(512)"
+    assert embedding_type("vector", 1536).get_col_spec() == "VECTOR(1536)"
+    with pytest.raises(ValueError):
+        embedding_type("bit", 1536)
+
+
+def test_openai_embeddings_requests_shortened_embeddings():
+    embeddings = openai_embeddings("sk_test_1234567890", dimension=512)
+    assert embeddings.dimensions == 512
+    assert embeddings.model == "text-embedding-3-small"
+    assert openai_embeddings("sk_test_1234567890").dimensions is None
+
+
+def test_openai_embeddings_only_shortens_text_embedding_3(monkeypatch):
+    monkeypatch.setenv("DIALOG_EMBEDDING_MODEL", "text-embedding-ada-002")
+    assert openai_embeddings("sk_test_1234567890", dimension=1536).dimensions is None
+    with pytest.raises(ValueError):
+        openai_embeddings("sk_test_1234567890", dimension=512)
+
+    monkeypatch.setenv("DIALOG_EMBEDDING_MODEL", "text-embedding-3-large")
+    assert openai_embeddings("sk_test_1234567890", dimension=1536).dimensions == 1536
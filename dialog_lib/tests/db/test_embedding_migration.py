@@ -0,0 +1,112 @@
+import pytest
+import sqlalchemy
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from dialog_lib.db.models import CompanyContent, DatasetVersion, EmbeddingMigrationState
+from dialog_lib.embeddings.migration import (
+    EmbeddingMigration,
+    EmbeddingSwitch,
+    MigrationError,
+    content_model_for,
+    drop_trigger_ddl,
+    shadow_column_ddl,
+    shadow_index_ddl,
+    swap_ddl,
+)
+from dialog_lib.loaders.executor import IngestionExecutor
+
+
+@pytest.fixture
+def session():
+    engine = sqlalchemy.create_engine("sqlite://")
+    CompanyContent.__table__.create(engine)
+    DatasetVersion.__table__.create(engine)
+    EmbeddingMigrationState.__table__.create(engine)
+    with engine.begin() as connection:
+        # what `prepare` does on Postgres
+        connection.execute(text("ALTER TABLE contents ADD COLUMN embedding_next TEXT"))
+    with Session(engine) as session:
+        session.add_all([
+            CompanyContent(
+                category="faq", subcategory="faq", question=f"question {index}", content=f"answer {index}",
+                embedding=[0.0] * CompanyContent.embedding.type.dim if index != 3 else None,
+            )
+            for index in range(5)
+        ])
+        session.add(EmbeddingMigrationState(name="small", embedding_type="vector", dimension=8, status="prepared"))
+        session.commit()
+        yield session
+
+
+def migration(session, **kwargs):
+    embeddings = DeterministicFakeEmbedding(size=8)
+    return EmbeddingMigration(session, embeddings, name="small", executor=IngestionExecutor(embeddings), **kwargs)
+
+
+def pending(session):
+    return session.scalar(text("SELECT count(*) FROM contents WHERE embedding IS NOT NULL AND embedding_next IS NULL"))
+
+
+def test_backfill_resumes_from_the_last_batch(session):
+    state = migration(session, batch_size=2).backfill(max_batches=1)
+    assert (state.status, state.rows_done, state.last_id) == ("backfilling", 2, 2)
+    assert pending(session) == 2
+
+    state = migration(session, batch_size=2).backfill()
+    assert (state.status, state.rows_done) == ("backfilled", 4)
+    assert pending(session) == 0
+    # the parent-like row without embedding is left alone
+    assert session.scalar(text("SELECT embedding_next FROM contents WHERE id = 4")) is None
+
+
+def test_backfill_catches_up_rows_written_meanwhile(session):
+    migration(session, batch_size=10).backfill(max_batches=1)
+    session.add(CompanyContent(
+        category="faq", subcategory="faq", question="late", content="late", embedding=[0.0] * CompanyContent.embedding.type.dim
+    ))
+    session.commit()
+
+    state = migration(session, batch_size=10).backfill()
+    assert (state.status, state.rows_done) == ("backfilled", 5)
+
+
+def test_swap_needs_a_backfilled_migration(session):
+    with pytest.raises(MigrationError):
+        migration(session).swap()
+
+
+def test_ddl():
+    assert "ADD COLUMN IF NOT EXISTS embedding_next VECTOR(512)" in shadow_column_ddl("small", "vector", 512)[0]
+    statements = swap_ddl("small")
+    assert statements[:2] == [
+        "ALTER TABLE contents RENAME COLUMN embedding TO embedding_previous",
+        "ALTER TABLE contents RENAME COLUMN embedding_next TO embedding",
+    ]
+
+
+@pytest.mark.parametrize("name", ["x; DROP TABLE contents; --", "Small", "a" * 33, ""])
+def test_ddl_rejects_names_that_are_not_identifiers(session, name):
+    for build in (
+        lambda: shadow_column_ddl(name, "vector", 512),
+        lambda: shadow_index_ddl(name, "vector"),
+        lambda: drop_trigger_ddl(name),
+        lambda: EmbeddingMigration(session, name=name),
+    ):
+        with pytest.raises(ValueError):
+            build()
+
+
+def test_switch_moves_to_the_new_model_after_the_swap(session):
+    switch = EmbeddingSwitch("previous", "next", name="small", refresh_interval=0)
+    assert switch.resolve(session) == ("previous", CompanyContent)
+
+    session.get(EmbeddingMigrationState, "small").status = "swapped"
+    session.commit()
+    llm, model = switch.resolve(session)
+    assert llm == "next"
+    assert model is content_model_for("vector", 8)
+    assert model.embedding.type.dim == 8
+    assert model.__tablename__ == CompanyContent.__tablename__
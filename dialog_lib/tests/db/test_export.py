@@ -0,0 +1,85 @@
+import io
+import json
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from click.testing import CliRunner
+
+from dialog_lib.db.export import export_messages, iter_messages
+from dialog_lib.db.shards import DEFAULT_SHARD
+from dialog_lib.manage import cli
+
+
+@pytest.fixture
+def database_url(tmp_path):
+    url = f"sqlite:///{tmp_path / 'export.db'}"
+    engine = create_engine(url)
+    with engine.begin() as connection:
+        connection.execute(text(
+            "CREATE TABLE chat_messages (id INTEGER PRIMARY KEY, parent INTEGER, session_id TEXT, "
+            "message TEXT, timestamp DATETIME)"
+        ))
+        connection.execute(text("CREATE TABLE chats (session_id TEXT PRIMARY KEY, tags TEXT)"))
+        for id, session_id, day in [(1, "acme_s1", 1), (2, "acme_s1", 2), (3, "other_s2", 2), (4, "acme_s3", 3)]:
+            message = json.dumps({"type": "human", "data": {"content": f"message {id}"}})
+            connection.execute(
+                text("INSERT INTO chat_messages VALUES (:id, NULL, :session_id, :message, :timestamp)"),
+                dict(id=id, session_id=session_id, message=message, timestamp=f"2024-05-0{day} 00:00:00.000000"),
+            )
+        connection.execute(text("INSERT INTO chats VALUES ('acme_s1', 'billing, vip'), ('acme_s3', 'support')"))
+    engine.dispose()
+    return url
+
+
+def export(database_url, **filters):
+    output = io.StringIO()
+    export_messages(database_url, output, **filters)
+    return [json.loads(line) for line in output.getvalue().splitlines()]
+
+
+def test_exports_all_messages_in_order(database_url):
+    records = export(database_url)
+    assert [record["id"] for record in records] == [1, 2, 3, 4]
+    assert records[0]["content"] == "message 1"
+    assert records[0]["tags"] == "billing, vip"
+    assert records[0]["timestamp"] == "2024-05-01T00:00:00"
+
+
+def test_filters(database_url):
+    assert [r["id"] for r in export(database_url, since=datetime(2024, 5, 2))] == [2, 3, 4]
+    assert [r["id"] for r in export(database_url, until=datetime(2024, 5, 2))] == [1]
+    assert [r["id"] for r in export(database_url, dataset="acme")] == [1, 2, 4]
+    assert [r["id"] for r in export(database_url, tags=["vip"])] == [1, 2]
+    assert [r["id"] for r in export(database_url, tags=["support", "vip"], since=datetime(2024, 5, 2))] == [2, 4]
+
+
+def test_streams_in_batches(database_url):
+    engine = create_engine(database_url)
+    with engine.connect() as connection:
+        assert [len(batch) for batch in iter_messages(connection, batch_size=3)] == [3, 1]
+    engine.dispose()
+
+
+def test_parquet_needs_a_path(database_url):
+    with pytest.raises(ValueError):
+        export_messages(database_url, "-", format="parquet")
+
+
+def test_cli_exports_a_dataset_from_its_shard(database_url, tmp_path, monkeypatch):
+    class Router:
+        def shard(self, dataset):
+            return "eu" if dataset == "acme" else DEFAULT_SHARD
+
+        def url(self, dataset):
+            return database_url
+
+    monkeypatch.setattr("dialog_lib.db.session.get_shard_router", lambda: Router())
+    output = tmp_path / "acme.jsonl"
+    result = CliRunner().invoke(cli, [
+        "export", "--database-url", f"sqlite:///{tmp_path / 'empty.db'}", "--dataset", "acme", "--output", str(output),
+    ])
+
+    assert result.exit_code == 0, result.output
+    assert [json.loads(line)["id"] for line in output.read_text().splitlines()] == [1, 2, 4]
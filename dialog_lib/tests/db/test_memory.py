@@ -1,4 +1,5 @@
 import os
+import pytest
 import sqlalchemy
 
 from dialog_lib.db import (
@@ -7,7 +8,9 @@ from dialog_lib.db import (
 )
 from dialog_lib.db.memory import CustomPostgresChatMessageHistory
 
-from langchain_core.messages import HumanMessage
+from langchain_core.messages import AIMessage, HumanMessage
+from sqlalchemy import text
+from sqlalchemy.orm import Session
 
 
 def test_models_were_created(db_engine):
@@ -46,4 +49,22 @@ def test_get_messages(db_session):
         database_url=os.environ.get('DATABASE_URL'),
     )
     assert isinstance(messages[0], HumanMessage)
-    assert messages[0].content == "test_message"
\ No newline at end of file
+    assert messages[0].content == "test_message"
+
+def test_sync_history_uses_the_given_session(monkeypatch, tmp_path):
+    monkeypatch.setattr("psycopg.connect", lambda *args, **kwargs: pytest.fail("opened its own connection"))
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'history.db'}")
+    with engine.begin() as connection:
+        connection.execute(text(
+            "CREATE TABLE chat_messages (id INTEGER PRIMARY KEY, parent INTEGER, session_id TEXT, "
+            "message JSON, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)"
+        ))
+    history = CustomPostgresChatMessageHistory(
+        connection_string="postgresql://unused/db", session_id="acme_s1", dbsession=Session(engine)
+    )
+
+    history.add_messages([HumanMessage(content="hi"), AIMessage(content="hello")])
+
+    assert [type(message) for message in history.messages] == [HumanMessage, AIMessage]
+    assert [message.content for message in history.messages] == ["hi", "hello"]
+    assert engine.pool.checkedout() == 0
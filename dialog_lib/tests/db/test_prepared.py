@@ -0,0 +1,68 @@
+import sqlalchemy
+
+from unittest.mock import MagicMock
+from sqlalchemy.orm import Session
+
+from dialog_lib.db.models import CompanyContent
+from dialog_lib.db.prepared import content_columns, contents_search_sql, fetch_messages, messages_sql, search_contents
+from dialog_lib.embeddings import generate
+from dialog_lib.embeddings.retrievers import DialogRetriever
+
+
+def test_contents_search_sql_sends_the_embedding_in_binary():
+    query = contents_search_sql("contents", "embedding", "vector", True, ("id", "content")).as_string(None)
+
+    assert query.startswith('SELECT "id", "content", "embedding" <=> %(embedding)b::vector AS distance')
+    assert '"embedding" <=> %(embedding)b::vector' in query
+    assert "AND dataset = %(dataset)s" in query
+    assert query.endswith("LIMIT %(top)s")
+
+
+def test_contents_search_sql_without_dataset():
+    query = contents_search_sql("contents", "embedding_next", "halfvec", False, ("id",)).as_string(None)
+
+    assert '"embedding_next" <=> %(embedding)b::halfvec' in query
+    assert "dataset =" not in query
+
+
+def test_content_columns_skip_embeddings_and_deferred_columns():
+    columns = content_columns(CompanyContent)
+
+    assert columns[:2] == ("id", "category")
+    assert {"content", "parent_id", "source", "source_key", "content_hash"} <= set(columns)
+    assert "embedding" not in columns
+    assert "search_vector" not in columns
+
+
+def test_messages_sql_orders_by_timestamp():
+    assert messages_sql("chat_messages").as_string(None) == (
+        'SELECT message FROM "chat_messages" WHERE session_id = %s ORDER BY timestamp, id'
+    )
+
+
+def test_other_drivers_fall_back_to_the_orm():
+    engine = sqlalchemy.create_engine("sqlite://")
+
+    with Session(engine) as session:
+        assert search_contents(session, [0.1] * 4, model=CompanyContent) is None
+        assert fetch_messages(session, "chat_messages", "session") is None
+
+
+def test_prepared_statements_are_opt_in(monkeypatch):
+    def prepared_search(*args, **kwargs):
+        raise AssertionError("the prepared statement ran")
+
+    monkeypatch.setattr(generate, "psycopg_connection", lambda session: object())
+    monkeypatch.setattr(generate, "search_contents", prepared_search)
+    monkeypatch.setattr(generate, "generate_embedding", lambda message, embeddings_llm: [0.1] * 1536)
+    session = MagicMock()
+    session.scalars.return_value.all.return_value = []
+    assert generate.get_most_relevant_contents_from_message("refund?", session=session) == []
+
+    calls = []
+    monkeypatch.setattr(
+        "dialog_lib.embeddings.retrievers.get_most_relevant_contents_from_message",
+        lambda query, **kwargs: calls.append(kwargs) or [],
+    )
+    DialogRetriever(session=Session(sqlalchemy.create_engine("sqlite://"))).invoke("refund?")
+    assert calls[0]["prepared"] is True
@@ -0,0 +1,48 @@
+import pytest
+import sqlalchemy
+
+from dialog_lib.db.replicas import ReadYourWrites, ReplicaRouter
+
+
+@pytest.fixture
+def primary():
+    engine = sqlalchemy.create_engine("sqlite://")
+    return lambda: engine
+
+
+def broken_url(tmp_path):
+    return f"sqlite:///{tmp_path}/missing/replica.db"
+
+
+def test_router_round_robins_over_replicas(primary, tmp_path):
+    router = ReplicaRouter([f"sqlite:///{tmp_path}/a.db", f"sqlite:///{tmp_path}/b.db"], primary)
+    urls = [str(router.engine().url) for _ in range(4)]
+    assert [url.rsplit("/", 1)[-1] for url in urls] == ["a.db", "b.db", "a.db", "b.db"]
+
+
+def test_router_skips_unhealthy_replicas_and_falls_back_to_primary(primary, tmp_path):
+    router = ReplicaRouter([broken_url(tmp_path), f"sqlite:///{tmp_path}/ok.db"], primary)
+    assert all(router.engine().url.database.endswith("ok.db") for _ in range(3))
+
+    router = ReplicaRouter([broken_url(tmp_path)], primary)
+    assert router.engine() is primary()
+    assert router.engine() is primary()
+
+    assert ReplicaRouter([], primary).engine() is primary()
+
+
+def test_connection_errors_mark_the_replica_unhealthy(primary, tmp_path):
+    router = ReplicaRouter([f"sqlite:///{tmp_path}/replica.db"], primary, health_check_interval=60)
+    engine = router.engine()
+    with pytest.raises(sqlalchemy.exc.OperationalError):
+        with engine.connect() as connection:
+            connection.execute(sqlalchemy.text("SELECT * FROM missing_table"))
+    assert router.engine() is primary()
+
+
+def test_read_your_writes_window():
+    tracker = ReadYourWrites(window=60)
+    assert not tracker.needs_primary("acme_session")
+    tracker.mark_written("acme_session")
+    assert tracker.needs_primary("acme_session")
+    assert not ReadYourWrites(window=0).needs_primary("acme_session")
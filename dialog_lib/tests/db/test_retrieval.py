@@ -0,0 +1,69 @@
+import pytest
+
+from sqlalchemy.dialects import postgresql
+
+from dialog_lib.db.types import text_search_config
+from dialog_lib.embeddings.generate import (
+    binary_quantized_index_ddl,
+    build_relevant_contents_query,
+    text_search_ddl,
+)
+
+
+def compile_query(query):
+    return str(query.compile(dialect=postgresql.dialect()))
+
+
+def test_vector_search_orders_by_cosine_distance():
+    sql = compile_query(build_relevant_contents_query([0.0] * 1536, top=3, dataset="acme"))
+    assert "ORDER BY contents.embedding <=>" in sql
+    assert "<~>" not in sql
+
+
+def test_binary_search_reranks_hamming_candidates():
+    sql = compile_query(
+        build_relevant_contents_query([0.0] * 1536, top=3, search_mode="binary", candidate_factor=20)
+    )
+    assert "CAST(binary_quantize(contents.embedding) AS BIT(1536)) <~>" in sql
+    assert "ORDER BY contents.embedding <=>" in sql
+    assert "JOIN (SELECT contents.id" in sql
+
+
+def test_binary_index_matches_the_search_expression():
+    assert "(binary_quantize(embedding)::bit(1536)) bit_hamming_ops" in binary_quantized_index_ddl()
+
+
+def test_invalid_search_mode():
+    with pytest.raises(ValueError):
+        build_relevant_contents_query([0.0] * 1536, search_mode="fuzzy")
+
+
+def test_hybrid_search_fuses_vector_and_text_rankings_in_one_statement():
+    sql = compile_query(
+        build_relevant_contents_query(
+            [0.0] * 1536, top=3, dataset="acme", search_mode="hybrid", message="SKU-123",
+            vector_weight=0.3, text_weight=0.7,
+        )
+    )
+    assert sql.startswith("WITH vector_hits AS")
+    assert "contents.search_vector @@ websearch_to_tsquery(CAST(" in sql
+    assert "FULL OUTER JOIN text_hits ON vector_hits.id = text_hits.id" in sql
+    assert "ORDER BY fused.score DESC" in sql
+    assert "contents.content_hash \nFROM contents JOIN" in sql
+
+
+def test_hybrid_search_needs_the_message():
+    with pytest.raises(ValueError):
+        build_relevant_contents_query([0.0] * 1536, search_mode="hybrid")
+
+
+def test_text_search_ddl_adds_generated_column_and_gin_index():
+    alter, index = text_search_ddl()
+    assert "search_vector tsvector GENERATED ALWAYS AS (to_tsvector('simple'::regconfig" in alter
+    assert index == "CREATE INDEX IF NOT EXISTS idx_contents_search_vector ON contents USING gin (search_vector)"
+
+
+def test_text_search_config_must_be_a_name():
+    assert text_search_config("pg_catalog.english") == "pg_catalog.english"
+    with pytest.raises(ValueError):
+        text_search_config("english'::regconfig, content)) STORED; DROP TABLE contents; --")
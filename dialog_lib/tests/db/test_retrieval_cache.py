@@ -0,0 +1,135 @@
+import pytest
+import sqlalchemy
+
+from sqlalchemy.orm import Session
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from dialog_lib.db.models import DatasetVersion, RetrievalCacheEntry
+from dialog_lib.db.versions import bump_dataset_versions, dataset_version
+from dialog_lib.embeddings.cache import LocalCache, RetrievalCache, retrieval_cache_key
+from dialog_lib.embeddings.retrievers import DialogRetriever
+
+
+@pytest.fixture
+def session():
+    engine = sqlalchemy.create_engine("sqlite://")
+    DatasetVersion.__table__.create(engine)
+    RetrievalCacheEntry.__table__.create(engine)
+    with Session(engine) as session:
+        yield session
+
+
+def test_bumping_a_dataset_also_bumps_unfiltered_searches(session):
+    bump_dataset_versions(session, ["acme"])
+    unfiltered = dataset_version(session, None)
+    bump_dataset_versions(session, ["acme", None])
+    session.commit()
+
+    assert dataset_version(session, "acme") == 2
+    assert dataset_version(session, None) > unfiltered
+    assert dataset_version(session, "other") == 0
+
+
+def test_dataset_writes_do_not_lock_a_shared_row(session):
+    bump_dataset_versions(session, ["acme"])
+    bump_dataset_versions(session, ["globex"])
+    session.commit()
+
+    assert session.scalars(sqlalchemy.select(DatasetVersion.dataset).order_by(DatasetVersion.dataset)).all() == [
+        "acme", "globex"
+    ]
+    assert dataset_version(session, None) == 2
+
+
+def test_prune_drops_unfiltered_entries_of_older_versions(session):
+    documents = [Document(page_content="Refunds take five days")]
+    cache = RetrievalCache(shared=True, write_session=lambda: session)
+    old_key = retrieval_cache_key("refund?", None, 0, top_k=3)
+    cache.set(session, old_key, None, 0, documents)
+
+    bump_dataset_versions(session, ["acme"])
+    new_key = retrieval_cache_key("refund?", None, 1, top_k=3)
+    cache.set(session, new_key, None, dataset_version(session, None), documents)
+    cache.prune(session)
+    assert session.scalars(sqlalchemy.select(RetrievalCacheEntry.key)).all() == [new_key]
+
+
+def test_local_cache_evicts_least_recently_used():
+    cache = LocalCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, None, 3)
+
+
+def test_shared_tier_serves_other_workers_and_prunes_old_versions(session):
+    documents = [Document(page_content="Refunds take five days", metadata={"score": 0.9})]
+    old_key = retrieval_cache_key("refund?", "acme", 0, top_k=3)
+    RetrievalCache(shared=True, write_session=lambda: session).set(session, old_key, "acme", 0, documents)
+
+    worker = RetrievalCache(shared=True, write_session=lambda: session)
+    assert worker.get(session, old_key) == documents
+
+    bump_dataset_versions(session, ["acme"])
+    new_key = retrieval_cache_key("refund?", "acme", 1, top_k=3)
+    worker.set(session, new_key, "acme", 1, documents)
+    worker.prune(session)
+    assert session.scalars(sqlalchemy.select(RetrievalCacheEntry.key)).all() == [new_key]
+
+
+def test_shared_entries_are_written_on_the_primary_by_default(session, monkeypatch):
+    datasets = []
+
+    def get_session(dataset=None):
+        datasets.append(dataset)
+        return session
+
+    monkeypatch.setattr("dialog_lib.embeddings.cache.get_session", get_session)
+    replica = Session(sqlalchemy.create_engine("sqlite://"))  # no tables: writing there would fail
+    key = retrieval_cache_key("refund?", "acme", 0, top_k=3)
+
+    RetrievalCache(shared=True).set(replica, key, "acme", 0, [Document(page_content="Refunds take five days")])
+
+    assert datasets == ["acme"]
+    assert session.get(RetrievalCacheEntry, key) is not None
+
+
+def test_retriever_serves_cached_results_until_the_dataset_changes(session, monkeypatch):
+    searches = []
+
+    def search(self, query):
+        searches.append(query)
+        return [Document(page_content=f"result {len(searches)}", metadata={})]
+
+    monkeypatch.setattr(DialogRetriever, "_search", search)
+    retriever = DialogRetriever(session=session, dataset="acme", cache=RetrievalCache())
+
+    first = retriever.invoke("refund?")
+    assert retriever.invoke("refund?") == first
+    assert len(searches) == 1
+
+    bump_dataset_versions(session, ["acme"])
+    session.commit()
+    assert retriever.invoke("refund?")[0].page_content == "result 2"
+
+
+def test_retrievers_of_different_embedding_models_do_not_share_entries(session, monkeypatch):
+    searches = []
+
+    def search(self, query):
+        searches.append(self.embedding_llm.size)
+        return [Document(page_content=f"result {self.embedding_llm.size}", metadata={})]
+
+    monkeypatch.setattr(DialogRetriever, "_search", search)
+    cache = RetrievalCache()
+    small, large = (
+        DialogRetriever(session=session, dataset="acme", cache=cache, embedding_llm=DeterministicFakeEmbedding(size=size))
+        for size in (8, 16)
+    )
+
+    assert small.invoke("refund?")[0].page_content == "result 8"
+    assert large.invoke("refund?")[0].page_content == "result 16"
+    assert small.invoke("refund?")[0].page_content == "result 8"
+    assert searches == [8, 16]
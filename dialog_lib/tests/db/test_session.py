@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+import sqlalchemy
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from dialog_lib.db import session as db_session
+from dialog_lib.db.shards import DEFAULT_SHARD
+from dialog_lib.db.session import (
+    checkout, engine_pool_options, pool_stats, psycopg_pool_options, register_pool_gauges, shutdown,
+)
+from dialog_lib.instrumentation.exporters import PrometheusExporter
+
+
+@pytest.fixture
+def sqlite_database(monkeypatch, tmp_path):
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'pools.db'}")
+    asyncio.run(shutdown())
+    yield
+    asyncio.run(shutdown())
+
+
+def test_pool_options_come_from_the_environment(monkeypatch):
+    monkeypatch.setenv("DATABASE_POOL_SIZE", "20")
+    monkeypatch.setenv("DATABASE_MAX_OVERFLOW", "5")
+    monkeypatch.setenv("DATABASE_POOL_TIMEOUT", "2.5")
+    monkeypatch.setenv("DATABASE_POOL_RECYCLE", "1800")
+    monkeypatch.setenv("DATABASE_POOL_PRE_PING", "true")
+
+    assert engine_pool_options() == {
+        "pool_size": 20, "max_overflow": 5, "pool_timeout": 2.5, "pool_recycle": 1800, "pool_pre_ping": True,
+    }
+    assert psycopg_pool_options() == {"min_size": 20, "max_size": 25, "timeout": 2.5, "max_lifetime": 1800.0}
+
+
+def test_pool_options_default_to_the_drivers_defaults(monkeypatch):
+    for name in ("DATABASE_POOL_SIZE", "DATABASE_MAX_OVERFLOW", "DATABASE_POOL_TIMEOUT", "DATABASE_POOL_RECYCLE"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.delenv("DATABASE_POOL_PRE_PING", raising=False)
+
+    assert engine_pool_options() == {}
+    assert psycopg_pool_options() == {"min_size": 5, "max_size": 15, "timeout": 30.0}
+
+
+def test_checkout_ends_only_the_transaction_it_started():
+    engine = sqlalchemy.create_engine("sqlite://")
+    with Session(engine) as session:
+        with checkout(session):
+            session.execute(text("SELECT 1"))
+        assert not session.in_transaction()
+
+        session.execute(text("SELECT 1"))
+        with checkout(session):
+            session.execute(text("SELECT 1"))
+        assert session.in_transaction()
+
+
+def test_pool_stats_and_gauges_cover_created_pools_only(sqlite_database):
+    assert pool_stats() == {}
+
+    with db_session.get_sync_engine().connect():
+        assert pool_stats()["sync"]["in_use"] == 1
+    assert pool_stats()["sync"]["in_use"] == 0
+
+    exporter = PrometheusExporter()
+    register_pool_gauges(exporter)
+    rendered = exporter.render()
+    assert "db_pool_sync_idle 1" in rendered
+    assert "db_pool_psycopg_waiting 0" in rendered
+
+
+def test_shutdown_disposes_and_forgets_the_pools(sqlite_database):
+    engine = db_session.get_sync_engine()
+    asyncio.run(shutdown())
+
+    assert db_session.get_sync_engine.cache_info().currsize == 0
+    assert db_session.get_sync_engine() is not engine
+
+
+def test_async_sessions_use_the_datasets_shard(sqlite_database, monkeypatch):
+    class Router:
+        def shard(self, dataset):
+            return "eu" if dataset == "acme" else DEFAULT_SHARD
+
+        def url(self, dataset):
+            return "postgresql+psycopg://eu-host/dialog"
+
+    with monkeypatch.context() as patch:
+        patch.setenv("DATABASE_URL", "postgresql+psycopg://default-host/dialog")
+        patch.setattr(db_session, "get_shard_router", lambda: Router())
+
+        assert db_session.get_async_engine("acme").url.host == "eu-host"
+        assert db_session.get_async_engine().url.host == "default-host"
+        assert db_session.get_async_engine("acme") is db_session.get_async_engine("acme")
+        session = asyncio.run(db_session.get_async_session("acme"))
+        assert session.bind.url.host == "eu-host"
@@ -0,0 +1,178 @@
+import datetime
+
+import pytest
+import sqlalchemy
+
+from sqlalchemy import insert, select, text
+from sqlalchemy.orm import Session
+
+from dialog_lib.db.models import Chat, ChatMessages, CompanyContent, DatasetShard, DatasetVersion, ShardMove
+from dialog_lib.db import shards
+from dialog_lib.db.shards import DEFAULT_SHARD, DatasetMove, ShardRouter, parse_shard_urls
+
+
+def create_shard(url):
+    engine = sqlalchemy.create_engine(url)
+    for model in (CompanyContent, DatasetVersion, Chat, DatasetShard, ShardMove):
+        model.__table__.create(engine)
+    with engine.begin() as connection:
+        connection.execute(text(
+            "CREATE TABLE chat_messages (id INTEGER PRIMARY KEY, parent INTEGER, session_id TEXT, "
+            "message JSON, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)"
+        ))
+    return engine
+
+
+@pytest.fixture
+def router(tmp_path):
+    primary = create_shard(f"sqlite:///{tmp_path / 'default.db'}")
+    eu_url = f"sqlite:///{tmp_path / 'eu.db'}"
+    create_shard(eu_url).dispose()
+    router = ShardRouter({"eu": eu_url}, primary=lambda: primary, refresh_interval=0)
+    yield router
+    router.dispose()
+    primary.dispose()
+
+
+def add_message(engine, session_id, content, timestamp=None):
+    row = {"session_id": session_id, "message": {"content": content}}
+    if timestamp is not None:
+        row["timestamp"] = timestamp
+    with Session(engine) as session:
+        session.execute(insert(ChatMessages), [row])
+        session.commit()
+
+
+def seed(engine):
+    with Session(engine) as session:
+        parent = CompanyContent(category="c", subcategory="s", question="q", content="long", dataset="acme")
+        session.add(parent)
+        session.flush()
+        session.add_all([
+            CompanyContent(
+                category="c", subcategory="s", question="q", content=f"chunk {index}", dataset="acme",
+                parent_id=parent.id, chunk_index=index, embedding=[0.1] * CompanyContent.embedding.type.dim,
+            )
+            for index in range(2)
+        ] + [
+            CompanyContent(category="c", subcategory="s", question="q", content="other", dataset="other"),
+            Chat(session_id="acme_s1", tags="vip"),
+            DatasetVersion(dataset="acme", version=7),
+        ])
+        session.commit()
+    add_message(engine, "acme_s1", "hello")
+    add_message(engine, "other_s1", "not moved")
+
+
+def test_parse_shard_urls():
+    assert parse_shard_urls("eu=postgresql://eu/db, us=postgresql://us/db,") == {
+        "eu": "postgresql://eu/db", "us": "postgresql://us/db",
+    }
+    assert parse_shard_urls("") == {}
+    with pytest.raises(ValueError):
+        parse_shard_urls("postgresql://eu/db")
+    with pytest.raises(ValueError):
+        parse_shard_urls("default=postgresql://eu/db")
+
+
+def test_router_sends_unassigned_datasets_to_the_default_shard(router):
+    assert router.shard("acme") == DEFAULT_SHARD
+    assert router.engine(None) is router.primary()
+
+    router.assign("acme", "eu")
+
+    assert router.shard("acme") == "eu"
+    assert router.url("acme").endswith("eu.db")
+    assert router.engine("acme") is router.shard_engine("eu")
+    with pytest.raises(KeyError):
+        router.assign("acme", "us")
+
+
+def test_move_copies_the_dataset_then_switches_it(router):
+    primary = router.primary()
+    seed(primary)
+    move = DatasetMove(router, "acme", "eu", batch_size=1)
+
+    assert move.copy_contents() == 3
+    assert move.copy_messages() == 1
+    # written while the move runs, before the switch
+    add_message(primary, "acme_s1", "still on the source")
+    move.cutover(wait=0)
+
+    assert router.shard("acme") == "eu"
+    with Session(router.shard_engine("eu")) as target:
+        contents = target.scalars(select(CompanyContent).order_by(CompanyContent.id)).all()
+        assert [content.dataset for content in contents] == ["acme"] * 3
+        assert [content.parent_id for content in contents] == [None, contents[0].id, contents[0].id]
+        messages = target.scalars(select(ChatMessages.message).order_by(ChatMessages.id)).all()
+        assert [message["content"] for message in messages] == ["hello", "still on the source"]
+        assert target.get(Chat, "acme_s1").tags == "vip"
+        assert target.get(DatasetVersion, "acme").version > 7
+        assert target.get(ShardMove, "acme").status == "switched"
+
+    assert move.cleanup(wait=0) == {"contents": 3, "messages": 2, "chats": 1}
+    with Session(primary) as source:
+        assert source.scalars(select(CompanyContent.dataset)).all() == ["other"]
+        assert source.scalars(select(ChatMessages.session_id)).all() == ["other_s1"]
+
+
+def test_move_refuses_a_dataset_already_on_the_target(router):
+    router.assign("acme", "eu")
+
+    with pytest.raises(ValueError):
+        DatasetMove(router, "acme", "eu").copy_contents()
+
+
+def test_overlapping_dataset_names_are_refused(router):
+    with Session(router.primary()) as session:
+        session.add_all([
+            CompanyContent(category="c", subcategory="s", question="q", content="c", dataset=dataset)
+            for dataset in ("acme", "acme_eu")
+        ])
+        session.commit()
+    add_message(router.primary(), "acme_eu_s1", "belongs to acme_eu")
+
+    with pytest.raises(ValueError, match="acme_eu"):
+        DatasetMove(router, "acme", "eu")
+    with pytest.raises(ValueError):
+        DatasetMove(router, "acme_eu", "eu")
+    with pytest.raises(ValueError):
+        router.assign("acme_eu", "eu")
+    with Session(router.primary()) as session:
+        assert session.scalars(select(ChatMessages.session_id)).all() == ["acme_eu_s1"]
+
+
+def test_cleanup_catches_up_late_source_writes_in_order(router, monkeypatch):
+    primary = router.primary()
+    seed(primary)
+    DatasetMove(router, "acme", "eu").run(wait=0)
+    at = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) + datetime.timedelta(minutes=1)
+    # a process that didn't refresh yet writes to the source, then one that did to the target
+    add_message(primary, "acme_s1", "late on the source", timestamp=at)
+    add_message(router.shard_engine("eu"), "acme_s1", "on the target", timestamp=at + datetime.timedelta(seconds=1))
+    waits = []
+
+    def sleep(seconds):
+        waits.append(seconds)
+        if len(waits) == 1:
+            add_message(primary, "acme_s1", "later on the source", timestamp=at + datetime.timedelta(seconds=2))
+
+    monkeypatch.setattr(shards.time, "sleep", sleep)
+    # `dialog shards cleanup` builds the move from the dataset's current shard
+    move = DatasetMove(router, "acme", "eu")
+
+    assert move.cleanup(wait=5)["messages"] == 3
+    assert waits == [5, 5]
+    with Session(router.shard_engine("eu")) as target:
+        messages = target.scalars(
+            select(ChatMessages.message).where(ChatMessages.session_id == "acme_s1")
+            .order_by(ChatMessages.timestamp, ChatMessages.id)
+        ).all()
+        assert [message["content"] for message in messages] == [
+            "hello", "late on the source", "on the target", "later on the source",
+        ]
+        assert target.get(ShardMove, "acme").status == "done"
+    with Session(primary) as source:
+        assert source.scalars(select(ChatMessages.session_id)).all() == ["other_s1"]
+    with pytest.raises(ValueError):
+        move.cleanup(wait=0)
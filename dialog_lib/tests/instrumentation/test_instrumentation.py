@@ -0,0 +1,87 @@
+import pytest
+
+from langchain_core.language_models import FakeListChatModel
+from langchain_core.runnables import RunnableLambda
+
+from dialog_lib.instrumentation import (
+    InMemoryExporter,
+    Instrumentation,
+    InstrumentationCallbackHandler,
+    PrometheusExporter,
+    StageRecord,
+)
+from dialog_lib.instrumentation.core import NULL_STAGE
+from dialog_lib.instrumentation.callbacks import token_usage
+
+
+def test_disabled_instrumentation_is_a_no_op():
+    instrumentation = Instrumentation()
+    assert not instrumentation.enabled
+    assert instrumentation.stage("turn") is NULL_STAGE
+    with instrumentation.stage("turn") as record:
+        record.set(rows=1)
+
+
+def test_stage_records_duration_attributes_and_errors():
+    exporter = InMemoryExporter()
+    instrumentation = Instrumentation([exporter])
+
+    with instrumentation.stage("vector_query", search_mode="vector") as record:
+        record.set(rows=3)
+    with pytest.raises(ValueError):
+        with instrumentation.stage("llm"):
+            raise ValueError("boom")
+
+    query, llm = exporter.records
+    assert query.attributes == {"search_mode": "vector", "rows": 3}
+    assert query.duration >= 0 and query.error is None
+    assert llm.error == "ValueError"
+
+
+def test_failing_exporter_does_not_break_the_stage():
+    class BrokenExporter(InMemoryExporter):
+        def export(self, record):
+            raise RuntimeError("exporter down")
+
+    exporter = InMemoryExporter()
+    instrumentation = Instrumentation([BrokenExporter(), exporter])
+    with instrumentation.stage("turn"):
+        pass
+    assert exporter.stages() == ["turn"]
+
+
+def test_prometheus_exporter_renders_histograms_and_counters():
+    exporter = PrometheusExporter(buckets=(0.1, 1.0))
+    exporter.export(StageRecord("retrieval", 0, 0.05, {"rows": 3, "cache_hit": False}))
+    exporter.export(StageRecord("retrieval", 0, 0.5, {"rows": 2, "cache_hit": True}))
+    exporter.export(StageRecord("llm", 0, 2.0, {"tokens": 40}, error="Timeout"))
+
+    text = exporter.render()
+    assert 'dialog_stage_duration_seconds_bucket{stage="retrieval",le="0.1"} 1' in text
+    assert 'dialog_stage_duration_seconds_bucket{stage="retrieval",le="1.0"} 2' in text
+    assert 'dialog_stage_duration_seconds_bucket{stage="llm",le="+Inf"} 1' in text
+    assert 'dialog_stage_duration_seconds_count{stage="retrieval"} 2' in text
+    assert 'dialog_stage_rows_total{stage="retrieval"} 5' in text
+    assert 'dialog_stage_tokens_total{stage="llm"} 40' in text
+    assert 'dialog_cache_hits_total{stage="retrieval"} 1' in text
+    assert 'dialog_cache_misses_total{stage="retrieval"} 1' in text
+    assert 'dialog_stage_errors_total{stage="llm"} 1' in text
+
+
+def test_callback_handler_records_llm_and_named_chains():
+    exporter = InMemoryExporter()
+    handler = InstrumentationCallbackHandler(Instrumentation([exporter]))
+    chain = (RunnableLambda(lambda x: x) | FakeListChatModel(responses=["hi"])).with_config(
+        {"run_name": "AnswerChain"}
+    )
+
+    assert chain.invoke("hello", {"callbacks": [handler]}).content == "hi"
+    assert exporter.stages() == ["llm", "answer"]
+
+
+def test_token_usage_reads_provider_output():
+    class Result:
+        llm_output = {"token_usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15}}
+        generations = []
+
+    assert token_usage(Result()) == {"prompt_tokens": 10, "completion_tokens": 5, "tokens": 15}
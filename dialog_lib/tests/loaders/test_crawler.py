@@ -0,0 +1,133 @@
+import asyncio
+import threading
+import pytest
+import sqlalchemy
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from sqlalchemy.orm import Session
+
+from dialog_lib.db.models import CompanyContent, DatasetVersion
+from dialog_lib.loaders.crawler import aload_webpages, load_webpages, parse_html, parse_sitemap
+from dialog_lib.tests.fixtures.embedding_model import FakeEmbeddingModel
+
+
+PAGES = {
+    "/sitemap.xml": (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+        "<sitemap><loc>{base}/pages.xml</loc></sitemap></sitemapindex>"
+    ),
+    "/pages.xml": (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+        "<url><loc>{base}/a</loc></url><url><loc>{base}/b</loc></url></urlset>"
+    ),
+    "/a": "<html><head><title>Page A</title></head><body><p>{long_text}</p></body></html>",
+    "/b": "<html><head><title>Page B</title><script>ignored()</script></head><body>Short</body></html>",
+}
+
+
+@pytest.fixture
+def http_server():
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in PAGES:
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = PAGES[self.path].format(base=base, long_text="word " * 500).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    base = f"http://127.0.0.1:{server.server_port}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield base
+    server.shutdown()
+
+
+def test_parse_html_drops_scripts():
+    title, text = parse_html(PAGES["/b"])
+    assert title == "Page B"
+    assert text == "Short"
+
+
+def test_parse_sitemap_index():
+    assert parse_sitemap(PAGES["/sitemap.xml"].format(base="http://x")) == ([], ["http://x/pages.xml"])
+
+
+def test_load_webpages_from_sitemap(http_server, sqlite_session):
+    metrics = load_webpages(
+        sitemap_url=f"{http_server}/sitemap.xml",
+        urls=[f"{http_server}/missing"],
+        embeddings_model_instance=FakeEmbeddingModel(),
+        dbsession=sqlite_session,
+        company_id="help-center",
+        chunk_size=500,
+        chunk_overlap=0,
+    )
+
+    contents = sqlite_session.query(CompanyContent).order_by(CompanyContent.id).all()
+    embedded = [content for content in contents if content.embedding is not None]
+    assert metrics.rows == len(embedded)
+    assert {content.question for content in contents} == {"Page A", "Page B"}
+
+    page_a = [content for content in contents if content.question == "Page A" and content.parent_id is None]
+    assert len(page_a) == 1 and page_a[0].embedding is None
+    chunks = [content for content in contents if content.parent_id == page_a[0].id]
+    assert len(chunks) > 1
+    assert all(len(chunk.content) <= 500 for chunk in chunks)
+
+    page_b = [content for content in contents if content.question == "Page B"]
+    assert len(page_b) == 1
+    assert page_b[0].link == f"{http_server}/b"
+    assert page_b[0].dataset == "help-center"
+
+
+def test_load_webpages_defaults_to_the_dataset_session(http_server, sqlite_session, monkeypatch):
+    datasets = []
+
+    def get_session(dataset=None):
+        datasets.append(dataset)
+        return sqlite_session
+
+    monkeypatch.setattr("dialog_lib.loaders.crawler.get_session", get_session)
+    load_webpages(urls=[f"{http_server}/b"], embeddings_model_instance=FakeEmbeddingModel(), company_id="help-center")
+
+    assert datasets == ["help-center"]
+    assert sqlite_session.query(CompanyContent).one().question == "Page B"
+
+
+@pytest.fixture
+def file_session(tmp_path):
+    # the pages are written from a worker thread: an in-memory database is per thread
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'contents.db'}")
+    CompanyContent.__table__.create(engine)
+    DatasetVersion.__table__.create(engine)
+    with Session(engine) as session:
+        yield session
+
+
+def test_load_webpages_inside_a_running_loop(http_server, file_session):
+    async def caller():
+        return load_webpages(
+            urls=[f"{http_server}/b"], embeddings_model_instance=FakeEmbeddingModel(), dbsession=file_session
+        )
+
+    assert asyncio.run(caller()).rows == 1
+    assert file_session.query(CompanyContent).one().question == "Page B"
+
+
+def test_aload_webpages(http_server, file_session):
+    metrics = asyncio.run(aload_webpages(
+        urls=[f"{http_server}/b"], embeddings_model_instance=FakeEmbeddingModel(), dbsession=file_session
+    ))
+
+    assert metrics.rows == 1
+    assert file_session.query(CompanyContent).one().question == "Page B"
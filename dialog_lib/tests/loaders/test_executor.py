@@ -0,0 +1,95 @@
+import asyncio
+import pytest
+
+from dialog_lib.loaders.executor import IngestionExecutor, RateBudget, is_rate_limit_error
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+class SlowEmbeddingModel:
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def aembed_documents(self, texts):
+        if self.failures:
+            self.failures -= 1
+            raise RateLimitError()
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        # later batches finish first to exercise ordered delivery
+        await asyncio.sleep(0.01 / len(texts[0]))
+        self.in_flight -= 1
+        return [[float(len(text))] for text in texts]
+
+
+def test_executor_returns_embeddings_in_order():
+    model = SlowEmbeddingModel()
+    executor = IngestionExecutor(model, concurrency=3, batch_size=2)
+    texts = ["a" * size for size in range(1, 11)]
+    starts = []
+
+    embeddings = executor.embed(texts, on_batch=lambda start, batch: starts.append(start))
+
+    assert embeddings == [[float(size)] for size in range(1, 11)]
+    assert starts == [0, 2, 4, 6, 8]
+    assert model.max_in_flight == 3
+    assert executor.metrics.rows == 10
+    assert executor.metrics.rows_per_second > 0
+
+
+def test_executor_embed_works_inside_a_running_loop():
+    executor = IngestionExecutor(SlowEmbeddingModel(), batch_size=2)
+
+    async def caller():
+        return executor.embed(["a", "bb", "ccc"])
+
+    assert asyncio.run(caller()) == [[1.0], [2.0], [3.0]]
+
+
+def test_executor_retries_rate_limited_batches():
+    model = SlowEmbeddingModel(failures=2)
+    executor = IngestionExecutor(model, concurrency=1, batch_size=5, backoff_base=0.001)
+
+    embeddings = executor.embed(["abc", "de"])
+
+    assert embeddings == [[3.0], [2.0]]
+    assert executor.metrics.retries == 2
+    assert executor.metrics.requests == 3
+
+
+def test_executor_gives_up_after_max_retries():
+    executor = IngestionExecutor(
+        SlowEmbeddingModel(failures=5), max_retries=1, backoff_base=0.001
+    )
+    with pytest.raises(RateLimitError):
+        executor.embed(["abc"])
+
+
+def test_executor_falls_back_to_sync_embed_documents():
+    from dialog_lib.tests.fixtures.embedding_model import FakeEmbeddingModel
+
+    executor = IngestionExecutor(FakeEmbeddingModel(), batch_size=1)
+    embeddings = executor.embed(["a", "b"])
+    assert len(embeddings) == 2
+    assert len(embeddings[0]) == 1536
+
+
+def test_rate_budget_waits_for_window():
+    async def acquire_three():
+        budget = RateBudget(requests_per_minute=2, window=0.05)
+        loop = asyncio.get_running_loop()
+        started_at = loop.time()
+        for _ in range(3):
+            await budget.acquire()
+        return loop.time() - started_at
+
+    assert asyncio.run(acquire_three()) >= 0.04
+
+
+def test_is_rate_limit_error():
+    assert is_rate_limit_error(RateLimitError())
+    assert not is_rate_limit_error(ValueError())
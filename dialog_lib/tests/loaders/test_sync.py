@@ -0,0 +1,126 @@
+import pytest
+
+from dialog_lib.db.models import CompanyContent
+from dialog_lib.loaders.executor import IngestionExecutor
+from dialog_lib.loaders.sync import append_contents, content_hash, row_key, sync_contents
+from dialog_lib.tests.fixtures.embedding_model import FakeEmbeddingModel
+
+
+class CountingEmbeddingModel(FakeEmbeddingModel):
+    embedded = 0
+
+    def embed_documents(self, contents, token_length=1536):
+        self.embedded += len(contents)
+        return super().embed_documents(contents, token_length)
+
+
+def make_record(question, content):
+    return dict(
+        category="csv",
+        subcategory="csv-content",
+        question=question,
+        content=content,
+        source_key=row_key({"question": question, "content": content}),
+        text=f"question: {question}\ncontent: {content}",
+    )
+
+
+def test_row_key_prefers_id_column():
+    assert row_key({"id": "7", "question": "q"}) == "7"
+    assert row_key({"question": "q"}) == "q"
+    assert row_key({"sku": "A1", "question": "q"}, key_column="sku") == "A1"
+
+
+def test_sync_inserts_updates_deletes_and_skips(sqlite_session):
+    model = CountingEmbeddingModel()
+    executor = IngestionExecutor(model)
+    append_contents(
+        sqlite_session, CompanyContent,
+        [make_record("a", "1"), make_record("b", "2"), make_record("c", "3")],
+        source="faq.csv", dataset="acme", executor=executor,
+    )
+    assert model.embedded == 3
+
+    summary = sync_contents(
+        sqlite_session, CompanyContent,
+        [make_record("a", "1"), make_record("b", "changed"), make_record("d", "4")],
+        source="faq.csv", dataset="acme", executor=executor,
+    )
+
+    assert (summary.inserted, summary.updated, summary.deleted, summary.skipped) == (1, 1, 1, 1)
+    assert model.embedded == 5
+    rows = {
+        row.question: row
+        for row in sqlite_session.query(CompanyContent).filter(CompanyContent.dataset == "acme")
+    }
+    assert sorted(rows) == ["a", "b", "d"]
+    assert rows["b"].content == "changed"
+    assert rows["b"].content_hash == content_hash("question: b\ncontent: changed")
+
+
+def test_sync_is_scoped_to_source_and_dataset(sqlite_session):
+    executor = IngestionExecutor(FakeEmbeddingModel())
+    sync_contents(
+        sqlite_session, CompanyContent, [make_record("a", "1")],
+        source="other.csv", dataset="acme", executor=executor,
+    )
+    summary = sync_contents(
+        sqlite_session, CompanyContent, [],
+        source="faq.csv", dataset="acme", executor=executor,
+    )
+    assert summary.deleted == 0
+    assert sqlite_session.query(CompanyContent).count() == 1
+
+
+def test_sync_refuses_to_empty_a_source(sqlite_session):
+    executor = IngestionExecutor(FakeEmbeddingModel())
+    sync_contents(sqlite_session, CompanyContent, [make_record("a", "1")], source="faq.csv", executor=executor)
+
+    with pytest.raises(ValueError):
+        sync_contents(sqlite_session, CompanyContent, [], source="faq.csv", executor=executor)
+    assert sqlite_session.query(CompanyContent).count() == 1
+
+    summary = sync_contents(sqlite_session, CompanyContent, [], source="faq.csv", executor=executor, allow_empty=True)
+    assert summary.deleted == 1
+
+
+def test_sync_adopts_rows_loaded_without_a_source(sqlite_session):
+    model = CountingEmbeddingModel()
+    executor = IngestionExecutor(model)
+    append_contents(
+        sqlite_session, CompanyContent, [make_record("a", "1"), make_record("b", "2"), make_record("z", "9")],
+        source=None, dataset="acme", executor=executor,
+    )
+
+    summary = sync_contents(
+        sqlite_session, CompanyContent, [make_record("a", "1"), make_record("b", "changed")],
+        source="faq.csv", dataset="acme", executor=executor,
+    )
+
+    assert (summary.adopted, summary.inserted, summary.updated, summary.skipped) == (2, 0, 1, 1)
+    assert model.embedded == 4
+    rows = {row.question: row for row in sqlite_session.query(CompanyContent)}
+    assert sorted(rows) == ["a", "b", "z"]
+    assert (rows["a"].source, rows["b"].source, rows["z"].source) == ("faq.csv", "faq.csv", None)
+    assert rows["b"].content == "changed"
+
+    summary = sync_contents(
+        sqlite_session, CompanyContent, [make_record("a", "1"), make_record("b", "changed")],
+        source="faq.csv", dataset="acme", executor=executor,
+    )
+    assert (summary.adopted, summary.skipped) == (0, 2)
+
+
+def test_csv_rows_are_tied_to_the_absolute_path(sqlite_session, tmp_path, monkeypatch):
+    from dialog_lib.loaders.csv import load_csv
+
+    (tmp_path / "faq.csv").write_text("question,content\nrefunds?,five days\n")
+    monkeypatch.chdir(tmp_path)
+    model = FakeEmbeddingModel()
+    load_csv("faq.csv", dbsession=sqlite_session, embeddings_model_instance=model)
+
+    monkeypatch.chdir(tmp_path.parent)
+    summary = load_csv(str(tmp_path / "faq.csv"), dbsession=sqlite_session, embeddings_model_instance=model, sync=True)
+
+    assert (summary.inserted, summary.skipped) == (0, 1)
+    assert sqlite_session.query(CompanyContent.source).scalar() == str(tmp_path / "faq.csv")
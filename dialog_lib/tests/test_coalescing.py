@@ -0,0 +1,156 @@
+import time
+import asyncio
+import threading
+
+import pytest
+
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.language_models import FakeListChatModel
+from langchain_core.prompts import ChatPromptTemplate
+
+from dialog_lib.agents.abstract import AbstractLCEL
+from dialog_lib.coalescing import SingleFlight, normalize_input
+
+
+def test_normalize_input():
+    assert normalize_input("  Is the APP\tdown? ") == "is the app down?"
+
+
+def test_concurrent_calls_share_one_execution():
+    flight, calls = SingleFlight(), []
+
+    def work():
+        calls.append(1)
+        time.sleep(0.2)
+        return object()
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda _: flight.do("key", work), range(8)))
+
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert flight.do("key", lambda: "next") == "next"
+
+
+def test_waiters_get_the_leader_exception():
+    flight, started = SingleFlight(), threading.Event()
+
+    def fail():
+        started.set()
+        time.sleep(0.1)
+        raise RuntimeError("provider down")
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        leader = pool.submit(flight.do, "key", fail)
+        started.wait()
+        waiter = pool.submit(flight.do, "key", lambda: "not called")
+        for future in (leader, waiter):
+            with pytest.raises(RuntimeError):
+                future.result()
+
+
+def test_async_calls_share_one_execution():
+    flight, calls = SingleFlight(), []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def main():
+        return await asyncio.gather(*[flight.ado("key", work) for _ in range(5)])
+
+    assert asyncio.run(main()) == ["answer"] * 5
+    assert len(calls) == 1
+
+
+def test_cancelled_async_leader_doesnt_cancel_waiters():
+    flight, calls = SingleFlight(), []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def main():
+        leader = asyncio.create_task(flight.ado("key", work))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(flight.ado("key", work))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await waiter
+
+    assert asyncio.run(main()) == "answer"
+    assert len(calls) == 1
+
+
+def test_async_call_is_cancelled_once_every_caller_is():
+    flight, cancelled = SingleFlight(), []
+
+    async def work():
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+        return "late"
+
+    async def main():
+        callers = [asyncio.create_task(flight.ado("key", work)) for _ in range(2)]
+        await asyncio.sleep(0)
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0)
+        return await flight.ado("key", lambda: asyncio.sleep(0, "fresh"))
+
+    assert asyncio.run(main()) == "fresh"
+    assert cancelled == [1]
+
+
+class SlowChatModel(FakeListChatModel):
+    calls: int = 0
+
+    def _call(self, *args, **kwargs):
+        self.calls += 1
+        time.sleep(0.2)
+        return super()._call(*args, **kwargs)
+
+
+def test_generation_coalescing_is_keyed_by_prompt():
+    model = SlowChatModel(responses=["It is up"] * 10)
+    agent = AbstractLCEL(model_class=model, embedding_llm=None, config={}, coalesce_generation=True)
+    prompt = ChatPromptTemplate.from_messages([("human", "{input}")])
+
+    def ask(question):
+        return agent.generation_model.invoke(prompt.invoke({"input": question})).content
+
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        answers = list(pool.map(ask, ["is the app down?"] * 4 + ["something else"] * 2))
+
+    assert answers == ["It is up"] * 6
+    assert model.calls == 2
+
+
+def test_retriever_coalesces_normalized_queries(monkeypatch):
+    from sqlalchemy.orm import Session
+    from langchain_core.documents import Document
+    from dialog_lib.embeddings.retrievers import DialogRetriever
+
+    calls = []
+
+    def retrieve(self, query):
+        calls.append(query)
+        time.sleep(0.2)
+        return [Document(page_content="Status page: all systems operational")]
+
+    monkeypatch.setattr(DialogRetriever, "_retrieve", retrieve)
+    retriever = DialogRetriever(session=Session(), dataset="acme", coalesce=True)
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(retriever.invoke, ["Is the app down?", "is the app  down?"] * 2))
+
+    assert len(calls) == 1
+    assert all(result == results[0] for result in results)
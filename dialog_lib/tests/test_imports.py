@@ -0,0 +1,78 @@
+import os
+import sys
+import json
+import subprocess
+
+
+# Measured at 0.04s and 1.4s (most of it SQLAlchemy, pgvector and psycopg
+# for the models) with some headroom, so they catch eager provider or loader
+# imports, not noise.
+CLI_IMPORT_BUDGET = 0.2
+PACKAGE_IMPORT_BUDGET = 2.5
+
+SCRIPT = """
+import json, sys, time
+
+started_at = time.perf_counter()
+from dialog_lib.manage import cli
+cli_import = time.perf_counter() - started_at
+
+try:
+    cli(["--help"], standalone_mode=False)
+except SystemExit:
+    pass
+cli_modules = [name for name in ("langchain_openai", "langchain_anthropic", "gspread", "sqlalchemy", "psycopg")
+               if name in sys.modules]
+
+import dialog_lib.agents
+agents_modules = [name for name in ("numpy", "pgvector", "psycopg", "sqlalchemy") if name in sys.modules]
+
+started_at = time.perf_counter()
+import dialog_lib.agents, dialog_lib.db, dialog_lib.db.utils, dialog_lib.loaders.csv, dialog_lib.loaders.web
+package_import = time.perf_counter() - started_at
+
+from dialog_lib.db.session import get_sync_engine, _async_engines
+print(json.dumps({
+    "cli_import": cli_import,
+    "cli_modules": cli_modules,
+    "agents_modules": agents_modules,
+    "package_import": package_import,
+    "loaders": [name for name in ("langchain_community.document_loaders",) if name in sys.modules],
+    "providers": [name for name in ("langchain_openai", "langchain_anthropic") if name in sys.modules],
+    "engines": get_sync_engine.cache_info().currsize + len(_async_engines),
+}))
+"""
+
+
+def run_import_script():
+    env = {key: value for key, value in os.environ.items() if key != "DATABASE_URL"}
+    output = subprocess.run(
+        [sys.executable, "-c", SCRIPT], env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def test_imports_do_no_database_or_provider_work():
+    result = run_import_script()
+
+    assert result["cli_modules"] == []
+    assert result["agents_modules"] == []
+    assert result["loaders"] == []
+    assert result["providers"] == []
+    assert result["engines"] == 0
+    assert result["cli_import"] < CLI_IMPORT_BUDGET
+    assert result["package_import"] < PACKAGE_IMPORT_BUDGET
+
+
+def test_provider_agents_load_on_access():
+    import dialog_lib.agents as agents
+    from dialog_lib.agents.anthropic import DialogAnthropic
+
+    assert agents.DialogAnthropic is DialogAnthropic
+
+
+def test_base_agents_load_on_access():
+    import dialog_lib.agents as agents
+    from dialog_lib.agents.abstract import AbstractLCEL
+
+    assert agents.AbstractLCEL is AbstractLCEL
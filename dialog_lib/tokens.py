@@ -0,0 +1,6 @@
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate (~4 characters per token), used for rate budgeting
+    and when no tokenizer is available.
+    """
+    return max(1, len(text) // 4)